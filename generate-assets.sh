@@ -1,4 +1,5 @@
 #!/bin/bash
 rm -fv **/*.0.svg
+# Pack the generated themes into arcticons-$1.tar.xz, .tar.zst and .tar.gz
+python3 scripts/archive_themes.py --name "arcticons-$1" || exit 1
 7z a arcticons-$1.7z arcticons-dark arcticons-light
-tar cf arcticons-$1.tar.gz arcticons-dark arcticons-light
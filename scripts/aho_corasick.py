@@ -0,0 +1,68 @@
+"""Find many substrings in a text in one pass with the Aho-Corasick algorithm."""
+
+from __future__ import annotations
+
+from collections import deque
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+class AhoCorasick:
+    """An automaton which finds all patterns contained in a text.
+
+    The time to search a text only depends on its length and the number of
+    matches, not on the number of patterns.
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        """Build the automaton of the patterns, empty patterns are ignored."""
+        self.patterns: list[str] = []
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[int]] = [[]]
+
+        for pattern in dict.fromkeys(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(len(self.patterns))
+            self.patterns.append(pattern)
+
+        # Breadth first, so the fail state of a state is always done before it
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] += self._output[fail]
+
+    def find(self, text: str) -> set[str]:
+        """Get the patterns which are contained in the text."""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found: set[int] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return {self.patterns[index] for index in found}
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+"""Pack the generated themes into reproducible release archives.
+
+The themes are read once, as a single tar stream which is compressed into
+every format at the same time. The entries are sorted and get a fixed owner,
+mode and mtime, so the same themes always give the same archives. Symlinks
+are kept, files with the same content are stored once and hard linked.
+"""
+
+# Example usage:
+#   python scripts/archive_themes.py --name arcticons-1.0
+#   python scripts/archive_themes.py --name arcticons-1.0 --format zst --format gz
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+import hashlib
+import io
+import logging
+import os
+from pathlib import Path
+from shutil import which
+import subprocess  # noqa: S404
+import sys
+import tarfile
+import tempfile
+import tomllib
+from typing import IO, TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+LOGGER = logging.getLogger("archive_themes")
+
+# The compressors of the formats, xz and zstd use all CPUs. The gzip archive
+# is kept for the tools which download the older releases, -n leaves the name
+# and time out of its header.
+COMPRESSORS = {
+    "xz": ["xz", "-T0", "-9", "-c"],
+    "zst": ["zstd", "-T0", "-19", "-q", "-c"],
+    "gz": ["gzip", "-n", "-9", "-c"],
+}
+
+
+def default_mtime() -> int:
+    """Get the mtime of the entries, SOURCE_DATE_EPOCH if it is set."""
+    return int(os.environ.get("SOURCE_DATE_EPOCH", "0"))
+
+
+def _skipped(name: str) -> bool:
+    """Check if a file isn't part of the theme.
+
+    Hidden files are left by the build, like the build manifest, and .0.svg
+    files by crashes of Inkscape.
+    """
+    return name.startswith(".") or name.endswith(".0.svg")
+
+
+def _walk(folder: Path) -> Iterator[Path]:
+    """Walk a folder in sorted order, without following symlinks."""
+    for dir_entry in sorted(os.scandir(folder), key=lambda item: item.name):
+        if _skipped(dir_entry.name):
+            continue
+        yield Path(dir_entry.path)
+        if dir_entry.is_dir(follow_symlinks=False):
+            yield from _walk(Path(dir_entry.path))
+
+
+def write_tar(
+    fileobj: IO[bytes] | _Archives, destinations: list[Path], mtime: int
+) -> int:
+    """Write the destinations to a tar stream, returns the number of entries.
+
+    The entries are named after the folders of the destinations.
+    """
+    first_files: dict[str, str] = {}
+    entries = 0
+    with tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for destination in sorted(destinations, key=lambda item: item.name):
+            for path in [destination, *_walk(destination)]:
+                info = tarfile.TarInfo(
+                    destination.name
+                    if path == destination
+                    else f"{destination.name}/{path.relative_to(destination)}"
+                )
+                info.mtime = mtime
+                data = None
+                if path.is_symlink():
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = str(path.readlink())
+                    info.mode = 0o777
+                elif path.is_dir():
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                else:
+                    data = path.read_bytes()
+                    info.mode = 0o644
+                    digest = hashlib.sha256(data).hexdigest()
+                    if digest in first_files:
+                        info.type = tarfile.LNKTYPE
+                        info.linkname = first_files[digest]
+                        data = None
+                    else:
+                        first_files[digest] = info.name
+                        info.size = len(data)
+                tar.addfile(info, None if data is None else io.BytesIO(data))
+                entries += 1
+    return entries
+
+
+class _Output(NamedTuple):
+    """An archive which is being written to a temporary file."""
+
+    archive: Path
+    tmp_file: Path
+    fp: IO[bytes]
+    process: subprocess.Popen[bytes]
+
+
+class _Archives:
+    """Compress a stream into an archive of every format at the same time."""
+
+    def __init__(self, name: Path, formats: list[str]) -> None:
+        self.outputs: list[_Output] = []
+        for archive_format in formats:
+            archive = name.with_name(f"{name.name}.tar.{archive_format}")
+            command = COMPRESSORS[archive_format]
+            if which(command[0]) is None:
+                LOGGER.warning(
+                    "%s was not detected, not creating %s.", command[0], archive
+                )
+                continue
+            fd, tmp_name = tempfile.mkstemp(
+                dir=archive.parent, prefix=f".{archive.name}."
+            )
+            fp = os.fdopen(fd, "wb")
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=fp)  # noqa: S603
+            self.outputs.append(_Output(archive, Path(tmp_name), fp, process))
+
+    def write(self, data: bytes) -> int:
+        """Pass the data to the compressors."""
+        for output in self.outputs:
+            if output.process.stdin is not None:
+                _ = output.process.stdin.write(data)
+        return len(data)
+
+    def finish(self, *, success: bool) -> list[Path]:
+        """Wait for the compressors and move the archives into place.
+
+        Without ``success`` the temporary files are removed.
+        """
+        for output in self.outputs:
+            if output.process.stdin is not None:
+                output.process.stdin.close()
+        for output in self.outputs:
+            if output.process.wait() != 0:
+                LOGGER.error("Couldn't compress %s.", output.archive)
+                success = False
+            output.fp.close()
+
+        archives: list[Path] = []
+        for output in self.outputs:
+            if not success:
+                output.tmp_file.unlink()
+                continue
+            output.tmp_file.chmod(0o644)
+            output.tmp_file.replace(output.archive)
+            archives.append(output.archive)
+        return archives
+
+
+def write_archives(
+    destinations: list[Path],
+    name: Path,
+    formats: list[str] | None = None,
+    mtime: int | None = None,
+) -> list[Path]:
+    """Pack the destinations into an archive of every format.
+
+    The archives are named like ``name.tar.xz``. Returns the archives, they
+    are only written if the compression of all formats succeeded. The xz
+    archive is the release archive, so nothing is written without xz.
+    """
+    formats = formats or list(COMPRESSORS)
+    if "xz" in formats and which("xz") is None:
+        LOGGER.error("xz was not detected, can't create %s.tar.xz.", name)
+        return []
+    archives = _Archives(name, formats)
+    success = False
+    try:
+        entries = write_tar(
+            archives,
+            destinations,
+            default_mtime() if mtime is None else mtime,
+        )
+        success = True
+    finally:
+        written = archives.finish(success=success)
+    for archive in written:
+        LOGGER.info(
+            "Wrote %s with %d entries, %.1f KiB.",
+            archive,
+            entries,
+            archive.stat().st_size / 1024,
+        )
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = ArgumentParser()
+    _ = parser.add_argument(
+        "-c",
+        "--config-file",
+        help="The config file, the destinations with archive=true are packed.",
+        type=Path,
+        default=Path("generate-icons.toml"),
+    )
+    _ = parser.add_argument(
+        "--name",
+        help="The name of the archives, without the extension.",
+        type=Path,
+        required=True,
+    )
+    _ = parser.add_argument(
+        "--format",
+        help="The format to write, can be repeated. All formats are written by "
+        "default.",
+        choices=COMPRESSORS.keys(),
+        action="append",
+        dest="formats",
+    )
+    _ = parser.add_argument(
+        "--mtime",
+        help="The mtime of the entries, SOURCE_DATE_EPOCH or 0 by default.",
+        type=int,
+    )
+    args = parser.parse_args()
+
+    config = tomllib.loads(args.config_file.read_text(encoding="utf8"))
+    archive_destinations = [
+        Path(section) for section, entry in config.items() if entry["archive"]
+    ]
+    if not archive_destinations:
+        LOGGER.error("No destination in %s has archive=true.", args.config_file)
+        sys.exit(1)
+    if not write_archives(archive_destinations, args.name, args.formats, args.mtime):
+        sys.exit(1)
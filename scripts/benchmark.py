@@ -0,0 +1,586 @@
+#!/usr/bin/python3
+"""Benchmark the generation, validation and search scripts.
+
+The corpora are synthesized, so the benchmark runs offline and is
+reproducible. Every stage runs in a fresh process, which reports its run time
+and peak memory. The results can be saved as JSON and compared between commits.
+"""
+
+# Example usage:
+#   python scripts/benchmark.py --json before.json
+#   python scripts/benchmark.py --compare before.json --max-regression 10
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import multiprocessing
+from operator import itemgetter
+import os
+from pathlib import Path
+import platform
+import random
+import resource
+from shutil import rmtree, which
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, NamedTuple, TypedDict
+
+import yaml
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+LOGGER = logging.getLogger("benchmark")
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+WORDS = (
+    "audio", "browser", "calc", "chat", "clock", "code", "daemon", "disk",
+    "editor", "files", "game", "graph", "image", "mail", "maps", "media",
+    "monitor", "music", "notes", "office", "paint", "photo", "player", "reader",
+    "record", "remote", "scan", "settings", "shell", "steam", "studio", "sync",
+    "system", "terminal", "text", "tools", "video", "viewer", "weather", "web",
+)  # fmt: skip
+
+CONTEXTS = {
+    "apps": "Applications",
+    "actions": "Actions",
+    "categories": "Categories",
+    "devices": "Devices",
+    "mimetypes": "MimeTypes",
+    "places": "Places",
+    "status": "Status",
+}
+
+SIZES = ("16x16", "22x22", "24x24", "32x32", "48x48", "scalable", "symbolic")
+
+# Inkscape replacement which copies the files, it speaks just enough of the
+# shell protocol for generate_icons
+INKSCAPE_STUB = """#!{python}
+import shutil, sys
+if "--version" in sys.argv:
+    print("Inkscape stub")
+    sys.exit(0)
+sys.stdout.write("> ")
+sys.stdout.flush()
+for line in sys.stdin:
+    src = dest = None
+    for action in line.strip().split(";"):
+        if action == "quit":
+            sys.exit(0)
+        if action.startswith("file-open:"):
+            src = action.removeprefix("file-open:")
+        if action.startswith("export-filename:"):
+            dest = action.removeprefix("export-filename:")
+        if action == "export-do":
+            shutil.copy(src, dest)
+    sys.stdout.write("> ")
+    sys.stdout.flush()
+"""
+
+
+class CorpusSize(NamedTuple):
+    """The size of the synthesized corpora."""
+
+    icons: int = 200
+    keys: int = 10_000
+    aliases: int = 3
+    themes: int = 3
+    theme_icons: int = 5_000
+    desktop_files: int = 2_000
+
+
+class StageResult(TypedDict):
+    """The measurements of a stage."""
+
+    items: int
+    seconds: float
+    items_per_second: float
+    peak_rss_kib: int
+
+
+class Report(TypedDict):
+    """The results of a benchmark run."""
+
+    python: str
+    corpus: dict[str, int]
+    stages: dict[str, StageResult]
+
+
+def _icon_name(rng: random.Random, index: int) -> str:
+    return f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{index}"
+
+
+def _source_svg(rng: random.Random) -> str:
+    """Build a source icon in the style of Arcticons."""
+    shapes = []
+    for _ in range(rng.randint(3, 12)):
+        kind = rng.choice(("path", "line", "circle", "rect", "polyline"))
+        x, y = rng.uniform(4, 44), rng.uniform(4, 44)
+        if kind == "path":
+            shapes.append(
+                f'<path class="a" d="m{x:.4f},{y:.4f}c{rng.uniform(-9, 9):.4f},'
+                f"{rng.uniform(-9, 9):.4f},{rng.uniform(-9, 9):.4f},"
+                f"{rng.uniform(-9, 9):.4f},{rng.uniform(-9, 9):.4f},"
+                f'{rng.uniform(-9, 9):.4f}s-2.5,4,3.5,1Z"/>'
+            )
+        elif kind == "line":
+            shapes.append(
+                f'<line class="a" x1="{x:.4f}" y1="{y:.4f}" '
+                f'x2="{rng.uniform(4, 44):.4f}" y2="{rng.uniform(4, 44):.4f}"/>'
+            )
+        elif kind == "circle":
+            radius = rng.choice((".75", f"{rng.uniform(1, 8):.4f}"))
+            shapes.append(f'<circle class="a" cx="{x:.4f}" cy="{y:.4f}" r="{radius}"/>')
+        elif kind == "rect":
+            shapes.append(
+                f'<rect class="a" x="{x:.4f}" y="{y:.4f}" width="{rng.uniform(2, 9):.4f}"'
+                f' height="{rng.uniform(2, 9):.4f}" rx="1.5"/>'
+            )
+        else:
+            points = " ".join(
+                f"{rng.uniform(4, 44):.4f} {rng.uniform(4, 44):.4f}" for _ in range(4)
+            )
+            shapes.append(f'<polyline class="a" points="{points}"/>')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><svg id="b" '
+        'xmlns="http://www.w3.org/2000/svg" viewBox="0 0 48 48"><defs><style>'
+        ".a{fill:none;stroke:#000;stroke-linecap:round;stroke-linejoin:round;}"
+        f"</style></defs>{''.join(shapes)}</svg>"
+    )
+
+
+def _mapping(rng: random.Random, keys: list[str], aliases: int) -> dict[str, list[str]]:
+    """Build a valid mapping, every key has up to ``aliases`` extra values."""
+    mapping: dict[str, list[str]] = {}
+    for index, key in enumerate(sorted(keys)):
+        values = {f"apps/{key}"}
+        for alias in range(rng.randint(0, aliases)):
+            context = rng.choice(list(CONTEXTS))
+            values.add(f"{context}/{rng.choice(WORDS)}.{index}.{alias}")
+        mapping[key] = sorted(values)
+    return mapping
+
+
+def synthesize_generate(folder: Path, size: CorpusSize, rng: random.Random) -> None:
+    """Synthesize the source icons, mapping and config of generate_icons."""
+    icons = [_icon_name(rng, index) for index in range(size.icons)]
+    (folder / "icons").mkdir(parents=True)
+    for icon in icons:
+        (folder / "icons" / f"{icon}.svg").write_text(_source_svg(rng), encoding="utf8")
+    with (folder / "mapping.yaml").open("w", encoding="utf8") as yaml_fp:
+        yaml.safe_dump(_mapping(rng, icons, size.aliases), yaml_fp)
+    (folder / "index.theme").write_bytes((REPO_ROOT / "index.theme").read_bytes())
+    (folder / "config.toml").write_text(
+        "[out]\n"
+        'name="Benchmark"\n'
+        'comment="Benchmark"\n'
+        'inherits="hicolor"\n'
+        "overwrite=false\n"
+        "archive=false\n"
+        'src_color="#000"\n'
+        'color="#fff"\n'
+        "line_weight=2\n"
+        'src_paths=["icons"]\n',
+        encoding="utf8",
+    )
+    (folder / "bin").mkdir()
+    (folder / "bin" / "inkscape").write_text(
+        INKSCAPE_STUB.format(python=sys.executable), encoding="utf8"
+    )
+    (folder / "bin" / "inkscape").chmod(0o755)
+
+
+def synthesize_validate(folder: Path, size: CorpusSize, rng: random.Random) -> None:
+    """Synthesize a large mapping file."""
+    folder.mkdir(parents=True)
+    keys = [_icon_name(rng, index) for index in range(size.keys)]
+    with (folder / "mapping.yaml").open("w", encoding="utf8") as yaml_fp:
+        yaml.safe_dump(_mapping(rng, keys, size.aliases), yaml_fp)
+
+
+def synthesize_search(folder: Path, size: CorpusSize, rng: random.Random) -> None:
+    """Synthesize icon themes and desktop files like in /usr/share."""
+    for theme in range(size.themes):
+        theme_dir = folder / "icons" / f"theme{theme}"
+        directories = [
+            f"{size_dir}/{context}" for size_dir in SIZES for context in CONTEXTS
+        ]
+        theme_dir.mkdir(parents=True)
+        index_theme = [
+            "[Icon Theme]",
+            f"Name=Theme {theme}",
+            f"Directories={','.join(directories)}",
+            "",
+        ]
+        for directory in directories:
+            (theme_dir / directory).mkdir(parents=True)
+            index_theme += [
+                f"[{directory}]",
+                f"Context={CONTEXTS[directory.split('/')[1]]}",
+                "Type=Scalable",
+                "",
+            ]
+        (theme_dir / "index.theme").write_text("\n".join(index_theme), encoding="utf8")
+        for index in range(size.theme_icons):
+            directory = rng.choice(directories)
+            suffix = "-symbolic" if directory.startswith("symbolic") else ""
+            (theme_dir / directory / f"{_icon_name(rng, index)}{suffix}.svg").touch()
+
+    (folder / "applications").mkdir(parents=True)
+    for index in range(size.desktop_files):
+        name = _icon_name(rng, index)
+        (folder / "applications" / f"org.example.{name}.desktop").write_text(
+            "[Desktop Entry]\n"
+            "Type=Application\n"
+            f"Name={name.replace('_', ' ').title()}\n"
+            f"Name[de]={name.title()}\n"
+            f"Comment={rng.choice(WORDS)} {rng.choice(WORDS)} application\n"
+            f"Exec={name} %U\n"
+            f"Icon=org.example.{name}\n"
+            "Categories=Utility;\n",
+            encoding="utf8",
+        )
+
+
+def synthesize_duplicates(folder: Path, size: CorpusSize, rng: random.Random) -> None:
+    """Synthesize two icon folders, half of the icons are in both."""
+    for subfolder in ("src", "target"):
+        (folder / subfolder).mkdir(parents=True)
+    for index in range(size.icons):
+        name = f"{_icon_name(rng, index)}.svg"
+        svg = _source_svg(rng)
+        (folder / "src" / name).write_text(svg, encoding="utf8")
+        if index % 2:
+            # Every fourth duplicate has a different content
+            if index % 8 == 1:
+                svg = _source_svg(rng)
+            (folder / "target" / name).write_text(svg, encoding="utf8")
+
+
+def synthesize(folder: Path, size: CorpusSize, seed: int) -> None:
+    """Synthesize all corpora."""
+    rng = random.Random(seed)  # noqa: S311
+    synthesize_generate(folder / "generate", size, rng)
+    synthesize_validate(folder / "validate", size, rng)
+    synthesize_search(folder / "search", size, rng)
+    synthesize_duplicates(folder / "duplicates", size, rng)
+
+
+def _timed(function: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    _ = function()
+    return time.perf_counter() - start
+
+
+def bench_generate(corpus: Path, options: dict[str, str | int]) -> tuple[int, float]:
+    """Generate the icons of the synthesized mapping."""
+    folder = corpus / "generate"
+    if options["inkscape"] == "stub" or not which("inkscape"):
+        os.environ["PATH"] = f"{folder / 'bin'}{os.pathsep}{os.environ['PATH']}"
+    os.chdir(folder)
+    rmtree(folder / "out", ignore_errors=True)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    import generate_icons  # noqa: PLC0415
+    from icon_mapping import load_mapping  # noqa: PLC0415
+
+    items = len(load_mapping(Path("mapping.yaml"), None))
+    return items, _timed(
+        lambda: generate_icons.main(
+            Path("config.toml"),
+            jobs=int(options["jobs"]),
+            options=generate_icons.BuildOptions(
+                symbolic_engine=str(options["symbolic_engine"])
+            ),
+        )
+    )
+
+
+def bench_validate(corpus: Path, _: dict[str, str | int]) -> tuple[int, float]:
+    """Validate the synthesized mapping."""
+    import validate_mapping  # noqa: PLC0415
+
+    mapping_file = corpus / "validate" / "mapping.yaml"
+    items = mapping_file.read_text(encoding="utf8").count(":\n")
+    return items, _timed(lambda: validate_mapping.validate_mapping(mapping_file))
+
+
+def _patch_search_dirs(corpus: Path) -> None:
+    import icon_search  # noqa: PLC0415
+
+    icon_search.APPLICATION_DIRS = [corpus / "search" / "applications"]
+    icon_search.ICON_THEME_DIRS = [corpus / "search" / "icons"]
+    icon_search.LOCAL_HICOLOR_DIR = corpus / "search" / "hicolor"
+    icon_search.INDEX_FILE = corpus / "search" / "index"
+
+
+def _build_search_index() -> None:
+    """Save the index of the search folders, so every timed run is a warm search.
+
+    It's built by its own IconIndex, so the timed run still loads it from disk.
+    """
+    from icon_index import IconIndex  # noqa: PLC0415
+    import icon_search  # noqa: PLC0415
+
+    index = IconIndex(icon_search.INDEX_FILE)
+    _ = index.icon_dirs(
+        icon_search.ICON_THEME_DIRS,
+        icon_search.LOCAL_HICOLOR_DIR,
+        icon_search.ICON_TYPES,
+    )
+    _ = index.desktop_entries(icon_search.APPLICATION_DIRS)
+
+
+def bench_search_icons(corpus: Path, _: dict[str, str | int]) -> tuple[int, float]:
+    """Search the synthesized icon themes."""
+    import icon_search  # noqa: PLC0415
+
+    _patch_search_dirs(corpus)
+    _build_search_index()
+    items = sum(1 for _ in (corpus / "search" / "icons").glob("*/*/*/*"))
+    return items, _timed(lambda: [icon_search.search_icons(word) for word in WORDS[:5]])
+
+
+def bench_search_icons_cold(corpus: Path, _: dict[str, str | int]) -> tuple[int, float]:
+    """Search the synthesized icon themes like search-icons, without an index."""
+    import icon_search  # noqa: PLC0415
+
+    _patch_search_dirs(corpus)
+    icon_search.INDEX_FILE = None
+    items = sum(1 for _ in (corpus / "search" / "icons").glob("*/*/*/*"))
+    return items, _timed(lambda: [icon_search.search_icons(word) for word in WORDS[:5]])
+
+
+def bench_search_desktop(corpus: Path, _: dict[str, str | int]) -> tuple[int, float]:
+    """Search the names of the synthesized desktop files."""
+    import icon_search  # noqa: PLC0415
+
+    _patch_search_dirs(corpus)
+    _build_search_index()
+    items = sum(1 for _ in (corpus / "search" / "applications").iterdir())
+    return items, _timed(
+        lambda: [icon_search.search_desktop_files(word) for word in WORDS[:5]]
+    )
+
+
+def bench_deep_search_desktop(
+    corpus: Path, _: dict[str, str | int]
+) -> tuple[int, float]:
+    """Search the content of the synthesized desktop files."""
+    import icon_search  # noqa: PLC0415
+
+    _patch_search_dirs(corpus)
+    _build_search_index()
+    items = sum(1 for _ in (corpus / "search" / "applications").iterdir())
+    return items, _timed(lambda: icon_search.deep_search_desktop_files(WORDS[0]))
+
+
+def bench_duplicates(corpus: Path, _: dict[str, str | int]) -> tuple[int, float]:
+    """Check the synthesized icon folders for duplicates."""
+    import check_icon_duplicates  # noqa: PLC0415
+
+    logging.getLogger().setLevel(logging.ERROR)
+    folder = corpus / "duplicates"
+    items = sum(1 for _ in (folder / "src").iterdir())
+    with Path(os.devnull).open("w", encoding="utf8") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            seconds = _timed(
+                lambda: check_icon_duplicates.main(folder / "src", folder / "target")
+            )
+        finally:
+            sys.stdout = stdout
+    return items, seconds
+
+
+STAGES: dict[str, Callable[[Path, dict[str, str | int]], tuple[int, float]]] = {
+    "generate": bench_generate,
+    "validate": bench_validate,
+    "search-icons": bench_search_icons,
+    "search-icons-cold": bench_search_icons_cold,
+    "search-desktop": bench_search_desktop,
+    "deep-search-desktop": bench_deep_search_desktop,
+    "duplicates": bench_duplicates,
+}
+
+
+def run_stage(stage: str, corpus: Path, options: dict[str, str | int]) -> StageResult:
+    """Run a stage, this is called in a fresh process."""
+    items, seconds = STAGES[stage](corpus, options)
+    peak_rss_kib = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return StageResult(
+        items=items,
+        seconds=seconds,
+        items_per_second=items / seconds if seconds else 0.0,
+        peak_rss_kib=peak_rss_kib,
+    )
+
+
+def benchmark(
+    corpus: Path, stages: list[str], options: dict[str, str | int], repeat: int
+) -> dict[str, StageResult]:
+    """Run the stages, the fastest of ``repeat`` runs is reported."""
+    results: dict[str, StageResult] = {}
+    context = multiprocessing.get_context("spawn")
+    for stage in stages:
+        runs: list[StageResult] = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(run_stage, stage, corpus, options).result())
+        results[stage] = min(runs, key=itemgetter("seconds"))
+        results[stage]["peak_rss_kib"] = max(run["peak_rss_kib"] for run in runs)
+        LOGGER.info("%s: %.3fs", stage, results[stage]["seconds"])
+    return results
+
+
+def print_report(report: Report, baseline: Report | None) -> dict[str, float]:
+    """Print the results, returns the time changes to the baseline in percent.
+
+    The changes are only printed for stages which are in the baseline.
+    """
+    print(f"{'stage':<20} {'items':>8} {'seconds':>9} {'items/s':>10} {'peak RSS':>10}")
+    changes: dict[str, float] = {}
+    for stage, result in report["stages"].items():
+        line = (
+            f"{stage:<20} {result['items']:>8} {result['seconds']:>9.3f}"
+            f" {result['items_per_second']:>10.1f}"
+            f" {result['peak_rss_kib'] / 1024:>7.1f}MiB"
+        )
+        if baseline is not None and stage in baseline["stages"]:
+            old = baseline["stages"][stage]
+            time_change = (result["seconds"] / old["seconds"] - 1) * 100
+            rss_change = (result["peak_rss_kib"] / old["peak_rss_kib"] - 1) * 100
+            line += f"  time {time_change:+.1f}%  RSS {rss_change:+.1f}%"
+            changes[stage] = time_change
+        print(line)
+    return changes
+
+
+if __name__ == "__main__":
+    defaults = CorpusSize()
+    parser = ArgumentParser()
+    _ = parser.add_argument(
+        "--stage",
+        help="The stage to run, can be repeated. All stages run by default.",
+        choices=STAGES.keys(),
+        action="append",
+    )
+    _ = parser.add_argument(
+        "--icons", help="Number of source icons.", type=int, default=defaults.icons
+    )
+    _ = parser.add_argument(
+        "--keys", help="Number of mapping keys.", type=int, default=defaults.keys
+    )
+    _ = parser.add_argument(
+        "--aliases",
+        help="Maximum number of extra values per mapping key.",
+        type=int,
+        default=defaults.aliases,
+    )
+    _ = parser.add_argument(
+        "--themes", help="Number of icon themes.", type=int, default=defaults.themes
+    )
+    _ = parser.add_argument(
+        "--theme-icons",
+        help="Number of icons per theme.",
+        type=int,
+        default=defaults.theme_icons,
+    )
+    _ = parser.add_argument(
+        "--desktop-files",
+        help="Number of desktop files.",
+        type=int,
+        default=defaults.desktop_files,
+    )
+    _ = parser.add_argument(
+        "--seed", help="Seed of the corpus generator.", type=int, default=0
+    )
+    _ = parser.add_argument(
+        "--repeat", help="Number of runs per stage.", type=int, default=3
+    )
+    _ = parser.add_argument(
+        "-j", "--jobs", help="Jobs of generate_icons.", type=int, default=1
+    )
+    _ = parser.add_argument(
+        "--symbolic-engine",
+        help="Symbolic engine of generate_icons.",
+        choices=("inkscape", "native"),
+        default="inkscape",
+    )
+    _ = parser.add_argument(
+        "--inkscape",
+        help="Use the installed Inkscape or a stub which copies the files. "
+        "The stub is used if Inkscape isn't installed.",
+        choices=("auto", "stub"),
+        default="auto",
+    )
+    _ = parser.add_argument(
+        "--corpus",
+        help="Keep the synthesized corpus in this folder and reuse it.",
+        type=Path,
+    )
+    _ = parser.add_argument("--json", help="Save the results to this file.", type=Path)
+    _ = parser.add_argument(
+        "--compare", help="Compare the results to a saved JSON file.", type=Path
+    )
+    _ = parser.add_argument(
+        "--max-regression",
+        help="Fail if a stage is this many percent slower than in the compared file.",
+        type=float,
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    size = CorpusSize(
+        icons=args.icons,
+        keys=args.keys,
+        aliases=args.aliases,
+        themes=args.themes,
+        theme_icons=args.theme_icons,
+        desktop_files=args.desktop_files,
+    )
+    options: dict[str, str | int] = {
+        "jobs": args.jobs,
+        "symbolic_engine": args.symbolic_engine,
+        "inkscape": args.inkscape,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="arcticons-benchmark-") as tmp_dir:
+        corpus = (args.corpus or Path(tmp_dir)).resolve()
+        if not (corpus / "generate").exists():
+            LOGGER.info("Synthesizing the corpus in %s", corpus)
+            synthesize(corpus, size, args.seed)
+        report = Report(
+            python=platform.python_version(),
+            corpus=size._asdict(),
+            stages=benchmark(
+                corpus, args.stage or list(STAGES), options, max(1, args.repeat)
+            ),
+        )
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=1), encoding="utf8")
+
+    baseline: Report | None = None
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf8"))
+        if baseline is not None and baseline["corpus"] != report["corpus"]:
+            LOGGER.warning("The corpus of %s has a different size.", args.compare)
+
+    regressions = [
+        stage
+        for stage, change in print_report(report, baseline).items()
+        if args.max_regression is not None and change > args.max_regression
+    ]
+    if regressions:
+        LOGGER.error("Stages slower than the baseline: %s", ", ".join(regressions))
+        sys.exit(1)
@@ -0,0 +1,99 @@
+"""A persistent content-addressed cache for build outputs."""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+
+LOGGER = logging.getLogger("build_cache")
+
+# Temporary files older than this were left behind by killed processes
+STALE_TMP_AGE = 3600
+
+
+def default_cache_dir() -> Path:
+    """Get the cache directory of Arcticons in the XDG cache home."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "arcticons-linux"
+
+
+class BuildCache:
+    """Cache build outputs on disk, keyed by the hash of their inputs.
+
+    The entries are files named after their key. Reading an entry updates its
+    modification time, so the least recently used entries are evicted first
+    once the cache grows beyond ``max_size`` bytes. Writes are atomic, multiple
+    processes can share the cache.
+    """
+
+    def __init__(self, directory: Path, max_size: int) -> None:
+        """Initialize the cache, the directory is created on the first write."""
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts: str | bytes) -> str:
+        """Build a key from the inputs of an output."""
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part.encode() if isinstance(part, str) else part
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> bytes | None:
+        """Get the cached output of a key, or None if it isn't cached."""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store the output of a key."""
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as tmp_file:
+                _ = tmp_file.write(data)
+            Path(tmp_name).replace(path)
+        except OSError as err:
+            LOGGER.warning("Couldn't write %s to the cache: %s", key, err)
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits its size."""
+        entries: list[tuple[float, int, Path]] = []
+        now = time.time()
+        for path in self.directory.glob("*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.name.startswith(".tmp-"):
+                if now - stat.st_mtime > STALE_TMP_AGE:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
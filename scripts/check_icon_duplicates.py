@@ -1,14 +1,209 @@
 #!/usr/bin/python3
-"""Synchronize icons between black and white."""
+"""Find icons which are in both black and white, or have the same content.
 
-from argparse import ArgumentParser
+By default the icons of the target folder with the path of a source icon are
+reported. With --content all icons are compared by a canonical form of their
+SVG content, whatever their name.
+"""
+
+from argparse import ArgumentParser, ArgumentTypeError
+from concurrent.futures import ProcessPoolExecutor
 from filecmp import cmp
+import hashlib
 import logging
+import os
 from pathlib import Path
+import re
 import sys
 
+from lxml import etree
+
 LOGGER = logging.getLogger("check_icon_duplicates")
 
+# The decimals numbers are rounded to, icons which only differ beyond them
+# are duplicates
+DEFAULT_PRECISION = 2
+
+_URL_REFERENCE = re.compile(r"url\(\s*#([^)\s]+)\s*\)")
+_CLASS_SELECTOR = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+_SHORT_COLOR = re.compile(r"#([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])\b")
+_NAMED_COLOR = re.compile(r"\b(black|white)\b", re.IGNORECASE)
+_NAMED_COLORS = {"black": "#000000", "white": "#ffffff"}
+# Colors are matched first, so their digits aren't read as numbers
+_COLOR_OR_NUMBER = re.compile(
+    r"(#[0-9a-fA-F]{6}\b)|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+)
+_SEPARATORS = re.compile(r"[\s,]+")
+
+
+def _round(number: str, precision: int) -> str:
+    """Round a number and write it without trailing zeros.
+
+    Only the zeros of the decimals are removed, integers keep theirs:
+
+    >>> [_round(number, 0) for number in ("10", "100", "1", "-0.2")]
+    ['10', '100', '1', '0']
+    >>> [_round(number, 2) for number in ("10", "1.50", "0.004")]
+    ['10', '1.5', '0']
+    """
+    text = f"{round(float(number), precision) + 0.0:.{precision}f}"  # no -0
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text
+
+
+def _precision(value: str) -> int:
+    """Parse the --precision option, which can't be negative."""
+    precision = int(value)
+    if precision < 0:
+        msg = f"{precision} is negative"
+        raise ArgumentTypeError(msg)
+    return precision
+
+
+def _canonical_names(root: etree._Element) -> tuple[dict[str, str], dict[str, str]]:
+    """Name the IDs and classes of an SVG file in the order they appear."""
+    ids: dict[str, str] = {}
+    classes: dict[str, str] = {}
+    for element in root.iter(etree.Element):
+        if (element_id := element.get("id")) is not None:
+            _ = ids.setdefault(element_id, f"id{len(ids)}")
+        if etree.QName(element).localname == "style" and element.text:
+            for name in _CLASS_SELECTOR.findall(element.text):
+                _ = classes.setdefault(name, f"class{len(classes)}")
+        for name in element.get("class", "").split():
+            _ = classes.setdefault(name, f"class{len(classes)}")
+    return ids, classes
+
+
+def canonical_svg(file: Path, precision: int = DEFAULT_PRECISION) -> bytes:
+    """Get a canonical form of an SVG file, to compare the content of icons.
+
+    Comments and whitespace are dropped and the attributes sorted. Colors are
+    written as lowercase #rrggbb, numbers are rounded to ``precision`` decimals
+    and the separators between them unified. IDs and classes are renamed in the
+    order they appear, so only their use matters and not their names.
+    """
+    parser = etree.XMLParser(
+        remove_blank_text=True, remove_comments=True, remove_pis=True
+    )
+    root = etree.parse(file, parser).getroot()
+    ids, classes = _canonical_names(root)
+
+    def normalize(text: str) -> str:
+        text = _URL_REFERENCE.sub(
+            lambda match: f"url(#{ids.get(match[1], match[1])})", text
+        )
+        text = _SHORT_COLOR.sub(r"#\1\1\2\2\3\3", text)
+        text = _NAMED_COLOR.sub(lambda match: _NAMED_COLORS[match[1].lower()], text)
+        text = _COLOR_OR_NUMBER.sub(
+            lambda match: match[1].lower()
+            if match[1]
+            else f"{_round(match[2], precision)} ",
+            text,
+        )
+        return _SEPARATORS.sub(" ", text).strip()
+
+    for element in root.iter(etree.Element):
+        for name, value in element.attrib.items():
+            if name == "id":
+                element.set(name, ids[value])
+            elif name == "class":
+                element.set(name, " ".join(classes[item] for item in value.split()))
+            elif value.startswith("#") and value[1:] in ids:
+                # A link, like href="#id"
+                element.set(name, f"#{ids[value[1:]]}")
+            else:
+                element.set(name, normalize(value))
+        if etree.QName(element).localname == "style" and element.text:
+            element.text = normalize(
+                _CLASS_SELECTOR.sub(lambda match: f".{classes[match[1]]}", element.text)
+            )
+        elif element.text:
+            element.text = element.text.strip()
+        if element.tail:
+            element.tail = element.tail.strip()
+
+    return etree.tostring(root, method="c14n")
+
+
+def _content_hash(file: Path, precision: int) -> str | None:
+    """Hash the canonical form of an SVG file, None if it isn't valid."""
+    try:
+        return hashlib.sha256(canonical_svg(file, precision)).hexdigest()
+    except (OSError, etree.XMLSyntaxError) as err:
+        LOGGER.warning("Can't read %s: %s", file, err)
+        return None
+
+
+def content_duplicates(
+    folders: list[Path], precision: int = DEFAULT_PRECISION, jobs: int = 0
+) -> list[list[Path]]:
+    """Find the icons in the folders with the same canonical content.
+
+    The icons are hashed in parallel. Each group lists the files with the same
+    content, no matter their name.
+    """
+    files = sorted({file for folder in folders for file in folder.glob("**/*.svg")})
+    groups: dict[str, list[Path]] = {}
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        for file, digest in zip(
+            files,
+            executor.map(
+                _content_hash,
+                files,
+                [precision] * len(files),
+                chunksize=max(1, len(files) // ((os.cpu_count() or 1) * 8)),
+            ),
+            strict=True,
+        ):
+            if digest is not None:
+                groups.setdefault(digest, []).append(file)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def main_content(
+    src_folder: Path,
+    target_folder: Path,
+    *,
+    fix: bool = False,
+    precision: int = DEFAULT_PRECISION,
+    jobs: int = 0,
+) -> bool:
+    """Check if icons in the target folder have the content of any other icon.
+
+    With ``fix`` the target files are removed, which have the same content and
+    the same relative path as a source file. Others are only reported, since
+    removing them would change which icon their name gets.
+    """
+    groups = [
+        group
+        for group in content_duplicates([src_folder, target_folder], precision, jobs)
+        if any(file.is_relative_to(target_folder) for file in group)
+    ]
+    if not groups:
+        LOGGER.info("No duplicates found.")
+        return True
+
+    print("Following icons have the same content:")
+    for group in groups:
+        print(", ".join(str(file) for file in group))
+        if not fix:
+            continue
+        src_files = {
+            file.relative_to(src_folder)
+            for file in group
+            if file.is_relative_to(src_folder)
+        }
+        for file in group:
+            if (
+                file.is_relative_to(target_folder)
+                and file.relative_to(target_folder) in src_files
+            ):
+                LOGGER.info("Removing %s", file)
+                file.unlink()
+    return False
+
 
 def main(src_folder: Path, target_folder: Path, *, fix: bool = False) -> bool:
     """Check if icons are in both black and white folders."""
@@ -67,7 +262,37 @@ if __name__ == "__main__":
         type=Path,
         required=True,
     )
+    parser.add_argument(
+        "--content",
+        help="Compare the content of all icons, regardless of their path. Colors, "
+        "numbers, IDs and classes are normalized before comparing.",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--precision",
+        help="Number of decimals numbers are compared with in content mode.",
+        type=_precision,
+        default=DEFAULT_PRECISION,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of icons to hash in parallel, 0 uses all CPUs.",
+        type=int,
+        default=0,
+    )
     args = parser.parse_args()
 
-    if not main(args.src_folder, args.target_folder, fix=args.fix):
+    if args.content:
+        valid = main_content(
+            args.src_folder,
+            args.target_folder,
+            fix=args.fix,
+            precision=args.precision,
+            jobs=args.jobs,
+        )
+    else:
+        valid = main(args.src_folder, args.target_folder, fix=args.fix)
+    if not valid:
         sys.exit(1)
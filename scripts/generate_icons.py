@@ -1,25 +1,49 @@
 #!/usr/bin/python3
 """Generate the icons for Arcticons."""
 
-# ruff: noqa: PLR0912
+# ruff: noqa: PLR0912, PLR0914, PLR0915
 
 from __future__ import annotations
 
 from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from configparser import ConfigParser
 import contextlib
+import copy
+import cProfile
+from functools import cache
+import hashlib
+import json
 import logging
+import multiprocessing.util
+from operator import itemgetter
+import os
 from os import symlink
 from pathlib import Path
+import pstats
 import re
 from shutil import rmtree, which
-import subprocess  # noqa: S404
+import sys
+import time
 import tomllib
-from typing import TypedDict
+from typing import TYPE_CHECKING, NamedTuple, NotRequired, TypedDict
 
+from archive_themes import write_archives
+from build_cache import BuildCache, default_cache_dir
+from icon_mapping import load_mapping
+from icon_theme_cache import write_icon_cache
+from inkscape_shell import InkscapeShell, inkscape_version
 from lxml import etree
+import raster_icons
 from scour import scour
-import yaml
+import staged_build
+import stroke_to_path
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from icon_mapping import Mapping
 
 LOGGER = logging.getLogger("generate_icons")
 
@@ -38,161 +62,812 @@ class GeneratorEntry(TypedDict):
     color: str
     line_weight: int
     src_paths: list[str]
+    # Render PNG files for the fixed-size folders instead of linking to scalable
+    raster: NotRequired[bool]
+
+
+# The fixed-size folders, which are linked to scalable or rendered to PNG
+SIZE_FOLDERS = (
+    "8x8",
+    "16x16",
+    "16x16@2x",
+    "18x18",
+    "18x18@2x",
+    "22x22",
+    "22x22@2x",
+    "24x24",
+    "24x24@2x",
+    "32x32",
+    "32x32@2x",
+    "42x42",
+    "48x48",
+    "48x48@2x",
+    "64x64",
+    "64x64@2x",
+    "84x84",
+    "96x96",
+    "128x128",
+)
+
+OLD_MANIFEST_FILE = ".build-manifest.json"
+MANIFEST_VERSION = 2
+
+
+class SourceRecord(TypedDict):
+    """The source file of an entry, as recorded in the build manifest."""
+
+    path: str
+    mtime_ns: int
+    size: int
+    sha256: str
+
+
+class ManifestEntry(TypedDict):
+    """The inputs an entry was generated from."""
+
+    source: SourceRecord
+    config: str
+    dests: list[str]
+    # The entry with the same source, whose icons are linked instead
+    link: str | None
+
+
+class Manifest(TypedDict):
+    """The build manifest of a destination."""
+
+    version: int
+    entries: dict[str, ManifestEntry]
+
+
+class Target(NamedTuple):
+    """A destination and the config to generate its icons with."""
+
+    destination: Path
+    config: GeneratorEntry
+
+
+class BuildOptions(NamedTuple):
+    """Options of a build, which are passed to the worker processes."""
+
+    inkscape_timeout: float = 60.0
+    symbolic_engine: str = "inkscape"
+    cache_dir: Path | None = None
+    cache_size: int = 256 * 1024 * 1024
+
+    @property
+    def symbolic(self) -> bool:
+        """Whether symbolic icons are generated."""
+        return self.symbolic_engine == "native" or has_inkscape
+
+
+class EntryResult(NamedTuple):
+    """The result of processing an entry in a worker process."""
+
+    entry: str
+    success: bool
+    records: list[logging.LogRecord]
+    cache_hits: int
+    cache_misses: int
+    timings: dict[str, float]
+
+
+class BuildTimings(TypedDict):
+    """The time spent in each stage, in total and per entry."""
+
+    stages: dict[str, float]
+    entries: dict[str, dict[str, float]]
+    slowest: list[tuple[str, float]]
+
+
+class _RecordCollector(logging.Handler):
+    """Collect the log records of an entry, so they can be emitted as a group."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Make the record picklable, tracebacks can't be sent to the main process
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+# The time spent in each stage of the entry which is processed by this process
+_stage_timings: dict[str, float] = {}
+
+
+@contextlib.contextmanager
+def _timed(stage: str) -> Iterator[None]:
+    """Add the time spent in the block to a stage of the current entry."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_timings[stage] = (
+            _stage_timings.get(stage, 0.0) + time.perf_counter() - start
+        )
+
+
+@cache
+def _inkscape_shell(timeout: float) -> InkscapeShell:
+    """Get the Inkscape shell session of this process.
+
+    The session is quit when the process exits. The worker processes of a pool
+    don't run atexit hooks on every Python version, but they do run the
+    finalizers of multiprocessing, like the main process.
+    """
+    shell = InkscapeShell(timeout=timeout)
+    _ = multiprocessing.util.Finalize(shell, shell.close, exitpriority=0)
+    return shell
+
+
+@cache
+def _symbolic_cache(options: BuildOptions) -> BuildCache | None:
+    """Get the symbolic icon cache of this process, None if it's disabled."""
+    if options.cache_dir is None or not options.symbolic:
+        return None
+    return BuildCache(options.cache_dir, options.cache_size)
+
+
+@cache
+def _symbolic_tools(options: BuildOptions) -> str:
+    """Describe the tools which convert the symbolic icons, for the cache key.
+
+    The native engine is identified by its source, so changing it invalidates
+    the cache.
+    """
+    if options.symbolic_engine == "native":
+        return hashlib.sha256(Path(stroke_to_path.__file__).read_bytes()).hexdigest()
+    return f"{inkscape_version()}\nscour {scour.__version__}"
+
+
+def _convert_symbolic(
+    entry: str,
+    svg_file: etree._ElementTree,
+    scalable_file: Path,
+    symbolic_file: Path,
+    options: BuildOptions,
+) -> bool:
+    """Convert a scalable icon to a symbolic icon, or reuse the cached result."""
+    cache_key = None
+    symbolic_cache = _symbolic_cache(options)
+    if symbolic_cache is not None:
+        with _timed("cache"):
+            cache_key = BuildCache.key(
+                options.symbolic_engine,
+                _symbolic_tools(options),
+                scalable_file.read_bytes(),
+            )
+            data = symbolic_cache.get(cache_key)
+            if data is not None:
+                symbolic_file.write_bytes(data)
+        if data is not None:
+            return True
+
+    if options.symbolic_engine == "native":
+        with _timed("native"):
+            symbolic_file.write_bytes(stroke_to_path.convert(svg_file))
+    else:
+        with _timed("inkscape"):
+            converted = _inkscape_shell(options.inkscape_timeout).stroke_to_path(
+                scalable_file, symbolic_file
+            )
+        if not converted:
+            LOGGER.error("%s: Inkscape couldn't create the symbolic icon", entry)
+            return False
+
+        with _timed("scour"), symbolic_file.open("r+") as symbolic_fp:
+            svg_data = scour.scourString(symbolic_fp.read())
+            symbolic_fp.seek(0)
+            symbolic_fp.truncate()
+            symbolic_fp.write(svg_data)
+
+        # remove .0.svg files in case of inkscape crashing
+        with _timed("cleanup"):
+            for file in scalable_file.parent.glob(f"{scalable_file.stem}*.0.svg"):
+                file.unlink()
+
+    if symbolic_cache is not None and cache_key is not None:
+        with _timed("cache"):
+            symbolic_cache.put(cache_key, symbolic_file.read_bytes())
+    return True
+
+
+class SourceIndex:
+    """An index of the source icons, built with a single scan per source path.
+
+    The source paths are in order of precedence, an icon in an earlier path
+    shadows the icons with the same name in the later paths.
+    """
+
+    def __init__(self, src_paths: list[str]) -> None:
+        """Scan the source paths."""
+        self.src_paths = src_paths
+        self.sources: dict[str, Path] = {}
+        self.shadowed: dict[str, list[Path]] = {}
+        for src_dir in src_paths:
+            try:
+                dir_entries = list(os.scandir(src_dir))
+            except FileNotFoundError:
+                LOGGER.warning('Source path "%s" doesn\'t exist.', src_dir)
+                continue
+            for dir_entry in sorted(dir_entries, key=lambda item: item.name):
+                if not dir_entry.name.endswith(".svg") or not dir_entry.is_file():
+                    continue
+                name = dir_entry.name.removesuffix(".svg")
+                src_file = Path(src_dir) / dir_entry.name
+                if name in self.sources:
+                    self.shadowed.setdefault(name, []).append(src_file)
+                else:
+                    self.sources[name] = src_file
+
+    def find(self, entry: str) -> Path | None:
+        """Find the source file of an entry."""
+        return self.sources.get(entry)
 
+    def missing(self, mapping: Mapping) -> list[str]:
+        """Get the mapping entries which don't have a source file."""
+        return [entry for entry in mapping if entry not in self.sources]
 
-type MappingYaml = dict[str, list[str]]
+
+def _source_indexes(targets: list[Target]) -> dict[tuple[str, ...], SourceIndex]:
+    """Build one source index for every distinct list of source paths."""
+    indexes: dict[tuple[str, ...], SourceIndex] = {}
+    for target in targets:
+        src_paths = tuple(target.config["src_paths"])
+        if src_paths not in indexes:
+            indexes[src_paths] = SourceIndex(target.config["src_paths"])
+    return indexes
+
+
+def report_sources(targets: list[Target], mapping: Mapping) -> bool:
+    """Print the entries without a source and the shadowed source files.
+
+    Returns False if any entry doesn't have a source.
+    """
+    valid = True
+    for index in _source_indexes(targets).values():
+        print(f"Source paths: {', '.join(index.src_paths)}")
+        missing = index.missing(mapping)
+        if missing:
+            valid = False
+            print("Entries without a source file:")
+            for entry in missing:
+                print(f"\t{entry}")
+        if index.shadowed:
+            print("Shadowed source files:")
+            for name, shadowed in sorted(index.shadowed.items()):
+                for src_file in shadowed:
+                    print(f"\t{src_file} (shadowed by {index.sources[name]})")
+    return valid
 
 
 def process_entry(
-    entry: str, dests: list[str], destination: Path, config: GeneratorEntry
-) -> None:
-    """Process an entry."""
-    scalable_root = destination / "scalable"
-    symbolic_root = destination / "symbolic"
+    entry: str,
+    dests: list[str],
+    sources: list[tuple[Path, Target]],
+    options: BuildOptions,
+) -> bool:
+    """Process an entry for all targets, returns False if it couldn't be generated.
 
+    Every source file is only parsed once, each target gets a copy of the tree.
+    """
     LOGGER.info("%s: creating %s", entry, dests)
 
-    if not any((not (scalable_root / (dest + ".svg")).exists()) for dest in dests):
-        LOGGER.info("%s: Skipping, all icons already exist.", entry)
-        return
+    _stage_timings.clear()
+    success = True
+    parsed: dict[Path, etree._ElementTree] = {}
+    with _timed("total"):
+        for src_file, target in sources:
+            with _timed("parse"):
+                if src_file not in parsed:
+                    parsed[src_file] = etree.parse(src_file)
+                svg_file = copy.deepcopy(parsed[src_file])
+            success &= generate_target(
+                entry, dests, src_file, svg_file, target, options
+            )
+    return success
 
-    dest = dests[0]
 
-    (scalable_root / dest).parent.mkdir(parents=True, exist_ok=True)
+def generate_target(  # noqa: PLR0913, PLR0917
+    entry: str,
+    dests: list[str],
+    src_file: Path,
+    svg_file: etree._ElementTree,
+    target: Target,
+    options: BuildOptions,
+) -> bool:
+    """Generate the icons of an entry in a target from the parsed source file."""
+    destination, config = target
+    scalable_root = destination / "scalable"
+    symbolic_root = destination / "symbolic"
 
-    src_file = None
+    dest = dests[0]
 
-    for src_dir in config["src_paths"]:
-        src_path = Path(src_dir)
-        if (src_path / f"{entry}.svg").exists():
-            src_file = src_path / f"{entry}.svg"
-            break
-    if src_file is None:
-        LOGGER.error("%s: Skipping, icon not found", entry)
-        return
+    (scalable_root / dest).parent.mkdir(parents=True, exist_ok=True)
 
     LOGGER.info("%s: %s -> %s", entry, src_file, scalable_root / f"{dest}.svg")
 
-    svg_file = etree.parse(src_file)
-    svg_root = svg_file.getroot()
+    with _timed("rewrite"):
+        svg_root = svg_file.getroot()
 
-    circles = svg_root.findall(".//{http://www.w3.org/2000/svg}circle")
-    for circle in circles:
-        if circle.get("r") in {"0.75", ".75"}:
-            circle.set("r", str(0.75 * config["line_weight"]))
+        circles = svg_root.findall(".//{http://www.w3.org/2000/svg}circle")
+        for circle in circles:
+            if circle.get("r") in {"0.75", ".75"}:
+                circle.set("r", str(0.75 * config["line_weight"]))
 
-    style_tag = svg_file.getroot().find(".//{http://www.w3.org/2000/svg}style")
-    if style_tag is None or style_tag.text is None:
-        LOGGER.error("%s: file %s doesn't have a style tag!", entry, src_file)
-        return
+        style_tag = svg_file.getroot().find(".//{http://www.w3.org/2000/svg}style")
+        if style_tag is None or style_tag.text is None:
+            LOGGER.error("%s: file %s doesn't have a style tag!", entry, src_file)
+            return False
 
-    if "stroke-width" in style_tag.text:
-        style_tag.text = re.sub(
-            r"(stroke-width\s*:)[^;]+;",
-            rf"\g<1>{config['line_weight']}px;",
-            style_tag.text,
+        if "stroke-width" in style_tag.text:
+            style_tag.text = re.sub(
+                r"(stroke-width\s*:)[^;]+;",
+                rf"\g<1>{config['line_weight']}px;",
+                style_tag.text,
+            )
+        else:
+            style_tag.text = re.sub(
+                r"(stroke\s*:[^;]+;)",
+                rf"\1stroke-width:{config['line_weight']}px;",
+                style_tag.text,
+            )
+
+        style_tag.text = style_tag.text.replace(config["src_color"], config["color"])
+    with _timed("write"):
+        # It might be a link to the icon of another entry from an earlier build
+        (scalable_root / f"{dest}.svg").unlink(missing_ok=True)
+        svg_file.write(
+            scalable_root / f"{dest}.svg", xml_declaration=True, encoding="UTF-8"
         )
-    else:
-        style_tag.text = re.sub(
-            r"(stroke\s*:[^;]+;)",
-            rf"\1stroke-width:{config['line_weight']}px;",
-            style_tag.text,
+
+    with _timed("symlinks"):
+        _link_aliases(entry, scalable_root, dests, ".svg")
+
+    if not options.symbolic:
+        return True
+
+    (symbolic_root / dest).parent.mkdir(exist_ok=True, parents=True)
+
+    LOGGER.info("%s: %s -> %s", entry, src_file, symbolic_root / f"{dest}-symbolic.svg")
+    (symbolic_root / f"{dest}-symbolic.svg").unlink(missing_ok=True)
+    if not _convert_symbolic(
+        entry,
+        svg_file,
+        scalable_root / f"{dest}.svg",
+        symbolic_root / f"{dest}-symbolic.svg",
+        options,
+    ):
+        return False
+
+    with _timed("symlinks"):
+        _link_aliases(entry, symbolic_root, dests, "-symbolic.svg")
+
+    return True
+
+
+def _link_aliases(entry: str, root: Path, dests: list[str], suffix: str) -> None:
+    """Link the other destinations of an entry to the icon of the first one."""
+    for dest_file in dests[1:]:
+        link = root / f"{dest_file}{suffix}"
+        link_target = (root / f"{dests[0]}{suffix}").relative_to(
+            link.parent, walk_up=True
         )
+        link.parent.mkdir(parents=True, exist_ok=True)
+        link.unlink(missing_ok=True)
+
+        LOGGER.info("%s: symlink: %s -> %s", entry, link, link_target)
+        symlink(link_target, link)
+
+
+def _init_worker(log_level: int) -> None:
+    """Set up the logging of a worker process.
 
-    style_tag.text = style_tag.text.replace(config["src_color"], config["color"])
-    svg_file.write(
-        scalable_root / f"{dest}.svg", xml_declaration=True, encoding="UTF-8"
+    The records are only collected and emitted by the main process.
+    """
+    root_logger = logging.getLogger()
+    root_logger.handlers.clear()
+    root_logger.setLevel(log_level)
+
+
+def _process_entry_worker(
+    entry: str,
+    dests: list[str],
+    sources: list[tuple[Path, Target]],
+    options: BuildOptions,
+) -> EntryResult:
+    """Process an entry in a worker process and collect its log records."""
+    collector = _RecordCollector()
+    logging.getLogger().addHandler(collector)
+    symbolic_cache = _symbolic_cache(options)
+    hits, misses = (
+        (symbolic_cache.hits, symbolic_cache.misses) if symbolic_cache else (0, 0)
+    )
+    try:
+        success = process_entry(entry, dests, sources, options)
+    except Exception:
+        LOGGER.exception("%s: Failed to process entry", entry)
+        success = False
+    finally:
+        logging.getLogger().removeHandler(collector)
+    if symbolic_cache is not None:
+        hits = symbolic_cache.hits - hits
+        misses = symbolic_cache.misses - misses
+    return EntryResult(
+        entry=entry,
+        success=success,
+        records=collector.records,
+        cache_hits=hits,
+        cache_misses=misses,
+        timings=dict(_stage_timings),
     )
 
-    if len(dests) > 1:
-        for dest_file in dests[1:]:
-            (scalable_root / f"{dest_file}.svg").parent.mkdir(
-                parents=True,
-                exist_ok=True,
-            )
-            (scalable_root / f"{dest_file}.svg").unlink(missing_ok=True)
 
-            LOGGER.info(
-                "%s: symlink: %s -> %s",
-                entry,
-                scalable_root / f"{dest_file}.svg",
-                (scalable_root / f"{dest}.svg").relative_to(
-                    (scalable_root / f"{dest_file}.svg").parent,
-                    walk_up=True,
-                ),
-            )
+def _manifest_file(destination: Path, cache_dir: Path | None) -> Path | None:
+    """Get the build manifest file of a destination in the cache directory.
 
-            symlink(
-                (scalable_root / f"{dest}.svg").relative_to(
-                    (scalable_root / f"{dest_file}.svg").parent,
-                    walk_up=True,
-                ),
-                scalable_root / f"{dest_file}.svg",
-            )
+    The manifest has machine specific mtimes, so it isn't kept in the
+    destination. Without a cache directory there is no manifest, the icons
+    which exist are kept then.
+    """
+    if cache_dir is None:
+        return None
+    path_hash = hashlib.sha256(str(destination.resolve()).encode()).hexdigest()
+    return cache_dir / f"manifest-{path_hash[:16]}.json"
+
+
+def _load_manifest(destination: Path, cache_dir: Path | None) -> Manifest:
+    """Load the build manifest of the destination."""
+    manifest_file = _manifest_file(destination, cache_dir)
+    if manifest_file is None:
+        return Manifest(version=MANIFEST_VERSION, entries={})
+    try:
+        manifest: Manifest = json.loads(manifest_file.read_text(encoding="utf8"))
+    except (OSError, ValueError):
+        return Manifest(version=MANIFEST_VERSION, entries={})
+    if manifest.get("version") != MANIFEST_VERSION:
+        LOGGER.info("The build manifest is outdated, regenerating all icons.")
+        return Manifest(version=MANIFEST_VERSION, entries={})
+    return manifest
 
-    if not has_inkscape:
+
+def _save_manifest(
+    destination: Path, cache_dir: Path | None, manifest: Manifest
+) -> None:
+    """Save the build manifest of the destination."""
+    # Earlier builds kept it in the destination
+    (destination / OLD_MANIFEST_FILE).unlink(missing_ok=True)
+    manifest_file = _manifest_file(destination, cache_dir)
+    if manifest_file is None:
         return
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_name(f"{manifest_file.name}.tmp")
+    tmp_file.write_text(json.dumps(manifest, indent=1, sort_keys=True), encoding="utf8")
+    tmp_file.replace(manifest_file)
 
-    (symbolic_root / dest).parent.mkdir(exist_ok=True, parents=True)
 
-    LOGGER.info("%s: %s -> %s", entry, src_file, symbolic_root / f"{dest}-symbolic.svg")
-    _ = subprocess.run(  # noqa: S603
-        [  # noqa: S607
-            "inkscape",
-            "--actions=select-all;object-stroke-to-path",
-            f"--export-filename={symbolic_root / dest}-symbolic.svg",
-            "--export-overwrite",
-            scalable_root / f"{dest}.svg",
-        ],
-        check=False,
+def _source_record(src_file: Path, old_record: SourceRecord | None) -> SourceRecord:
+    """Record a source file, the hash is only recalculated if the file changed."""
+    stat = src_file.stat()
+    if (
+        old_record is not None
+        and old_record["path"] == str(src_file)
+        and old_record["mtime_ns"] == stat.st_mtime_ns
+        and old_record["size"] == stat.st_size
+    ):
+        return old_record
+    return SourceRecord(
+        path=str(src_file),
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        sha256=hashlib.sha256(src_file.read_bytes()).hexdigest(),
     )
-    with (symbolic_root / f"{dest}-symbolic.svg").open("r+") as symbolic_file:
-        svg_data = scour.scourString(symbolic_file.read())
-        symbolic_file.seek(0)
-        symbolic_file.truncate()
-        symbolic_file.write(svg_data)
-
-    # remove .0.svg files in case of inkscape crashing
-    for file in scalable_root.glob(f"{dest}*.0.svg"):
-        file.unlink()
-
-    if len(dests) > 1:
-        for dest_file in dests[1:]:
-            (symbolic_root / f"{dest_file}-symbolic.svg").parent.mkdir(
-                parents=True,
-                exist_ok=True,
+
+
+def _config_hash(config: GeneratorEntry, options: BuildOptions) -> str:
+    """Hash the parts of the config which change the generated icons."""
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "src_color": config["src_color"],
+                "color": config["color"],
+                "line_weight": config["line_weight"],
+                "symbolic": options.symbolic_engine if options.symbolic else None,
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+
+
+def _output_files(destination: Path, dest: str, *, symbolic: bool) -> list[Path]:
+    """Get the files generated for a destination icon."""
+    files = [destination / "scalable" / f"{dest}.svg"]
+    if symbolic:
+        files.append(destination / "symbolic" / f"{dest}-symbolic.svg")
+    return files
+
+
+def _process_entries(
+    entries: dict[str, tuple[list[str], list[tuple[Path, Target]]]],
+    options: BuildOptions,
+    jobs: int,
+) -> list[EntryResult]:
+    """Process the entries, serially or in a process pool.
+
+    The log records of the workers are emitted as their results arrive.
+    """
+    if jobs == 1:
+        serial_results: list[EntryResult] = []
+        for entry, (dests, sources) in entries.items():
+            try:
+                success = process_entry(entry, dests, sources, options)
+            except Exception:
+                LOGGER.exception("%s: Failed to process entry", entry)
+                success = False
+            serial_results.append(
+                EntryResult(
+                    entry=entry,
+                    success=success,
+                    records=[],
+                    cache_hits=0,
+                    cache_misses=0,
+                    timings=dict(_stage_timings),
+                )
+            )
+        return serial_results
+
+    results: list[EntryResult] = []
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(),),
+    ) as executor:
+        # map() returns the results in order, so the log output is deterministic
+        for result in executor.map(
+            _process_entry_worker,
+            entries.keys(),
+            [dests for dests, _ in entries.values()],
+            [sources for _, sources in entries.values()],
+            [options] * len(entries),
+            chunksize=max(1, len(entries) // (jobs * 16)),
+        ):
+            for record in result.records:
+                LOGGER.handle(record)
+            results.append(result)
+    return results
+
+
+def _remove_unmapped(destination: Path, manifest: Manifest, mapping: Mapping) -> None:
+    """Remove the icons of destinations which were mapped in the last build."""
+    for old_record in manifest["entries"].values():
+        for dest in old_record["dests"]:
+            if dest in mapping.reverse:
+                continue
+            for file in _output_files(destination, dest, symbolic=True):
+                if file.is_symlink() or file.exists():
+                    LOGGER.info("Removing %s, it isn't mapped anymore.", file)
+                    file.unlink()
+
+
+def _link_duplicates(
+    duplicates: list[tuple[str, Target, dict[str, ManifestEntry]]],
+    mapping: Mapping,
+    failed: set[str],
+    options: BuildOptions,
+) -> None:
+    """Link the icons of entries to the icons of the first entry with the same source.
+
+    The icons of the first entry were generated from an identical file with the
+    same config, so they are identical too. The duplicates are found by the
+    hash of their source before anything is generated, so their conversions
+    are saved, and the manifest records the link. Different sources which give
+    identical icons aren't linked.
+    """
+    linked = 0
+    saved_bytes = 0
+    for entry, target, target_records in duplicates:
+        first_entry = target_records[entry]["link"]
+        if first_entry is None:
+            continue
+        if first_entry in failed:
+            # Retried with the first entry on the next build
+            target_records.pop(entry, None)
+            continue
+        first_dest = mapping[first_entry][0]
+        _link_aliases(
+            entry,
+            target.destination / "scalable",
+            [first_dest, *mapping[entry]],
+            ".svg",
+        )
+        if options.symbolic:
+            _link_aliases(
+                entry,
+                target.destination / "symbolic",
+                [first_dest, *mapping[entry]],
+                "-symbolic.svg",
+            )
+        linked += 1
+        saved_bytes += sum(
+            file.stat().st_size
+            for file in _output_files(
+                target.destination, first_dest, symbolic=options.symbolic
             )
-            (symbolic_root / f"{dest_file}-symbolic.svg").unlink(missing_ok=True)
+            if file.exists()
+        )
+
+    if linked:
+        LOGGER.info(
+            "Linked %d entries to the icons of identical sources, saving %.1f KiB "
+            "and %d symbolic icon conversions.",
+            linked,
+            saved_bytes / 1024,
+            linked if options.symbolic else 0,
+        )
 
-            LOGGER.info(
-                "%s: symlink: %s -> %s",
+
+def generate_destinations(
+    targets: list[Target],
+    mapping: Mapping,
+    options: BuildOptions,
+    jobs: int,
+    timings: BuildTimings | None = None,
+) -> bool:
+    """Generate the icons in all destinations, returns False if any entry failed.
+
+    The mapping is walked once for all targets. Only the entries whose source
+    file, config or mapping changed since the last build of a destination are
+    generated, the icons of removed mappings are deleted.
+
+    The time spent in each stage is added to ``timings``.
+    """
+    start = time.perf_counter()
+    indexes = _source_indexes(targets)
+    manifests = [
+        _load_manifest(target.destination, options.cache_dir) for target in targets
+    ]
+    config_hashes = [_config_hash(target.config, options) for target in targets]
+    records: list[dict[str, ManifestEntry]] = [{} for _ in targets]
+    # The first entry of every source hash, identical sources give identical icons
+    first_entries: list[dict[str, str]] = [{} for _ in targets]
+    duplicates: list[tuple[str, Target, dict[str, ManifestEntry]]] = []
+    success = True
+
+    # Report all missing icons up front
+    for index in indexes.values():
+        for entry in index.missing(mapping):
+            LOGGER.error(
+                "%s: Skipping, icon not found in %s",
                 entry,
-                symbolic_root / f"{dest_file}-symbolic.svg",
-                (symbolic_root / f"{dest}-symbolic.svg").relative_to(
-                    (symbolic_root / f"{dest_file}-symbolic.svg").parent,
-                    walk_up=True,
-                ),
+                ", ".join(index.src_paths),
             )
+            success = False
+
+    outdated: dict[str, tuple[list[str], list[tuple[Path, Target]]]] = {}
+    for entry, dests in mapping.items():
+        sources: list[tuple[Path, Target]] = []
+        for target, manifest, config_hash, target_records, target_first in zip(
+            targets, manifests, config_hashes, records, first_entries, strict=True
+        ):
+            src_file = indexes[tuple(target.config["src_paths"])].find(entry)
+            if src_file is None:
+                continue
 
-            symlink(
-                (symbolic_root / f"{dest}-symbolic.svg").relative_to(
-                    (symbolic_root / f"{dest_file}-symbolic.svg").parent,
-                    walk_up=True,
-                ),
-                symbolic_root / f"{dest_file}-symbolic.svg",
+            old_record = manifest["entries"].get(entry)
+            source = _source_record(
+                src_file, old_record["source"] if old_record else None
             )
+            first_entry = target_first.setdefault(source["sha256"], entry)
+            target_records[entry] = ManifestEntry(
+                source=source,
+                config=config_hash,
+                dests=dests,
+                link=None if first_entry == entry else first_entry,
+            )
+            # Without a manifest only the missing icons are generated
+            if (
+                options.cache_dir is None or target_records[entry] == old_record
+            ) and all(
+                file.exists()
+                for dest in dests
+                for file in _output_files(
+                    target.destination, dest, symbolic=options.symbolic
+                )
+            ):
+                LOGGER.info(
+                    "%s: Skipping, icons in %s are up to date.",
+                    entry,
+                    target.destination,
+                )
+                continue
+            if first_entry != entry:
+                duplicates.append((entry, target, target_records))
+                continue
+            sources.append((src_file, target))
+        if sources:
+            outdated[entry] = (dests, sources)
 
+    for target, manifest in zip(targets, manifests, strict=True):
+        _remove_unmapped(target.destination, manifest, mapping)
+    source_lookup = time.perf_counter() - start
 
-def generate_destination(
-    destination: Path, config: GeneratorEntry, mapping_yaml: MappingYaml
-) -> None:
-    """Generate the icons in the destination."""
-    for entry, dests in mapping_yaml.items():
-        process_entry(entry, dests, destination, config)
+    symbolic_cache = _symbolic_cache(options)
+    stages: Counter[str] = Counter({"source lookup": source_lookup})
+    failed: set[str] = set()
+    for result in _process_entries(outdated, options, jobs):
+        if not result.success:
+            # Failed entries are retried on the next build
+            for target_records in records:
+                target_records.pop(result.entry, None)
+            failed.add(result.entry)
+            success = False
+        # Count the cache use of the workers in the cache of this process
+        if symbolic_cache is not None:
+            symbolic_cache.hits += result.cache_hits
+            symbolic_cache.misses += result.cache_misses
+        stages.update(result.timings)
+        if timings is not None:
+            timings["entries"][result.entry] = result.timings
 
+    start = time.perf_counter()
+    _link_duplicates(duplicates, mapping, failed, options)
+    stages["duplicates"] += time.perf_counter() - start
 
-def generate_index_theme(destination: Path, config: GeneratorEntry) -> None:
-    """Generate the target index.theme file."""
+    start = time.perf_counter()
+    for target, target_records in zip(targets, records, strict=True):
+        _save_manifest(
+            target.destination,
+            options.cache_dir,
+            Manifest(version=MANIFEST_VERSION, entries=target_records),
+        )
+    stages["manifest"] += time.perf_counter() - start
+    if timings is not None:
+        timings["stages"] = dict(stages)
+
+    if symbolic_cache is not None:
+        LOGGER.info(
+            "Symbolic icon cache: %d hits, %d misses",
+            symbolic_cache.hits,
+            symbolic_cache.misses,
+        )
+    return success
+
+
+def report_timings(timings: BuildTimings, top: int) -> None:
+    """Log the time spent in each stage and the slowest entries."""
+    timings["slowest"] = sorted(
+        (
+            (entry, entry_timings.get("total", 0.0))
+            for entry, entry_timings in timings["entries"].items()
+        ),
+        key=itemgetter(1),
+        reverse=True,
+    )[:top]
+    LOGGER.info("Time spent in each stage:")
+    for stage, seconds in sorted(
+        timings["stages"].items(), key=itemgetter(1), reverse=True
+    ):
+        LOGGER.info("\t%-14s %9.3fs", stage, seconds)
+    LOGGER.info("The %d slowest entries:", len(timings["slowest"]))
+    for entry, seconds in timings["slowest"]:
+        LOGGER.info("\t%-30s %9.3fs", entry, seconds)
+
+
+def generate_index_theme(
+    destination: Path,
+    config: GeneratorEntry,
+    raster_directories: list[str] | None = None,
+) -> None:
+    """Generate the target index.theme file.
+
+    With ``raster_directories`` only these fixed-size directories are listed,
+    the others don't have any PNG files.
+    """
 
     index_theme_file = ConfigParser()
     index_theme_file.optionxform = lambda optionstr: optionstr
@@ -200,56 +875,150 @@ def generate_index_theme(destination: Path, config: GeneratorEntry) -> None:
     index_theme_file["Icon Theme"]["Name"] = config["name"]
     index_theme_file["Icon Theme"]["Comment"] = config["comment"]
     index_theme_file["Icon Theme"]["Inherits"] = config["inherits"]
+    if raster_directories is not None:
+        directories = [
+            directory
+            for directory in index_theme_file["Icon Theme"]["Directories"].split(",")
+            if index_theme_file.get(directory, "Type", fallback=None) != "Fixed"
+            or directory in raster_directories
+        ]
+        for directory in index_theme_file.sections():
+            if directory != "Icon Theme" and directory not in directories:
+                _ = index_theme_file.remove_section(directory)
+        index_theme_file["Icon Theme"]["Directories"] = ",".join(directories)
+    # It might be a link to the file of the last build
+    (destination / "index.theme").unlink(missing_ok=True)
     with (destination / "index.theme").open("w", encoding="utf8") as dest_fp:
         index_theme_file.write(dest_fp, space_around_delimiters=False)
 
 
-def main(config_file: Path) -> None:
-    """Generate all icons."""
-    if not has_inkscape:
+def main(  # noqa: PLR0913
+    config_file: Path,
+    *,
+    jobs: int = 1,
+    options: BuildOptions | None = None,
+    report: bool = False,
+    timings_file: Path | None = None,
+    timings_top: int = 10,
+    archive: Path | None = None,
+) -> bool:
+    """Generate all icons, returns False if any icon failed to generate.
+
+    Every destination is built in a staging folder next to it, which is swapped
+    in once all destinations are generated.
+
+    With ``report`` only the source files are checked and nothing is
+    generated. With ``timings_file`` the time spent in each stage is reported
+    and saved. With ``archive`` the destinations with ``archive`` in their
+    config are packed into archives of this name.
+    """
+    if options is None:
+        options = BuildOptions()
+    if not options.symbolic:
         LOGGER.warning("Inkscape was not detected, not creating symbolic icons.")
 
     config: dict[str, GeneratorEntry] = tomllib.loads(
         config_file.read_text(encoding="utf8")
     )
 
-    with Path("mapping.yaml").open(encoding="utf8") as yaml_fp:
-        mapping_yaml: MappingYaml = yaml.safe_load(yaml_fp)
+    mapping = load_mapping(Path("mapping.yaml"), options.cache_dir)
+
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
 
+    if report:
+        return report_sources(
+            [Target(Path(section), entry) for section, entry in config.items()],
+            mapping,
+        )
+
+    targets: list[Target] = []
+    destinations: list[Path] = []
     for section, entry in config.items():
+        # The icons are generated in a staging folder, the destination stays
+        # complete until it is swapped in
         if entry["overwrite"]:
-            rmtree(section)
+            LOGGER.info('Destination "%s" is generated from scratch.', section)
         elif Path(section).exists():
             LOGGER.info('Destination "%s" exists, trying to update.', section)
+        staging = staged_build.prepare(Path(section), reuse=not entry["overwrite"])
+        targets.append(Target(staging, entry))
+        destinations.append(Path(section))
 
-        generate_destination(Path(section), entry, mapping_yaml)
-
-        generate_index_theme(Path(section), entry)
-
-        # link all the sizes to scalable
-        for folder in (
-            "8x8",
-            "16x16",
-            "16x16@2x",
-            "18x18",
-            "18x18@2x",
-            "22x22",
-            "22x22@2x",
-            "24x24",
-            "24x24@2x",
-            "32x32",
-            "32x32@2x",
-            "42x42",
-            "48x48",
-            "48x48@2x",
-            "64x64",
-            "64x64@2x",
-            "84x84",
-            "96x96",
-            "128x128",
-        ):
+    timings = BuildTimings(stages={}, entries={}, slowest=[]) if timings_file else None
+    success = generate_destinations(targets, mapping, options, jobs, timings)
+    if timings_file is not None and timings is not None:
+        report_timings(timings, timings_top)
+        timings_file.write_text(json.dumps(timings, indent=1), encoding="utf8")
+
+    build_cache = (
+        BuildCache(options.cache_dir, options.cache_size)
+        if options.cache_dir is not None
+        else None
+    )
+    for target in targets:
+        raster_directories = None
+        if target.config.get("raster", False):
+            if raster_icons.has_renderer:
+                start = time.perf_counter()
+                result = raster_icons.rasterize(
+                    target.destination,
+                    raster_icons.fixed_directories(Path("index.theme")),
+                    build_cache,
+                    jobs,
+                )
+                LOGGER.info(
+                    "Rendered %d PNG files in %s in %.1fs, %d failed.",
+                    result.rendered,
+                    target.destination,
+                    time.perf_counter() - start,
+                    result.failed,
+                )
+                raster_directories = result.directories
+                success &= not result.failed
+            else:
+                LOGGER.warning(
+                    "%s was not detected, linking the sizes of %s to scalable.",
+                    raster_icons.RENDERER,
+                    target.destination,
+                )
+        generate_index_theme(target.destination, target.config, raster_directories)
+
+        # link all the other sizes to scalable
+        raster_folders = {
+            directory.partition("/")[0] for directory in raster_directories or []
+        }
+        for folder in SIZE_FOLDERS:
+            size_folder = target.destination / folder
+            if folder in raster_folders:
+                continue
+            if size_folder.is_dir() and not size_folder.is_symlink():
+                # The PNG files of an earlier build
+                rmtree(size_folder)
             with contextlib.suppress(FileExistsError):
-                symlink("scalable", Path(section) / folder, target_is_directory=True)
+                symlink("scalable", size_folder, target_is_directory=True)
+
+        write_icon_cache(target.destination)
+
+    for target, destination in zip(targets, destinations, strict=True):
+        staged_build.swap(target.destination, destination)
+    # The symbolic icons and the PNG files share the cache and its size, so it
+    # is evicted once when both are done
+    if build_cache is not None:
+        build_cache.evict()
+
+    if archive is not None:
+        archive_destinations = [
+            destination
+            for target, destination in zip(targets, destinations, strict=True)
+            if target.config["archive"]
+        ]
+        if not archive_destinations:
+            LOGGER.warning("No destination has archive=true, not writing %s.", archive)
+        elif not write_archives(archive_destinations, archive):
+            success = False
+
+    return success
 
 
 if __name__ == "__main__":
@@ -257,8 +1026,101 @@ if __name__ == "__main__":
     _ = parser.add_argument(
         "-c", "--config-file", help="The config file to read.", type=Path
     )
+    _ = parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of entries to process in parallel, 0 uses all CPUs.",
+        type=int,
+        default=1,
+    )
+    _ = parser.add_argument(
+        "--inkscape-timeout",
+        help="Seconds to wait for Inkscape to convert an icon before restarting it.",
+        type=float,
+        default=BuildOptions().inkscape_timeout,
+    )
+    _ = parser.add_argument(
+        "--symbolic-engine",
+        help="Convert the symbolic icons with Inkscape or the built-in converter.",
+        choices=("inkscape", "native"),
+        default=BuildOptions().symbolic_engine,
+    )
+    _ = parser.add_argument(
+        "--cache-dir",
+        help="The directory to cache the symbolic icons, the mapping and the build "
+        "manifests in.",
+        type=Path,
+        default=default_cache_dir(),
+    )
+    _ = parser.add_argument(
+        "--cache-size",
+        help="The size limit of the cache in MiB.",
+        type=int,
+        default=BuildOptions().cache_size // (1024 * 1024),
+    )
+    _ = parser.add_argument(
+        "--no-cache",
+        help="Don't cache the symbolic icons, the mapping and the build manifests. "
+        "Only the missing icons are generated then.",
+        action="store_true",
+        default=False,
+    )
+    _ = parser.add_argument(
+        "--timings-json",
+        help="Save the time spent in each stage per entry to this file.",
+        type=Path,
+    )
+    _ = parser.add_argument(
+        "--timings-top",
+        help="Number of the slowest entries to report with --timings-json.",
+        type=int,
+        default=10,
+    )
+    _ = parser.add_argument(
+        "--profile",
+        help="Profile the build with cProfile and save the stats to this file. "
+        "The worker processes of --jobs aren't profiled.",
+        type=Path,
+    )
+    _ = parser.add_argument(
+        "--archive",
+        help="Pack the destinations with archive=true into archives of this name, "
+        "without the extension.",
+        type=Path,
+    )
+    _ = parser.add_argument(
+        "--report-sources",
+        help="Only report the entries without a source and the shadowed sources.",
+        action="store_true",
+        default=False,
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
 
-    main(args.config_file)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    success = main(
+        args.config_file,
+        jobs=args.jobs,
+        options=BuildOptions(
+            inkscape_timeout=args.inkscape_timeout,
+            symbolic_engine=args.symbolic_engine,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024,
+        ),
+        report=args.report_sources,
+        timings_file=args.timings_json,
+        timings_top=args.timings_top,
+        archive=args.archive,
+    )
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,417 @@
+"""A persistent index of the installed icon themes and desktop files."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser, Error as ConfigParserError
+import contextlib
+import hashlib
+import logging
+import marshal
+import os
+from pathlib import Path
+import re
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+LOGGER = logging.getLogger("icon_index")
+
+INDEX_VERSION = 3
+
+# Directories modified this recently are scanned again on the next run, their
+# mtime might not change if they are modified again within its resolution
+RACY_NS = 2_000_000_000
+
+# The kinds of directory entries in a listing
+OTHER = 0
+DIRECTORY = 1
+DIRECTORY_SYMLINK = 2
+
+
+class IconDir(NamedTuple):
+    """An icon directory and the names of its files."""
+
+    directory: Path
+    icon_type: str
+    names: list[str]
+
+
+class DesktopEntry(NamedTuple):
+    """The fields of a desktop file which are searched."""
+
+    path: Path
+    type: str | None
+    icon: str | None
+    name: str | None
+    comment: str | None
+    generic_name: str | None
+    keywords: str | None
+    startup_wm_class: str | None
+    command: str | None
+    localized_names: list[str]
+    localized_comments: list[str]
+
+
+# The keys of the [Desktop Entry] group which are read, in the field order
+_DESKTOP_KEYS = {
+    key: index
+    for index, key in enumerate(
+        (
+            "Type",
+            "Icon",
+            "Name",
+            "Comment",
+            "GenericName",
+            "Keywords",
+            "StartupWMClass",
+            "Exec",
+        )
+    )
+}
+_EXEC = _DESKTOP_KEYS["Exec"]
+
+_ESCAPES = {"s": " ", "n": "\n", "t": "\t", "r": "\r", "\\": "\\"}
+_ESCAPE = re.compile(r"\\(.)")
+
+
+def _unescape(value: str) -> str:
+    """Replace the escape sequences of a desktop file string value."""
+    if "\\" not in value:
+        return value
+    return _ESCAPE.sub(lambda match: _ESCAPES.get(match[1], match[0]), value)
+
+
+def _read_desktop_file(path: Path) -> tuple[Any, ...] | None:
+    """Read the searched fields of a desktop file, None if it isn't one.
+
+    Only the [Desktop Entry] group is read, the file isn't read any further
+    once the next group starts. Like in xdg-utils, the first value of a key
+    which is set twice wins instead of making the file invalid.
+    """
+    fields: list[str | None] = [None] * len(_DESKTOP_KEYS)
+    localized: dict[str, list[str]] = {"Name": [], "Comment": []}
+    in_group = found = False
+    try:
+        with path.open(encoding="utf8", errors="replace") as desktop_file:
+            for raw_line in desktop_file:
+                line = raw_line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("["):
+                    if in_group:
+                        break
+                    in_group = found = line == "[Desktop Entry]"
+                    continue
+                if not in_group:
+                    continue
+                key, separator, value = line.partition("=")
+                if not separator:
+                    continue
+                key = key.rstrip()
+                value = value.lstrip()
+                base_key, bracket, _ = key.partition("[")
+                if bracket:
+                    if base_key in localized:
+                        localized[base_key].append(_unescape(value))
+                    continue
+                index = _DESKTOP_KEYS.get(key)
+                if index is not None and fields[index] is None:
+                    # Exec has its own quoting rules, it is kept as it is
+                    fields[index] = value if index == _EXEC else _unescape(value)
+    except OSError as err:
+        LOGGER.debug("Can't read %s: %s", path, err)
+        return None
+    if not found:
+        return None
+    return (*fields, localized["Name"], localized["Comment"])
+
+
+def _read_index_theme(path: Path) -> list[tuple[str, str]] | None:
+    """Read the directories and their context of an index.theme file."""
+    config = ConfigParser()
+    try:
+        if (
+            str(path) not in config.read(path)
+            or "Icon Theme" not in config
+            or "Directories" not in config["Icon Theme"]
+        ):
+            # Not an icon theme file
+            return None
+        return [
+            (directory, config[directory]["Context"])
+            for directory in config["Icon Theme"]["Directories"].split(",")
+            if directory in config and "Context" in config[directory]
+        ]
+    except (ConfigParserError, UnicodeDecodeError) as err:
+        LOGGER.debug("Can't read %s: %s", path, err)
+        return None
+
+
+class IconIndex:
+    """An index of icon directories and desktop files, saved between runs.
+
+    A directory is only listed again if its mtime changed, an index.theme or
+    desktop file is only parsed again if its mtime or size changed. Entries
+    which weren't visited by a run are dropped when the index is saved.
+    """
+
+    def __init__(self, cache_file: Path | None) -> None:
+        """Load the index, it isn't saved if ``cache_file`` is None."""
+        self.cache_file = cache_file
+        self._old: dict[str, dict[str, Any]] = {}
+        self._new: dict[str, dict[str, Any]] = {}
+        self._dirty = False
+        if cache_file is None:
+            return
+        try:
+            data = marshal.loads(cache_file.read_bytes())  # noqa: S302
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+        if isinstance(data, dict) and data.get("version") == INDEX_VERSION:
+            self._old = data["sections"]
+
+    def _lookup(self, section: str, key: str, validator: object) -> Any:  # noqa: ANN401
+        """Get a cached value, if it was stored with the same validator."""
+        cached = self._new.get(section, {}).get(key)
+        if cached is not None:
+            # Already scanned in this run
+            return cached[1]
+        cached = self._old.get(section, {}).get(key)
+        if cached is not None and cached[0] == validator:
+            self._new.setdefault(section, {})[key] = cached
+            return cached[1]
+        return None
+
+    def _store(self, section: str, key: str, validator: object, value: object) -> None:
+        self._new.setdefault(section, {})[key] = (validator, value)
+        self._dirty = True
+
+    def _listdir(self, section: str, path: Path) -> list[tuple[str, int]]:
+        """List the names of a directory and their kind."""
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            # Kept as well, so the fingerprint changes when it's created
+            if self._lookup(section, str(path), None) is None:
+                self._store(section, str(path), None, [])
+            return []
+        cached = self._lookup(section, str(path), mtime_ns)
+        if cached is not None:
+            return cached
+
+        listing: list[tuple[str, int]] = []
+        with contextlib.suppress(OSError), os.scandir(path) as dir_entries:
+            for dir_entry in dir_entries:
+                kind = OTHER
+                with contextlib.suppress(OSError):
+                    if dir_entry.is_dir():
+                        kind = (
+                            DIRECTORY_SYMLINK if dir_entry.is_symlink() else DIRECTORY
+                        )
+                listing.append((dir_entry.name, kind))
+        if time.time_ns() - mtime_ns < RACY_NS:
+            mtime_ns = -1
+        self._store(section, str(path), mtime_ns, listing)
+        return listing
+
+    def _parsed(self, section: str, path: Path, parser: Any) -> Any:  # noqa: ANN401
+        """Parse a file with ``parser``, the result is reused while it's unchanged."""
+        return self._parsed_many(section, [path], parser)[0]
+
+    def _parsed_many(
+        self, section: str, paths: list[Path], parser: Callable[[Path], Any]
+    ) -> list[Any]:
+        """Parse files with ``parser``, the results are reused while they're unchanged.
+
+        The files which changed are parsed concurrently.
+        """
+        values: list[Any] = [None] * len(paths)
+        changed: list[tuple[int, Path, tuple[int, int]]] = []
+        for position, path in enumerate(paths):
+            try:
+                file_stat = path.stat()
+            except OSError:
+                continue
+            validator = (file_stat.st_mtime_ns, file_stat.st_size)
+            cached = self._lookup(section, str(path), validator)
+            if cached is not None:
+                values[position] = cached[0]
+            else:
+                changed.append((position, path, validator))
+
+        if len(changed) > 1:
+            with ThreadPoolExecutor() as executor:
+                parsed = list(executor.map(parser, (path for _, path, _ in changed)))
+        else:
+            parsed = [parser(path) for _, path, _ in changed]
+
+        now = time.time_ns()
+        for (position, path, validator), value in zip(changed, parsed, strict=True):
+            values[position] = value
+            if now - validator[0] < RACY_NS:
+                validator = (-1, -1)  # noqa: PLW2901
+            # Wrapped in a tuple, so a file which isn't valid is cached as well
+            self._store(section, str(path), validator, (value,))
+        return values
+
+    def _kinds(
+        self, directory: Path, memo: dict[Path, dict[str, int]]
+    ) -> dict[str, int]:
+        """Get the kinds of the entries of a directory from its listing."""
+        if directory not in memo:
+            memo[directory] = dict(self._listdir("icon_dirs", directory))
+        return memo[directory]
+
+    def _theme_icon_dirs(self, theme_file: Path) -> list[IconDir]:
+        """Get the icon directories of a theme.
+
+        Whether a directory or its parent is a symlink is looked up in the
+        listing of its parent, so the theme is walked with one scan per folder.
+        """
+        directories = self._parsed("index_themes", theme_file, _read_index_theme)
+        if directories is None:
+            return []
+
+        memo: dict[Path, dict[str, int]] = {}
+        icon_dirs: list[IconDir] = []
+        for directory, context in directories:
+            dir_path = theme_file.parent / directory
+            if (
+                self._kinds(dir_path.parent, memo).get(dir_path.name) != DIRECTORY
+                or self._kinds(dir_path.parent.parent, memo).get(dir_path.parent.name)
+                == DIRECTORY_SYMLINK
+            ):
+                continue
+            icon_dirs.append(
+                IconDir(
+                    directory=dir_path,
+                    icon_type=context,
+                    names=list(self._kinds(dir_path, memo)),
+                )
+            )
+        return icon_dirs
+
+    def _hicolor_icon_dirs(
+        self, hicolor_dir: Path, icon_types: dict[str, str]
+    ) -> list[IconDir]:
+        """Get the icon directories of a theme without index.theme file.
+
+        The directories are named after their context.
+        """
+        contexts: dict[str, str] = {}
+        for context, folder in icon_types.items():
+            _ = contexts.setdefault(folder, context)
+
+        memo: dict[Path, dict[str, int]] = {}
+        icon_dirs: list[IconDir] = []
+        for size, size_kind in self._kinds(hicolor_dir, memo).items():
+            if size_kind == OTHER:
+                continue
+            for folder, kind in self._kinds(hicolor_dir / size, memo).items():
+                if kind == OTHER or folder not in contexts:
+                    continue
+                icon_dirs.append(
+                    IconDir(
+                        directory=hicolor_dir / size / folder,
+                        icon_type=contexts[folder],
+                        names=list(self._kinds(hicolor_dir / size / folder, memo)),
+                    )
+                )
+        return icon_dirs
+
+    def icon_dirs(
+        self, theme_dirs: list[Path], hicolor_dir: Path, icon_types: dict[str, str]
+    ) -> list[IconDir]:
+        """Get the icon directories of all themes with their context.
+
+        Symlinked directories are skipped, because some themes link them to
+        other contexts. The themes are scanned concurrently.
+        """
+        theme_files = sorted(
+            {
+                theme_dir / name / "index.theme"
+                for theme_dir in theme_dirs
+                for name, _ in self._listdir("icon_dirs", theme_dir)
+            }
+        )
+        with ThreadPoolExecutor() as executor:
+            hicolor_dirs = executor.submit(
+                self._hicolor_icon_dirs, hicolor_dir, icon_types
+            )
+            icon_dirs = [
+                icon_dir
+                for theme_icon_dirs in executor.map(self._theme_icon_dirs, theme_files)
+                for icon_dir in theme_icon_dirs
+            ]
+            icon_dirs += hicolor_dirs.result()
+
+        self._save("icon_dirs", "index_themes")
+        return icon_dirs
+
+    def desktop_entries(self, application_dirs: list[Path]) -> list[DesktopEntry]:
+        """Get the desktop files in the application directories and below."""
+        desktop_files: set[Path] = set()
+        for application_dir in application_dirs:
+            pending = [application_dir]
+            while pending:
+                directory = pending.pop()
+                for name, kind in self._listdir("application_dirs", directory):
+                    # Like glob("**"), symlinks to directories aren't followed
+                    if kind == DIRECTORY:
+                        pending.append(directory / name)
+                    if name.lower().endswith(".desktop"):
+                        desktop_files.add(directory / name)
+
+        paths = sorted(desktop_files)
+        entries = [
+            DesktopEntry(desktop_file, *fields)
+            for desktop_file, fields in zip(
+                paths,
+                self._parsed_many("desktop_files", paths, _read_desktop_file),
+                strict=True,
+            )
+            if fields is not None
+        ]
+
+        self._save("application_dirs", "desktop_files")
+        return entries
+
+    def fingerprint(self, *sections: str) -> str | None:
+        """Get a hash of the validators of the entries of the sections.
+
+        It changes when a directory or file of the sections changed, so results
+        derived from them can be saved along with it. None if an entry was
+        modified too recently to tell.
+        """
+        digest = hashlib.sha256()
+        for section in sections:
+            for key, (validator, _) in sorted(self._old.get(section, {}).items()):
+                if validator in {-1, (-1, -1)}:
+                    return None
+                digest.update(f"{section}\0{key}\0{validator}\0".encode())
+        return digest.hexdigest()
+
+    def _save(self, *sections: str) -> None:
+        """Save the index, the entries of the sections which weren't visited are dropped."""
+        for section in sections:
+            if self._old.get(section, {}).keys() != self._new.get(section, {}).keys():
+                self._dirty = True
+            self._old[section] = self._new.pop(section, {})
+        if self.cache_file is None or not self._dirty:
+            return
+        self._dirty = False
+
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_file.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as tmp_file:
+                marshal.dump(
+                    {"version": INDEX_VERSION, "sections": self._old}, tmp_file
+                )
+            Path(tmp_name).replace(self.cache_file)
+        except OSError as err:
+            LOGGER.warning("Couldn't save the icon index: %s", err)
@@ -0,0 +1,446 @@
+#!/usr/bin/python3
+"""Simulate the icon lookups of a desktop against a generated theme.
+
+The lookup follows the freedesktop icon theme specification: the theme and
+the themes it inherits from are searched in order, then hicolor and the
+unthemed icons. Every file system call of the lookup is counted, so layouts of
+the theme can be compared before they are shipped. Without a cache every
+candidate file is checked with a stat call, like the algorithm of the
+specification. With a cache the icon-theme.cache file of a theme answers
+which icons are in its directories, like in GTK.
+"""
+
+# Example usage:
+#   python scripts/icon_lookup_sim.py arcticons-dark --theme-path /tmp/themes
+#   python scripts/icon_lookup_sim.py arcticons-dark --size 16 --size 48 --json out.json
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from collections import Counter
+from configparser import ConfigParser, Error as ConfigParserError
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import NamedTuple, TypedDict
+
+from icon_mapping import load_mapping
+from icon_theme_cache import CACHE_FILE, SUFFIX_FLAGS, IconCacheError, read_cache
+
+LOGGER = logging.getLogger("icon_lookup_sim")
+
+# The extensions in the order of the specification
+EXTENSIONS = ("png", "svg", "xpm")
+
+# The name the lookups resolved by the unthemed icons are counted under
+UNTHEMED = "(unthemed)"
+MISSING = "(missing)"
+
+
+class IconDirectory(NamedTuple):
+    """A directory of a theme and the sizes of its icons."""
+
+    name: str
+    type: str
+    size: int
+    min_size: int
+    max_size: int
+    threshold: int
+    scale: int
+
+    def matches_size(self, size: int, scale: int) -> bool:
+        """Check if the icons of the directory have the size, DirectoryMatchesSize."""
+        if self.scale != scale:
+            return False
+        if self.type == "Fixed":
+            return self.size == size
+        if self.type == "Scalable":
+            return self.min_size <= size <= self.max_size
+        return self.size - self.threshold <= size <= self.size + self.threshold
+
+    def size_distance(self, size: int, scale: int) -> int:
+        """Get how far the icon size is off, DirectorySizeDistance."""
+        pixels = size * scale
+        if self.type == "Fixed":
+            return abs(self.size * self.scale - pixels)
+        if self.type == "Scalable":
+            low, high = self.min_size, self.max_size
+        else:
+            low, high = self.size - self.threshold, self.size + self.threshold
+        if pixels < low * self.scale:
+            return low * self.scale - pixels
+        if pixels > high * self.scale:
+            return pixels - high * self.scale
+        return 0
+
+
+class _CachedIcons(NamedTuple):
+    """The icons of an icon-theme.cache file, by directory name."""
+
+    directories: set[str]
+    icons: dict[str, dict[str, int]]
+
+
+class Theme(NamedTuple):
+    """A theme, in all base directories which have a folder of it."""
+
+    name: str
+    paths: list[Path]
+    directories: list[IconDirectory]
+    parents: list[str]
+    # The cache of every path, None if it doesn't have a valid one
+    caches: list[_CachedIcons | None]
+
+
+class LookupStats(TypedDict):
+    """The results of replaying the lookups."""
+
+    mode: str
+    lookups: int
+    seconds: float
+    lookups_per_second: float
+    setup_syscalls: int
+    syscalls: int
+    syscalls_per_lookup: float
+    # The share of the lookups each theme resolved
+    resolved_by: dict[str, float]
+
+
+class Simulator:
+    """Look up icons like a desktop does and count the file system calls."""
+
+    def __init__(self, search_path: list[Path], *, use_cache: bool) -> None:
+        """Initialize the simulator, the themes are loaded on their first lookup."""
+        self.search_path = search_path
+        self.use_cache = use_cache
+        self.syscalls = 0
+        self.themes: dict[str, Theme | None] = {}
+
+    def _exists(self, path: Path) -> bool:
+        self.syscalls += 1
+        try:
+            _ = path.stat()
+        except OSError:
+            return False
+        return True
+
+    def _read(self, path: Path) -> bytes | None:
+        # open, fstat, read and close
+        self.syscalls += 4
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def _load_cache(self, path: Path) -> _CachedIcons | None:
+        """Load the cache of a theme path, None if it is missing or outdated."""
+        self.syscalls += 2
+        try:
+            if (path / CACHE_FILE).stat().st_mtime_ns < path.stat().st_mtime_ns:
+                return None
+        except OSError:
+            return None
+        data = self._read(path / CACHE_FILE)
+        if data is None:
+            return None
+        try:
+            directories, icons = read_cache(data)
+        except (IconCacheError, UnicodeDecodeError) as err:
+            LOGGER.warning("Can't read %s: %s", path / CACHE_FILE, err)
+            return None
+        return _CachedIcons(
+            directories=set(directories),
+            icons={
+                name: {directories[index]: flag for index, flag in flags.items()}
+                for name, flags in icons.items()
+            },
+        )
+
+    def theme(self, name: str) -> Theme | None:
+        """Load a theme, None if no base directory has it."""
+        if name in self.themes:
+            return self.themes[name]
+        paths = [base / name for base in self.search_path if self._exists(base / name)]
+        config = ConfigParser()
+        config.optionxform = lambda optionstr: optionstr
+        for path in paths:
+            data = self._read(path / "index.theme")
+            if data is None:
+                continue
+            try:
+                config.read_string(data.decode())
+            except (ConfigParserError, UnicodeDecodeError) as err:
+                LOGGER.warning("Can't read %s: %s", path / "index.theme", err)
+                continue
+            break
+        if "Icon Theme" not in config:
+            self.themes[name] = None
+            return None
+
+        directories: list[IconDirectory] = []
+        for directory in config["Icon Theme"].get("Directories", "").split(","):
+            if directory not in config:
+                continue
+            section = config[directory]
+            size = int(section.get("Size", "0"))
+            directories.append(
+                IconDirectory(
+                    name=directory,
+                    type=section.get("Type", "Threshold"),
+                    size=size,
+                    min_size=int(section.get("MinSize", str(size))),
+                    max_size=int(section.get("MaxSize", str(size))),
+                    threshold=int(section.get("Threshold", "2")),
+                    scale=int(section.get("Scale", "1")),
+                )
+            )
+        parents = [
+            parent.strip()
+            for parent in config["Icon Theme"].get("Inherits", "").split(",")
+            if parent.strip()
+        ]
+        theme = Theme(
+            name=name,
+            paths=paths,
+            directories=directories,
+            parents=parents,
+            caches=[
+                self._load_cache(path) if self.use_cache else None for path in paths
+            ],
+        )
+        self.themes[name] = theme
+        return theme
+
+    def load_themes(self, theme_name: str) -> None:
+        """Load a theme, the themes it inherits from and hicolor."""
+        pending = [theme_name, "hicolor"]
+        while pending:
+            name = pending.pop()
+            if name in self.themes:
+                continue
+            theme = self.theme(name)
+            if theme is not None:
+                pending += theme.parents
+
+    def _has_icon(
+        self, theme: Theme, directory: IconDirectory, icon: str, extension: str
+    ) -> Path | None:
+        """Get the file of an icon in a directory of a theme, if it has one."""
+        for path, cached in zip(theme.paths, theme.caches, strict=True):
+            if cached is not None and directory.name in cached.directories:
+                flags = cached.icons.get(icon, {}).get(directory.name, 0)
+                if flags & SUFFIX_FLAGS[f".{extension}"]:
+                    return path / directory.name / f"{icon}.{extension}"
+            elif self._exists(path / directory.name / f"{icon}.{extension}"):
+                return path / directory.name / f"{icon}.{extension}"
+        return None
+
+    def lookup_icon(
+        self, theme: Theme, icon: str, size: int, scale: int
+    ) -> Path | None:
+        """Find an icon in a theme, LookupIcon of the specification."""
+        for directory in theme.directories:
+            if not directory.matches_size(size, scale):
+                continue
+            for extension in EXTENSIONS:
+                file = self._has_icon(theme, directory, icon, extension)
+                if file is not None:
+                    return file
+
+        closest: Path | None = None
+        minimal_distance = sys.maxsize
+        for directory in theme.directories:
+            distance = directory.size_distance(size, scale)
+            if distance >= minimal_distance:
+                continue
+            for extension in EXTENSIONS:
+                file = self._has_icon(theme, directory, icon, extension)
+                if file is not None:
+                    closest = file
+                    minimal_distance = distance
+                    break
+        return closest
+
+    def _find_icon_helper(
+        self, icon: str, size: int, scale: int, theme_name: str, visited: set[str]
+    ) -> tuple[Path, str] | None:
+        if theme_name in visited:
+            return None
+        visited.add(theme_name)
+        theme = self.theme(theme_name)
+        if theme is None:
+            return None
+        file = self.lookup_icon(theme, icon, size, scale)
+        if file is not None:
+            return file, theme_name
+        for parent in theme.parents:
+            found = self._find_icon_helper(icon, size, scale, parent, visited)
+            if found is not None:
+                return found
+        return None
+
+    def find_icon(
+        self, icon: str, size: int, scale: int, theme_name: str
+    ) -> tuple[Path | None, str]:
+        """Find an icon, FindIcon of the specification.
+
+        Returns the file and the theme which had it.
+        """
+        visited: set[str] = set()
+        for name in (theme_name, "hicolor"):
+            found = self._find_icon_helper(icon, size, scale, name, visited)
+            if found is not None:
+                return found
+        for base in self.search_path:
+            for extension in EXTENSIONS:
+                if self._exists(base / f"{icon}.{extension}"):
+                    return base / f"{icon}.{extension}", UNTHEMED
+        return None, MISSING
+
+
+def replay(  # noqa: PLR0913
+    destination: Path,
+    search_path: list[Path],
+    names: list[str],
+    sizes: list[int],
+    scale: int,
+    *,
+    use_cache: bool,
+) -> LookupStats:
+    """Look up every name at every size in the destination theme."""
+    simulator = Simulator([destination.parent, *search_path], use_cache=use_cache)
+    # Loading the themes isn't part of the lookups, they are loaded once
+    simulator.load_themes(destination.name)
+    setup_syscalls = simulator.syscalls
+    simulator.syscalls = 0
+
+    resolved_by: Counter[str] = Counter()
+    start = time.perf_counter()
+    for size in sizes:
+        for name in names:
+            _, theme_name = simulator.find_icon(name, size, scale, destination.name)
+            resolved_by[theme_name] += 1
+    seconds = time.perf_counter() - start
+
+    lookups = len(names) * len(sizes)
+    return LookupStats(
+        mode="cache" if use_cache else "stat",
+        lookups=lookups,
+        seconds=seconds,
+        lookups_per_second=lookups / seconds if seconds else 0.0,
+        setup_syscalls=setup_syscalls,
+        syscalls=simulator.syscalls,
+        syscalls_per_lookup=simulator.syscalls / lookups if lookups else 0.0,
+        resolved_by={
+            theme_name: count / lookups for theme_name, count in resolved_by.items()
+        },
+    )
+
+
+def mapping_names(mapping_file: Path, misses: int) -> list[str]:
+    """Get the icon names of the mapping and names of icons which don't exist."""
+    names = {
+        dest.rpartition("/")[2]
+        for dests in load_mapping(mapping_file, None).values()
+        for dest in dests
+    }
+    return sorted(names) + [f"arcticons-missing-{index}" for index in range(misses)]
+
+
+def report(results: list[LookupStats]) -> None:
+    """Print the results of the modes side by side."""
+    print(
+        f"{'mode':<6} {'lookups':>8} {'lookups/s':>11} {'syscalls/lookup':>16} "
+        f"{'setup syscalls':>15}"
+    )
+    for result in results:
+        print(
+            f"{result['mode']:<6} {result['lookups']:>8} "
+            f"{result['lookups_per_second']:>11.0f} "
+            f"{result['syscalls_per_lookup']:>16.2f} {result['setup_syscalls']:>15}"
+        )
+    for result in results:
+        print(f"Resolved by ({result['mode']}):")
+        for theme_name, share in sorted(
+            result["resolved_by"].items(), key=lambda item: -item[1]
+        ):
+            print(f"\t{theme_name:<24} {share:>7.1%}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = ArgumentParser()
+    _ = parser.add_argument(
+        "destination", help="The generated theme to look the icons up in.", type=Path
+    )
+    _ = parser.add_argument(
+        "--theme-path",
+        help="A folder with the inherited themes, like /usr/share/icons. Can be "
+        "repeated, the folders are searched in order.",
+        type=Path,
+        action="append",
+        default=[],
+    )
+    _ = parser.add_argument(
+        "--names",
+        help="A file with the icon names to look up, one per line. The names of "
+        "the mapping are looked up by default.",
+        type=Path,
+    )
+    _ = parser.add_argument(
+        "--mapping", help="The mapping file.", type=Path, default=Path("mapping.yaml")
+    )
+    _ = parser.add_argument(
+        "--misses",
+        help="Number of names of icons which don't exist to add to the mapping names.",
+        type=int,
+        default=100,
+    )
+    _ = parser.add_argument(
+        "--size",
+        help="The icon size to look up, can be repeated.",
+        type=int,
+        action="append",
+        dest="sizes",
+    )
+    _ = parser.add_argument("--scale", help="The icon scale.", type=int, default=1)
+    _ = parser.add_argument(
+        "--mode",
+        help="Look up with stat calls, with the icon caches or both.",
+        choices=("stat", "cache", "both"),
+        default="both",
+    )
+    _ = parser.add_argument("--json", help="Save the results to this file.", type=Path)
+    args = parser.parse_args()
+
+    if not (args.destination / "index.theme").is_file():
+        LOGGER.error("%s isn't an icon theme.", args.destination)
+        sys.exit(1)
+    if args.names is not None:
+        icon_names = args.names.read_text(encoding="utf8").split()
+    else:
+        icon_names = mapping_names(args.mapping, args.misses)
+    theme_path = args.theme_path or [
+        Path(os.environ.get("XDG_DATA_HOME") or Path.home() / ".local/share") / "icons",
+        Path("/usr/share/icons"),
+    ]
+
+    stats = [
+        replay(
+            args.destination.resolve(),
+            theme_path,
+            icon_names,
+            args.sizes or [48],
+            args.scale,
+            use_cache=mode == "cache",
+        )
+        for mode in ("stat", "cache")
+        if args.mode in {mode, "both"}
+    ]
+    report(stats)
+    if args.json is not None:
+        args.json.write_text(json.dumps(stats, indent=1), encoding="utf8")
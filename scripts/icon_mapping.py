@@ -0,0 +1,146 @@
+"""Load the mapping of the icons to the names they are installed as."""
+
+from __future__ import annotations
+
+from collections import abc
+from functools import cached_property
+import hashlib
+import logging
+import marshal
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import TYPE_CHECKING
+
+import yaml
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+LOGGER = logging.getLogger("icon_mapping")
+
+# The C loader of libyaml is a lot faster, if PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+CACHE_VERSION = 1
+
+# A file modified this recently is hashed again on the next load, its mtime
+# might not change if it is modified again within its resolution
+RACY_NS = 2_000_000_000
+
+
+class Mapping(abc.Mapping[str, list[str]]):
+    """The mapping of entries to their destinations, like ``apps/firefox``.
+
+    It is a read only dict of the entries, with views to look up the entry of
+    a destination and the entries of a context.
+    """
+
+    def __init__(self, entries: dict[str, list[str]]) -> None:
+        """Wrap the parsed mapping file."""
+        self.entries = entries
+
+    def __getitem__(self, entry: str) -> list[str]:
+        """Get the destinations of an entry."""
+        return self.entries[entry]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the entries in the order of the file."""
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        """Get the number of entries."""
+        return len(self.entries)
+
+    @cached_property
+    def reverse(self) -> dict[str, str]:
+        """Map every destination to its entry.
+
+        If a destination is in multiple entries, which validate_mapping reports,
+        the first entry wins.
+        """
+        reverse: dict[str, str] = {}
+        for entry, dests in self.entries.items():
+            for dest in dests:
+                _ = reverse.setdefault(dest, entry)
+        return reverse
+
+    def entry_of(self, dest: str) -> str | None:
+        """Get the entry of a destination, None if it isn't mapped."""
+        return self.reverse.get(dest)
+
+    @cached_property
+    def contexts(self) -> dict[str, dict[str, list[str]]]:
+        """Map every context folder, like ``apps``, to the icon names of the entries."""
+        contexts: dict[str, dict[str, list[str]]] = {}
+        for entry, dests in self.entries.items():
+            for dest in dests:
+                context, _, name = dest.partition("/")
+                contexts.setdefault(context, {}).setdefault(entry, []).append(name)
+        return contexts
+
+    def context(self, context: str) -> dict[str, list[str]]:
+        """Get the entries with an icon in a context folder and their icon names."""
+        return self.contexts.get(context, {})
+
+
+def _cache_file(cache_dir: Path, mapping_file: Path) -> Path:
+    """Get the cache file of a mapping file, each mapping file has its own."""
+    path_hash = hashlib.sha256(str(mapping_file.resolve()).encode()).hexdigest()
+    return cache_dir / f"mapping-{path_hash[:16]}"
+
+
+def _parse(data: bytes) -> dict[str, list[str]]:
+    return yaml.load(data, Loader=YAML_LOADER) or {}  # noqa: S506
+
+
+def load_mapping(mapping_file: Path, cache_dir: Path | None) -> Mapping:
+    """Load a mapping file, the parsed mapping is cached in ``cache_dir``.
+
+    The cached mapping is used as long as the mtime and size of the file are
+    the same. Otherwise the file is only parsed again if its hash changed.
+    Without ``cache_dir`` the file is always parsed.
+    """
+    if cache_dir is None:
+        return Mapping(_parse(mapping_file.read_bytes()))
+
+    file_stat = mapping_file.stat()
+    validator = (file_stat.st_mtime_ns, file_stat.st_size)
+    cache_file = _cache_file(cache_dir, mapping_file)
+    try:
+        cached = marshal.loads(cache_file.read_bytes())  # noqa: S302
+    except (OSError, EOFError, ValueError, TypeError):
+        cached = None
+    if not isinstance(cached, dict) or cached.get("version") != CACHE_VERSION:
+        cached = {}
+    if cached.get("validator") == validator:
+        return Mapping(cached["entries"])
+
+    data = mapping_file.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    if cached.get("sha256") == digest:
+        entries = cached["entries"]
+    else:
+        LOGGER.debug("Parsing %s", mapping_file)
+        entries = _parse(data)
+
+    if time.time_ns() - file_stat.st_mtime_ns < RACY_NS:
+        validator = (-1, -1)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as tmp_file:
+            marshal.dump(
+                {
+                    "version": CACHE_VERSION,
+                    "validator": validator,
+                    "sha256": digest,
+                    "entries": entries,
+                },
+                tmp_file,
+            )
+        Path(tmp_name).replace(cache_file)
+    except OSError as err:
+        LOGGER.warning("Couldn't cache the mapping: %s", err)
+    return Mapping(entries)
@@ -5,10 +5,20 @@
 from __future__ import annotations
 
 import argparse
-from configparser import ConfigParser
+import fnmatch
+from functools import cache
+import json
 from pathlib import Path
+import re
+import shlex
+import sys
 from typing import NamedTuple
 
+from aho_corasick import AhoCorasick
+from build_cache import default_cache_dir
+from icon_index import DesktopEntry, IconDir, IconIndex
+from trigram_index import TrigramIndex
+
 # Mapping of Icon Contexts to folder names
 ICON_TYPES = {
     "Actions": "actions",
@@ -23,165 +33,330 @@ ICON_TYPES = {
     "Status": "status",
 }
 
+# The folders which are searched for desktop files and icon themes
+APPLICATION_DIRS = [
+    Path("/usr/share/applications"),
+    Path("~/.local/share/applications").expanduser(),
+]
+ICON_THEME_DIRS = [
+    Path("/usr/share/icons"),
+    Path("~/.local/share/icons").expanduser(),
+]
+LOCAL_HICOLOR_DIR = Path("~/.local/share/icons/hicolor").expanduser()
+
+# The index of the folders above is kept here between searches, None disables it
+INDEX_FILE: Path | None = default_cache_dir() / "icon-search-index"
+
+# Fuzzy searches look at this many times more texts than results, because a
+# mapping has multiple texts
+FUZZY_OVERFETCH = 4
+
+# Below this number of queries, testing each query is faster than the automaton
+AHO_CORASICK_MIN_QUERIES = 8
+
+
+@cache
+def _icon_index(index_file: Path | None) -> IconIndex:
+    """Get the index of the icon themes and desktop files."""
+    return IconIndex(index_file)
+
 
-class IconDirEntry(NamedTuple):
-    """An icon directory entry."""
+def _desktop_mapping(desktop_entry: DesktopEntry) -> str | None:
+    """Get the mapping of a desktop file, None if it doesn't have a themed icon."""
+    if (
+        desktop_entry.icon is None
+        or desktop_entry.type is None
+        or "/" in desktop_entry.icon
+        or desktop_entry.type not in ICON_TYPES
+    ):
+        return None
+    return f"{ICON_TYPES[desktop_entry.type]}/{desktop_entry.icon}"
 
-    directory: Path
-    icon_type: str
+
+class _QueryMatcher:
+    """Match many queries against names in one pass.
+
+    The literal queries are found with an Aho-Corasick automaton once there
+    are enough of them, queries with glob characters are matched one by one.
+    """
+
+    def __init__(self, queries: list[str], *, fold_case: bool, globs: bool) -> None:
+        self.fold_case = fold_case
+        self._literals: dict[str, list[str]] = {}
+        self._globs: list[tuple[re.Pattern[str], str]] = []
+        self._always: list[str] = []
+        for query in dict.fromkeys(queries):
+            key = query.lower() if fold_case else query
+            if globs and any(char in key for char in "*?["):
+                self._globs.append((re.compile(fnmatch.translate(f"*{key}*")), query))
+            elif not key:
+                self._always.append(query)
+            else:
+                self._literals.setdefault(key, []).append(query)
+        self._automaton = (
+            AhoCorasick(self._literals)
+            if len(self._literals) > AHO_CORASICK_MIN_QUERIES
+            else None
+        )
+
+    def matches(self, text: str) -> list[str]:
+        """Get the queries which match the text."""
+        if self.fold_case:
+            text = text.lower()
+        found = list(self._always)
+        keys = (
+            self._automaton.find(text)
+            if self._automaton is not None
+            else [key for key in self._literals if key in text]
+        )
+        for key in keys:
+            found += self._literals[key]
+        found += [query for pattern, query in self._globs if pattern.match(text)]
+        return found
+
+
+def deep_search_desktop_files_batch(
+    appnames: list[str],
+) -> dict[str, dict[str, list[Path]]]:
+    """Search for many icon names in desktop file names and descriptions.
+
+    The translated names and descriptions are searched as well.
+    """
+    matcher = _QueryMatcher(appnames, fold_case=True, globs=False)
+    results: dict[str, dict[str, list[Path]]] = {appname: {} for appname in appnames}
+
+    for desktop_entry in _icon_index(INDEX_FILE).desktop_entries(APPLICATION_DIRS):
+        mapping_str = _desktop_mapping(desktop_entry)
+        if mapping_str is None:
+            continue
+        found = {
+            appname
+            for text in (
+                desktop_entry.name,
+                desktop_entry.comment,
+                *desktop_entry.localized_names,
+                *desktop_entry.localized_comments,
+            )
+            if text is not None
+            for appname in matcher.matches(text)
+        }
+        for appname in found:
+            results[appname].setdefault(mapping_str, []).append(desktop_entry.path)
+
+    return results
 
 
 def deep_search_desktop_files(appname: str) -> dict[str, list[Path]]:
     """Search for icon names in desktop file names and descriptions."""
+    return deep_search_desktop_files_batch([appname])[appname]
 
-    desktop_files = {
-        *set(
-            Path("/usr/share/applications").glob("**/*.desktop", case_sensitive=False)
-        ),
-        *set(
-            Path("~/.local/share/applications")
-            .expanduser()
-            .glob("**/*.desktop", case_sensitive=False)
-        ),
-    }
 
-    entries: dict[str, list[Path]] = {}
-
-    for desktop_file in desktop_files:
-        desktop_file_config = ConfigParser()
-        _ = desktop_file_config.read(desktop_file)
-        if (
-            "Desktop Entry" not in desktop_file_config
-            or "Icon" not in desktop_file_config["Desktop Entry"]
-            or "Type" not in desktop_file_config["Desktop Entry"]
-            or "/" in desktop_file_config["Desktop Entry"]["Icon"]
-            or desktop_file_config["Desktop Entry"]["Type"] not in ICON_TYPES
-        ):
+def search_desktop_files_batch(
+    appnames: list[str],
+) -> dict[str, dict[str, list[Path]]]:
+    """Search for many icon names in the names of desktop files."""
+
+    matcher = _QueryMatcher(appnames, fold_case=True, globs=True)
+    results: dict[str, dict[str, list[Path]]] = {appname: {} for appname in appnames}
+
+    for desktop_entry in _icon_index(INDEX_FILE).desktop_entries(APPLICATION_DIRS):
+        # Like the glob *{appname}*.desktop, the appname is in the file stem
+        stem = desktop_entry.path.name[: -len(".desktop")]
+        found = matcher.matches(stem)
+        if not found:
             continue
-        if (
-            "Name" not in desktop_file_config["Desktop Entry"]
-            or appname.lower()
-            not in desktop_file_config["Desktop Entry"]["Name"].lower()
-        ) and (
-            "Comment" not in desktop_file_config["Desktop Entry"]
-            or appname.lower()
-            not in desktop_file_config["Desktop Entry"]["Comment"].lower()
-        ):
+        mapping_str = _desktop_mapping(desktop_entry)
+        if mapping_str is None:
             continue
-        mapping_str = f"{ICON_TYPES[desktop_file_config['Desktop Entry']['Type']]}/{desktop_file_config['Desktop Entry']['Icon']}"
-        if mapping_str in entries:
-            entries[mapping_str].append(desktop_file)
-        else:
-            entries[mapping_str] = [desktop_file]
+        for appname in found:
+            results[appname].setdefault(mapping_str, []).append(desktop_entry.path)
 
-    return entries
+    return results
 
 
 def search_desktop_files(appname: str) -> dict[str, list[Path]]:
     """Search for icon names in desktop files."""
+    return search_desktop_files_batch([appname])[appname]
 
-    desktop_files = {
-        *set(
-            Path("/usr/share/applications").glob(
-                f"**/*{appname}*.desktop", case_sensitive=False
-            )
-        ),
-        *set(
-            Path("~/.local/share/applications")
-            .expanduser()
-            .glob(f"**/*{appname}*.desktop", case_sensitive=False)
-        ),
-    }
 
-    entries: dict[str, list[Path]] = {}
-
-    for desktop_file in desktop_files:
-        desktop_file_config = ConfigParser()
-        _ = desktop_file_config.read(desktop_file)
-        if (
-            "Desktop Entry" not in desktop_file_config
-            or "Icon" not in desktop_file_config["Desktop Entry"]
-            or "Type" not in desktop_file_config["Desktop Entry"]
-            or "/" in desktop_file_config["Desktop Entry"]["Icon"]
-            or desktop_file_config["Desktop Entry"]["Type"] not in ICON_TYPES
-        ):
-            continue
-        mapping_str = f"{ICON_TYPES[desktop_file_config['Desktop Entry']['Type']]}/{desktop_file_config['Desktop Entry']['Icon']}"
-        if mapping_str in entries:
-            entries[mapping_str].append(desktop_file)
-        else:
-            entries[mapping_str] = [desktop_file]
+def search_icons_batch(appnames: list[str]) -> dict[str, dict[str, list[Path]]]:
+    """Search for icons containing any of the appnames, with one pass over the icons."""
+
+    icon_directories = _icon_index(INDEX_FILE).icon_dirs(
+        ICON_THEME_DIRS, LOCAL_HICOLOR_DIR, ICON_TYPES
+    )
 
-    return entries
+    # Search in all directories for files with the appname in the filename
+    matcher = _QueryMatcher(appnames, fold_case=False, globs=True)
+    results: dict[str, dict[str, list[Path]]] = {appname: {} for appname in appnames}
+    for folder in icon_directories:
+        if folder.icon_type not in ICON_TYPES:
+            continue
+        for name in folder.names:
+            found = matcher.matches(name)
+            if not found:
+                continue
+            file = folder.directory / name
+            mapping_str = f"{ICON_TYPES[folder.icon_type]}/{file.stem}"
+            if mapping_str.endswith("-symbolic"):
+                mapping_str = mapping_str.removesuffix("-symbolic")
+            for appname in found:
+                results[appname].setdefault(mapping_str, []).append(file)
+    return results
 
 
 def search_icons(appname: str) -> dict[str, list[Path]]:
     """Search for icons containing the specified appname."""
+    return search_icons_batch([appname])[appname]
 
-    # find all theme files
-    theme_files = {
-        *set(Path("/usr/share/icons").glob("*/index.theme")),
-        *set(Path("~/.local/share/icons").expanduser().glob("*/index.theme")),
-    }
-    icon_directories: list[IconDirEntry] = []
-
-    for theme_file in theme_files:
-        theme_file_config = ConfigParser()
-        if (
-            str(theme_file) not in theme_file_config.read(theme_file)
-            or "Icon Theme" not in theme_file_config
-            or "Directories" not in theme_file_config["Icon Theme"]
-        ):
-            # Not an icon theme file
-            continue
 
-        # Parse all directories inside the theme file
-        for directory in theme_file_config["Icon Theme"]["Directories"].split(","):
-            dir_path = theme_file.parent / directory
-            if (
-                dir_path.is_dir()
-                and not dir_path.is_symlink()  # The Papirus theme has symlinks from categories to apps, so each app would be a category as well
-                and not dir_path.parent.is_symlink()
-                and directory in theme_file_config
-                and "Context" in theme_file_config[directory]
-            ):
-                icon_directories.append(
-                    IconDirEntry(
-                        directory=dir_path,
-                        icon_type=theme_file_config[directory]["Context"],
-                    ),
-                )
+class FuzzyMatch(NamedTuple):
+    """A mapping found by a fuzzy search."""
 
-    # Parse ~/.local/share/icons/hicolor, because it doesn't have a theme file
-    icon_directories += [
-        IconDirEntry(
-            directory=folder,
-            icon_type=([*ICON_TYPES.keys()][[*ICON_TYPES.values()].index(folder.name)]),
-        )
-        for folder in Path("~/.local/share/icons/hicolor").glob("*/*")
-        if folder.is_dir()
-    ]
+    mapping: str
+    score: float
+    paths: list[Path]
 
-    # Search in all directories for files with the appname in the filename
-    entries: dict[str, list[Path]] = {}
-    for folder in icon_directories:
-        for file in folder.directory.glob(f"*{appname}*"):
-            if folder.icon_type not in ICON_TYPES:
-                continue
+
+def _command_name(command: str | None) -> str | None:
+    """Get the name of the program an Exec key runs."""
+    try:
+        args = shlex.split(command or "")
+    except ValueError:
+        return None
+    if args and args[0] == "env":
+        # env VAR=value program args
+        args = [arg for arg in args[1:] if "=" not in arg]
+    return args[0].rsplit("/", 1)[-1] if args else None
+
+
+def _fuzzy_documents(
+    icon_dirs: list[IconDir], desktop_entries: list[DesktopEntry]
+) -> tuple[list[tuple[str, str]], dict[str, list[str]]]:
+    """Collect the searchable texts of every mapping and the files they come from.
+
+    The texts are the icon file names and the names, translated names,
+    descriptions, keywords, window classes and commands of the desktop files.
+    """
+    texts: set[tuple[str, str]] = set()
+    paths: dict[str, list[str]] = {}
+    for folder in icon_dirs:
+        if folder.icon_type not in ICON_TYPES:
+            continue
+        for name in folder.names:
+            file = folder.directory / name
             mapping_str = f"{ICON_TYPES[folder.icon_type]}/{file.stem}"
-            if mapping_str.endswith("-symbolic"):
-                mapping_str = mapping_str.removesuffix("-symbolic")
-            if mapping_str in entries:
-                entries[mapping_str].append(file)
-            else:
-                entries[mapping_str] = [file]
-    return entries
+            mapping_str = mapping_str.removesuffix("-symbolic")
+            texts.add((mapping_str, mapping_str.split("/", 1)[1]))
+            paths.setdefault(mapping_str, []).append(str(file))
+
+    for desktop_entry in desktop_entries:
+        mapping_str = _desktop_mapping(desktop_entry)
+        if mapping_str is None:
+            continue
+        for text in (
+            desktop_entry.path.name[: -len(".desktop")],
+            desktop_entry.name,
+            desktop_entry.generic_name,
+            desktop_entry.comment,
+            desktop_entry.keywords,
+            desktop_entry.startup_wm_class,
+            _command_name(desktop_entry.command),
+            *desktop_entry.localized_names,
+        ):
+            if text:
+                texts.add((mapping_str, text))
+        paths.setdefault(mapping_str, []).append(str(desktop_entry.path))
+    return sorted(texts), paths
+
+
+def _trigram_index() -> TrigramIndex:
+    """Get the trigram index of the texts of all mappings.
+
+    It is kept next to the icon index, with the mapping of each text and the
+    files of each mapping as payload. The index is valid while the directories
+    and files in the icon index didn't change, so the texts are only collected
+    again when they did.
+    """
+    icon_index = _icon_index(INDEX_FILE)
+    icon_dirs = icon_index.icon_dirs(ICON_THEME_DIRS, LOCAL_HICOLOR_DIR, ICON_TYPES)
+    desktop_entries = icon_index.desktop_entries(APPLICATION_DIRS)
+    fingerprint = icon_index.fingerprint(
+        "icon_dirs", "index_themes", "application_dirs", "desktop_files"
+    )
+    trigram_file = (
+        INDEX_FILE.with_name(f"{INDEX_FILE.name}-trigrams") if INDEX_FILE else None
+    )
+    if trigram_file and fingerprint:
+        trigram_index = TrigramIndex.load(trigram_file, fingerprint)
+        if trigram_index is not None:
+            return trigram_index
+
+    documents, paths = _fuzzy_documents(icon_dirs, desktop_entries)
+    trigram_index = TrigramIndex(
+        [text for _, text in documents],
+        {"mappings": [mapping_str for mapping_str, _ in documents], "paths": paths},
+    )
+    if trigram_file and fingerprint:
+        trigram_index.save(trigram_file, fingerprint)
+    return trigram_index
+
+
+def fuzzy_search_batch(appnames: list[str], top: int) -> dict[str, list[FuzzyMatch]]:
+    """Rank the mappings by their similarity to each appname."""
+    trigram_index = _trigram_index()
+    mappings = trigram_index.payload["mappings"]
+    paths = trigram_index.payload["paths"]
+
+    results: dict[str, list[FuzzyMatch]] = {}
+    for appname in appnames:
+        # A mapping has multiple texts, it's ranked by the best one
+        scores: dict[str, float] = {}
+        for document_id, score in trigram_index.search(appname, top * FUZZY_OVERFETCH):
+            mapping_str = mappings[document_id]
+            scores[mapping_str] = max(score, scores.get(mapping_str, 0.0))
+        results[appname] = [
+            FuzzyMatch(mapping_str, score, [Path(path) for path in paths[mapping_str]])
+            for mapping_str, score in sorted(
+                scores.items(), key=lambda item: (-item[1], item[0])
+            )[:top]
+        ]
+    return results
+
+
+def fuzzy_search(appname: str, top: int) -> list[FuzzyMatch]:
+    """Rank the mappings by their similarity to the appname."""
+    return fuzzy_search_batch([appname], top)[appname]
+
+
+def _read_batch(batch_file: str) -> list[str]:
+    """Read the appnames of a batch, one per line, "-" reads them from stdin."""
+    if batch_file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        lines = Path(batch_file).read_text(encoding="utf8").splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def _json_entries(entries: dict[str, list[Path]]) -> dict[str, list[str]]:
+    return {
+        mapping_str: sorted(str(path) for path in paths)
+        for mapping_str, paths in sorted(entries.items())
+    }
 
 
 if __name__ == "__main__":
     # Parse arguments from command line
     parser = argparse.ArgumentParser()
-    parser.add_argument("appname", help="name of the app to search icons for")
+    parser.add_argument(
+        "appname", help="name of the app to search icons for", nargs="?"
+    )
+    parser.add_argument(
+        "--batch",
+        help="search the app names in this file, one per line, - reads them from "
+        "stdin. The results are printed as JSON Lines",
+        metavar="FILE",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -197,8 +372,80 @@ if __name__ == "__main__":
         help="Search names and comments inside desktop files",
         action="store_true",
     )
+    parser.add_argument(
+        "--fuzzy",
+        help="rank the icons and desktop files by their similarity to the app name",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--top",
+        help="number of results of a fuzzy search",
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "--no-index",
+        help="Don't use the index of the previous searches",
+        action="store_true",
+    )
     args = parser.parse_args()
 
+    if args.no_index:
+        INDEX_FILE = None
+
+    if args.appname is None and args.batch is None:
+        parser.error("the appname or --batch is required")
+
+    if args.fuzzy:
+        appnames = _read_batch(args.batch) if args.batch is not None else [args.appname]
+        fuzzy_results = fuzzy_search_batch(appnames, args.top)
+        for appname in dict.fromkeys(appnames):
+            if args.batch is not None:
+                print(
+                    json.dumps(
+                        {
+                            "query": appname,
+                            "fuzzy": [
+                                {
+                                    "mapping": match.mapping,
+                                    "score": round(match.score, 4),
+                                    "paths": sorted(str(path) for path in match.paths),
+                                }
+                                for match in fuzzy_results[appname]
+                            ],
+                        }
+                    )
+                )
+                continue
+            for match in fuzzy_results[appname]:
+                print(f"{match.score:.2f}\t{match.mapping}")
+                if args.verbose:
+                    for path in sorted(match.paths):
+                        print(f"\t{path}")
+        sys.exit(0)
+
+    if args.batch is not None:
+        appnames = _read_batch(args.batch)
+        batch_entries = search_icons_batch(appnames) if not args.no_icons else {}
+        batch_desktop_entries = (
+            search_desktop_files_batch(appnames) if not args.no_desktop else {}
+        )
+        batch_deep_desktop_entries = (
+            deep_search_desktop_files_batch(appnames) if args.deep_desktop else {}
+        )
+        for appname in dict.fromkeys(appnames):
+            result: dict[str, object] = {"query": appname}
+            if not args.no_icons:
+                result["icons"] = _json_entries(batch_entries[appname])
+            if not args.no_desktop:
+                result["desktop"] = _json_entries(batch_desktop_entries[appname])
+            if args.deep_desktop:
+                result["deep_desktop"] = _json_entries(
+                    batch_deep_desktop_entries[appname]
+                )
+            print(json.dumps(result))
+        sys.exit(0)
+
     entries = search_icons(args.appname) if not args.no_icons else {}
     desktop_entries = search_desktop_files(args.appname) if not args.no_desktop else {}
     deep_desktop_entries = (
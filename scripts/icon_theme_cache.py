@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+"""Write and verify the icon-theme.cache file of a theme, like gtk-update-icon-cache.
+
+The cache is a hash table of the icon names, with the directories each icon
+is in and the file types it has there. GTK reads it instead of listing the
+directories of the theme. The format is version 1.0, all numbers are big
+endian and every block starts at a multiple of 4 bytes.
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+import logging
+import os
+from pathlib import Path
+import struct
+import sys
+import tempfile
+
+LOGGER = logging.getLogger("icon_theme_cache")
+
+CACHE_FILE = "icon-theme.cache"
+MAJOR_VERSION = 1
+MINOR_VERSION = 0
+
+# The flags of the file types of an icon
+HAS_SUFFIX_XPM = 1
+HAS_SUFFIX_SVG = 2
+HAS_SUFFIX_PNG = 4
+HAS_ICON_FILE = 8
+SUFFIX_FLAGS = {
+    ".xpm": HAS_SUFFIX_XPM,
+    ".svg": HAS_SUFFIX_SVG,
+    ".png": HAS_SUFFIX_PNG,
+    ".icon": HAS_ICON_FILE,
+}
+
+# The offset of an empty bucket or the end of a chain
+NO_OFFSET = 0xFFFFFFFF
+
+# The icons in every directory and their flags
+type IconTable = dict[str, dict[int, int]]
+
+
+class IconCacheError(Exception):
+    """The cache file is damaged."""
+
+
+def icon_name_hash(name: str) -> int:
+    """Hash an icon name like GTK, which adds up the bytes as signed chars."""
+    name_hash = 0
+    for byte in name.encode():
+        name_hash = (name_hash * 31 + (byte ^ 0x80) - 0x80) & 0xFFFFFFFF
+    return name_hash
+
+
+def _bucket_count(icons: int) -> int:
+    """Get the smallest prime which isn't below the number of icons."""
+    count = max(icons, 2)
+    while any(count % divisor == 0 for divisor in range(2, int(count**0.5) + 1)):
+        count += 1
+    return count
+
+
+def theme_directories(destination: Path) -> list[str]:
+    """Get the directories of the index.theme file of a theme, without duplicates."""
+    theme = ConfigParser()
+    theme.optionxform = lambda optionstr: optionstr
+    _ = theme.read(destination / "index.theme", encoding="utf8")
+    return list(dict.fromkeys(theme["Icon Theme"]["Directories"].split(",")))
+
+
+def scan_theme(destination: Path, directories: list[str]) -> IconTable:
+    """Find the icons in the directories of a theme.
+
+    The directories are looked at through their links, like the size folders
+    which link to scalable, since GTK looks the icons up in them by name.
+    """
+    icons: IconTable = {}
+    for index, directory in enumerate(directories):
+        try:
+            dir_entries = list(os.scandir(destination / directory))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for dir_entry in dir_entries:
+            name, dot, suffix = dir_entry.name.rpartition(".")
+            flag = SUFFIX_FLAGS.get(dot + suffix)
+            if not name or flag is None or not dir_entry.is_file():
+                continue
+            flags = icons.setdefault(name, {})
+            flags[index] = flags.get(index, 0) | flag
+    return icons
+
+
+class _Writer:
+    """Lay out the blocks of a cache file."""
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    def reserve(self, size: int) -> int:
+        """Add a block of zeros and get its offset."""
+        offset = len(self.data)
+        self.data += bytes(size)
+        return offset
+
+    def string(self, text: str) -> int:
+        """Add a string with a NUL terminator, padded to 4 bytes."""
+        offset = len(self.data)
+        encoded = text.encode() + b"\0"
+        self.data += encoded + bytes(-len(encoded) % 4)
+        return offset
+
+    def set(self, offset: int, fmt: str, *values: int) -> None:
+        struct.pack_into(f">{fmt}", self.data, offset, *values)
+
+
+def build_cache(directories: list[str], icons: IconTable) -> bytes:
+    """Build the cache file of the icons in the directories."""
+    writer = _Writer()
+    header = writer.reserve(12)
+
+    buckets: list[list[str]] = [[] for _ in range(_bucket_count(len(icons)))]
+    for name in sorted(icons):
+        buckets[icon_name_hash(name) % len(buckets)].append(name)
+    hash_offset = writer.reserve(4 + 4 * len(buckets))
+    writer.set(hash_offset, "I", len(buckets))
+
+    for bucket_index, bucket in enumerate(buckets):
+        # Every icon points to the next one in its bucket
+        link = hash_offset + 4 + 4 * bucket_index
+        for name in bucket:
+            icon = writer.reserve(12)
+            writer.set(link, "I", icon)
+            link = icon
+            flags = icons[name]
+            image_list = writer.reserve(4 + 8 * len(flags))
+            writer.set(image_list, "I", len(flags))
+            for image, directory_index in enumerate(sorted(flags)):
+                # The images don't embed the pixel data
+                writer.set(
+                    image_list + 4 + 8 * image,
+                    "HHI",
+                    directory_index,
+                    flags[directory_index],
+                    0,
+                )
+            writer.set(icon + 4, "II", writer.string(name), image_list)
+        writer.set(link, "I", NO_OFFSET)
+
+    directory_list = writer.reserve(4 + 4 * len(directories))
+    writer.set(directory_list, "I", len(directories))
+    for index, directory in enumerate(directories):
+        writer.set(directory_list + 4 + 4 * index, "I", writer.string(directory))
+
+    writer.set(
+        header, "HHII", MAJOR_VERSION, MINOR_VERSION, hash_offset, directory_list
+    )
+    return bytes(writer.data)
+
+
+class _Reader:
+    """Read the blocks of a cache file."""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def get(self, fmt: str, offset: int) -> tuple[int, ...]:
+        try:
+            return struct.unpack_from(f">{fmt}", self.data, offset)
+        except struct.error:
+            msg = f"Offset {offset} is outside of the file"
+            raise IconCacheError(msg) from None
+
+    def string(self, offset: int) -> str:
+        end = self.data.find(b"\0", offset)
+        if offset >= len(self.data) or end < 0:
+            msg = f"The string at {offset} isn't terminated"
+            raise IconCacheError(msg)
+        return self.data[offset:end].decode()
+
+    def images(self, offset: int, name: str, directory_count: int) -> dict[int, int]:
+        """Read the image list of an icon, the flags of every directory."""
+        (image_count,) = self.get("I", offset)
+        flags: dict[int, int] = {}
+        for image in range(image_count):
+            directory_index, image_flags, _ = self.get("HHI", offset + 4 + 8 * image)
+            if directory_index >= directory_count:
+                msg = f"The icon '{name}' is in an unknown directory"
+                raise IconCacheError(msg)
+            flags[directory_index] = image_flags
+        return flags
+
+
+def read_cache(data: bytes) -> tuple[list[str], IconTable]:
+    """Read the directories and icons of a cache file.
+
+    Raises an IconCacheError if the file is damaged, or an icon is in the
+    wrong bucket.
+    """
+    reader = _Reader(data)
+    major, minor, hash_offset, directory_list = reader.get("HHII", 0)
+    if (major, minor) != (MAJOR_VERSION, MINOR_VERSION):
+        msg = f"Unsupported version {major}.{minor}"
+        raise IconCacheError(msg)
+
+    directories = [
+        reader.string(reader.get("I", directory_list + 4 + 4 * index)[0])
+        for index in range(reader.get("I", directory_list)[0])
+    ]
+
+    icons: IconTable = {}
+    (bucket_count,) = reader.get("I", hash_offset)
+    for bucket_index in range(bucket_count):
+        (icon,) = reader.get("I", hash_offset + 4 + 4 * bucket_index)
+        seen: set[int] = set()
+        while icon != NO_OFFSET:
+            if icon in seen:
+                msg = f"The chain of bucket {bucket_index} is a loop"
+                raise IconCacheError(msg)
+            seen.add(icon)
+            next_icon, name_offset, image_list = reader.get("III", icon)
+            name = reader.string(name_offset)
+            if icon_name_hash(name) % bucket_count != bucket_index:
+                msg = f"The icon '{name}' is in the wrong bucket"
+                raise IconCacheError(msg)
+            icons[name] = reader.images(image_list, name, len(directories))
+            icon = next_icon
+    return directories, icons
+
+
+def write_icon_cache(destination: Path) -> None:
+    """Write the cache file of a theme.
+
+    GTK ignores the cache if the theme folder is newer, so the folder gets the
+    mtime of the cache file, like gtk-update-icon-cache does.
+    """
+    directories = theme_directories(destination)
+    icons = scan_theme(destination, directories)
+    data = build_cache(directories, icons)
+    fd, tmp_name = tempfile.mkstemp(dir=destination, prefix=f".{CACHE_FILE}.")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            _ = tmp_file.write(data)
+        Path(tmp_name).chmod(0o644)
+        Path(tmp_name).replace(destination / CACHE_FILE)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    cache_stat = (destination / CACHE_FILE).stat()
+    os.utime(destination, ns=(destination.stat().st_atime_ns, cache_stat.st_mtime_ns))
+    LOGGER.info(
+        "Wrote %s with %d icons in %d directories.",
+        destination / CACHE_FILE,
+        len(icons),
+        len(directories),
+    )
+
+
+def verify_icon_cache(destination: Path) -> bool:
+    """Check if the cache file of a theme matches its icons and is up to date."""
+    cache_file = destination / CACHE_FILE
+    try:
+        cached_directories, cached_icons = read_cache(cache_file.read_bytes())
+    except (OSError, IconCacheError, UnicodeDecodeError) as err:
+        LOGGER.error("%s: %s", cache_file, err)  # noqa: TRY400
+        return False
+
+    valid = True
+    if cache_file.stat().st_mtime_ns < destination.stat().st_mtime_ns:
+        LOGGER.error("%s: It is older than the theme folder", cache_file)
+        valid = False
+
+    directories = theme_directories(destination)
+    if cached_directories != directories:
+        LOGGER.error(
+            "%s: The directories differ from index.theme: %s",
+            cache_file,
+            sorted(set(cached_directories) ^ set(directories)),
+        )
+        return False
+
+    icons = scan_theme(destination, directories)
+    for name in sorted(icons.keys() | cached_icons.keys()):
+        expected = icons.get(name, {})
+        cached = cached_icons.get(name, {})
+        for index in sorted(expected.keys() | cached.keys()):
+            if expected.get(index) != cached.get(index):
+                LOGGER.error(
+                    "%s: The icon '%s' in %s has the flags %s, but %s in the cache",
+                    cache_file,
+                    name,
+                    directories[index],
+                    expected.get(index),
+                    cached.get(index),
+                )
+                valid = False
+    return valid
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--verify",
+        help="Check the cache files against the themes instead of writing them.",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument("destinations", help="The theme folders.", type=Path, nargs="+")
+    args = parser.parse_args()
+
+    valid = True
+    for destination in args.destinations:
+        if args.verify:
+            valid &= verify_icon_cache(destination)
+        else:
+            write_icon_cache(destination)
+    if not valid:
+        sys.exit(1)
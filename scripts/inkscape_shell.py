@@ -0,0 +1,134 @@
+"""A long-lived Inkscape shell session."""
+
+from __future__ import annotations
+
+import logging
+import os
+import select
+import subprocess  # noqa: S404
+import time
+from typing import TYPE_CHECKING, Self
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+LOGGER = logging.getLogger("inkscape_shell")
+
+PROMPT = b"> "
+
+
+def inkscape_version() -> str:
+    """Get the version string of the installed Inkscape."""
+    return subprocess.run(  # noqa: S603
+        ["inkscape", "--version"],  # noqa: S607
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.strip()
+
+
+class InkscapeShellError(Exception):
+    """The Inkscape shell exited or didn't answer in time."""
+
+
+class InkscapeShell:
+    """An ``inkscape --shell`` session which converts strokes to paths.
+
+    Starting Inkscape takes multiple seconds, so the session is kept alive and
+    the files are streamed through it. A session that crashes or doesn't answer
+    within the timeout is killed and restarted.
+    """
+
+    def __init__(self, timeout: float = 60.0, startup_timeout: float = 120.0) -> None:
+        """Initialize the session, Inkscape is started on first use."""
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self._process: subprocess.Popen[bytes] | None = None
+
+    def __enter__(self) -> Self:
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        """Quit Inkscape when leaving the context manager."""
+        self.close()
+
+    def start(self) -> None:
+        """Start the Inkscape shell and wait for the prompt."""
+        self._process = subprocess.Popen(  # noqa: S603
+            ["inkscape", "--shell"],  # noqa: S607
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self._read_prompt(self.startup_timeout)
+
+    def close(self) -> None:
+        """Quit the Inkscape shell."""
+        if self._process is None:
+            return
+        try:
+            self._send("quit")
+            _ = self._process.wait(timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self._kill()
+        self._process = None
+
+    def stroke_to_path(self, src: Path, dest: Path) -> bool:
+        """Convert all strokes of ``src`` to paths and save the result as ``dest``.
+
+        The session is restarted once if Inkscape crashes or times out.
+        """
+        if any(char in f"{src}{dest}" for char in ";\n"):
+            LOGGER.error("Can't pass %s or %s to the Inkscape shell", src, dest)
+            return False
+
+        dest.unlink(missing_ok=True)
+        for _ in range(2):
+            try:
+                if self._process is None or self._process.poll() is not None:
+                    self.start()
+                self._send(
+                    f"file-open:{src};select-all;object-stroke-to-path;"
+                    f"export-filename:{dest};export-overwrite;export-do;file-close"
+                )
+                self._read_prompt(self.timeout)
+            except (OSError, InkscapeShellError) as err:
+                LOGGER.warning("%s: Inkscape failed (%s), restarting it", src, err)
+                self._kill()
+                continue
+            return dest.exists()
+        return False
+
+    def _send(self, command: str) -> None:
+        if self._process is None or self._process.stdin is None:
+            msg = "Inkscape isn't running"
+            raise InkscapeShellError(msg)
+        _ = self._process.stdin.write(command.encode() + b"\n")
+        self._process.stdin.flush()
+
+    def _read_prompt(self, timeout: float) -> None:
+        """Read the output until Inkscape shows the prompt again."""
+        if self._process is None or self._process.stdout is None:
+            msg = "Inkscape isn't running"
+            raise InkscapeShellError(msg)
+
+        stdout = self._process.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        output = b""
+        while not output.endswith(PROMPT):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([stdout], [], [], remaining)[0]:
+                msg = f"no answer after {timeout}s"
+                raise InkscapeShellError(msg)
+            data = os.read(stdout, 4096)
+            if not data:
+                msg = f"exited with {self._process.wait()}"
+                raise InkscapeShellError(msg)
+            output = (output + data)[-len(PROMPT) :]
+
+    def _kill(self) -> None:
+        if self._process is None:
+            return
+        self._process.kill()
+        _ = self._process.wait()
+        self._process = None
@@ -0,0 +1,198 @@
+"""Render the scalable icons to PNG for the fixed-size folders of a theme."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from functools import cache
+import logging
+import os
+from pathlib import Path
+import re
+from shutil import which
+import subprocess  # noqa: S404
+from typing import TYPE_CHECKING, NamedTuple
+
+from build_cache import BuildCache
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+LOGGER = logging.getLogger("raster_icons")
+
+RENDERER = "rsvg-convert"
+
+# The folders of a size, like 16x16 or 16x16@2x
+SIZE_FOLDER = re.compile(r"\d+x\d+(@\d+x)?")
+
+has_renderer = bool(which(RENDERER))
+
+
+class RasterResult(NamedTuple):
+    """The result of rendering the icons of a destination."""
+
+    # The fixed-size directories which were rendered, like 16x16/apps
+    directories: list[str]
+    # The PNG files which were written and which couldn't be rendered
+    rendered: int
+    failed: int
+
+
+def fixed_directories(index_theme: Path) -> dict[str, int]:
+    """Get the fixed-size directories of a theme and their size in pixels.
+
+    The size of a directory with a scale, like 16x16@2x/apps, is multiplied
+    with the scale. Only the directories with Type=Fixed are rasterized, the
+    directories of a size folder with another type, like 128x128/apps which
+    is Scalable, are logged and left out.
+    """
+    theme = ConfigParser()
+    theme.optionxform = lambda optionstr: optionstr
+    _ = theme.read(index_theme)
+    directories: dict[str, int] = {}
+    for directory in theme["Icon Theme"]["Directories"].split(","):
+        directory_type = theme[directory].get("Type") if directory in theme else None
+        if directory_type != "Fixed":
+            if SIZE_FOLDER.fullmatch(directory.partition("/")[0]):
+                LOGGER.info(
+                    "Not rendering %s, its type is %s instead of Fixed.",
+                    directory,
+                    directory_type,
+                )
+            continue
+        section = theme[directory]
+        directories[directory] = int(section["Size"]) * int(section.get("Scale", "1"))
+    return directories
+
+
+@cache
+def renderer_version() -> str:
+    """Get the version of the renderer, for the cache key."""
+    return subprocess.run(  # noqa: S603
+        [RENDERER, "--version"], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def render_png(svg_data: bytes, pixels: int) -> bytes:
+    """Render an SVG icon to a square PNG."""
+    return subprocess.run(  # noqa: S603
+        [RENDERER, "-f", "png", "-w", str(pixels), "-h", str(pixels), "-a"],
+        input=svg_data,
+        capture_output=True,
+        check=True,
+    ).stdout
+
+
+def _render_icon(
+    svg_file: Path, pngs: list[tuple[Path, int]], build_cache: BuildCache | None
+) -> int:
+    """Render an icon to the PNG files of all sizes, or reuse the cached PNGs.
+
+    Returns the number of PNG files which were written, the sizes after the
+    first failure aren't rendered.
+    """
+    svg_data = svg_file.read_bytes()
+    for written, (png_file, pixels) in enumerate(pngs):
+        cache_key = None
+        data = None
+        if build_cache is not None:
+            cache_key = BuildCache.key("png", renderer_version(), str(pixels), svg_data)
+            data = build_cache.get(cache_key)
+        if data is None:
+            try:
+                data = render_png(svg_data, pixels)
+            except (OSError, subprocess.CalledProcessError) as err:
+                LOGGER.error(  # noqa: TRY400
+                    "%s: Couldn't render it at %dpx: %s", svg_file, pixels, err
+                )
+                return written
+            if build_cache is not None and cache_key is not None:
+                build_cache.put(cache_key, data)
+        png_file.unlink(missing_ok=True)
+        png_file.write_bytes(data)
+    return len(pngs)
+
+
+def _remove_stale(directory: Path, icons: Iterable[str]) -> None:
+    """Remove the PNG files of a directory which don't have an icon anymore."""
+    names = {f"{Path(icon).stem}.png" for icon in icons}
+    for png_file in directory.glob("*.png"):
+        if png_file.name not in names:
+            LOGGER.info("Removing %s, it isn't an icon anymore.", png_file)
+            png_file.unlink()
+
+
+def rasterize(
+    destination: Path,
+    directories: dict[str, int],
+    build_cache: BuildCache | None,
+    jobs: int,
+) -> RasterResult:
+    """Render the scalable icons of a destination into the fixed-size directories.
+
+    A directory like 16x16/apps gets a PNG of every icon in scalable/apps,
+    directories of contexts without icons are skipped. Icons which are links to
+    other icons are linked to their PNG as well. Only the PNG files which are
+    older than their icon are rendered, in a thread pool of ``jobs`` renderers.
+    """
+    scalable = destination / "scalable"
+    contexts: dict[str, list[os.DirEntry[str]]] = {}
+    renders: dict[Path, list[tuple[Path, int]]] = {}
+    rendered_directories: list[str] = []
+    for directory, pixels in directories.items():
+        folder, _, context = directory.partition("/")
+        if context not in contexts:
+            try:
+                contexts[context] = sorted(
+                    (
+                        icon
+                        for icon in os.scandir(scalable / context)
+                        if icon.name.endswith(".svg")
+                    ),
+                    key=lambda icon: icon.name,
+                )
+            except FileNotFoundError:
+                contexts[context] = []
+        if not contexts[context]:
+            continue
+        rendered_directories.append(directory)
+
+        # The folder was a link to scalable before
+        if (destination / folder).is_symlink():
+            (destination / folder).unlink()
+        png_dir = destination / directory
+        png_dir.mkdir(parents=True, exist_ok=True)
+        _remove_stale(png_dir, (icon.name for icon in contexts[context]))
+
+        for icon in contexts[context]:
+            png_file = png_dir / f"{icon.name.removesuffix('.svg')}.png"
+            link_target = Path(icon.path).readlink() if icon.is_symlink() else None
+            if link_target is not None:
+                # The PNG of the linked icon is only there if its context is too
+                target_context = Path(os.path.normpath(context / link_target)).parent
+                if f"{folder}/{target_context}" not in directories:
+                    link_target = None
+            if link_target is not None:
+                link_target = link_target.with_suffix(".png")
+                if png_file.is_symlink() and png_file.readlink() == link_target:
+                    continue
+                png_file.unlink(missing_ok=True)
+                os.symlink(link_target, png_file)
+            elif (
+                png_file.is_symlink()
+                or not png_file.exists()
+                or png_file.stat().st_mtime_ns < icon.stat().st_mtime_ns
+            ):
+                renders.setdefault(Path(icon.path), []).append((png_file, pixels))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        rendered = sum(
+            executor.map(
+                lambda render: _render_icon(*render, build_cache), renders.items()
+            )
+        )
+    return RasterResult(
+        directories=rendered_directories,
+        rendered=rendered,
+        failed=sum(len(pngs) for pngs in renders.values()) - rendered,
+    )
@@ -0,0 +1,120 @@
+"""Build a destination in a staging folder and swap it in when it is done.
+
+The installed theme stays complete while it is rebuilt. The staging folder
+starts as a copy of the destination made of hard links, so the unchanged icons
+aren't written again. Every file the build writes is unlinked first, so the
+files of the destination are never changed through their links.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import errno
+import logging
+import os
+from pathlib import Path
+import shutil
+import sys
+
+LOGGER = logging.getLogger("staged_build")
+
+# From <fcntl.h> and <linux/fs.h>
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+def staging_dir(destination: Path) -> Path:
+    """Get the staging folder of a destination, next to it on the same file system."""
+    return destination.with_name(f".{destination.name}.staging")
+
+
+def _link_tree(src: Path, dest: Path) -> int:
+    """Recreate a folder with hard links to its files, returns the number of files.
+
+    Symlinks are recreated as they are. Files are copied if the file system
+    doesn't support hard links.
+    """
+    dest.mkdir()
+    files = 0
+    for dir_entry in os.scandir(src):
+        target = dest / dir_entry.name
+        if dir_entry.is_symlink():
+            target.symlink_to(Path(dir_entry.path).readlink())
+        elif dir_entry.is_dir():
+            files += _link_tree(Path(dir_entry.path), target)
+        else:
+            try:
+                target.hardlink_to(dir_entry.path)
+            except OSError:
+                _ = shutil.copy2(dir_entry.path, target)
+            files += 1
+    return files
+
+
+def prepare(destination: Path, *, reuse: bool) -> Path:
+    """Create the staging folder of a destination and get its path.
+
+    With ``reuse`` it starts with the files of the destination, otherwise it is
+    empty. A staging folder left behind by an interrupted build is removed.
+    """
+    staging = staging_dir(destination)
+    if staging.exists() or staging.is_symlink():
+        LOGGER.info("Removing %s of an interrupted build.", staging)
+        shutil.rmtree(staging)
+    if reuse and destination.is_dir():
+        files = _link_tree(destination, staging)
+        LOGGER.info("Staging %s with %d files of %s.", staging, files, destination)
+    else:
+        staging.mkdir(parents=True)
+    return staging
+
+
+def _rename_exchange(src: Path, dest: Path) -> bool:
+    """Swap two paths atomically with renameat2, False if it isn't supported."""
+    if sys.platform != "linux":
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    renameat2 = getattr(libc, "renameat2", None)
+    if renameat2 is None:
+        # glibc before 2.28
+        return False
+    renameat2.argtypes = [
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_uint,
+    ]
+    if (
+        renameat2(
+            AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dest), RENAME_EXCHANGE
+        )
+        == 0
+    ):
+        return True
+    error = ctypes.get_errno()
+    if error in {errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP}:
+        # Not supported by the kernel or the file system
+        return False
+    raise OSError(error, os.strerror(error), str(src), None, str(dest))
+
+
+def swap(staging: Path, destination: Path) -> None:
+    """Replace the destination with the staging folder and remove the old files.
+
+    The folders are exchanged atomically where the system supports it, else
+    the destination is only missing between two renames.
+    """
+    if not destination.exists() and not destination.is_symlink():
+        staging.rename(destination)
+    elif _rename_exchange(staging, destination):
+        # The staging folder has the old files now
+        shutil.rmtree(staging)
+    else:
+        old = destination.with_name(f".{destination.name}.old")
+        if old.exists():
+            shutil.rmtree(old)
+        destination.rename(old)
+        staging.rename(destination)
+        shutil.rmtree(old)
+    LOGGER.info("Swapped %s into place.", destination)
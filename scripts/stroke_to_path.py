@@ -0,0 +1,879 @@
+"""Convert the strokes of an icon to filled outlines, for symbolic icons.
+
+Every stroke is expanded into a set of outlines: a quadrilateral per segment,
+plus the caps and joins. All outlines are drawn in the same direction, so the
+``nonzero`` fill rule renders their union without computing intersections.
+"""
+
+# ruff: noqa: PLR0914, PLR2004
+
+from __future__ import annotations
+
+from itertools import starmap
+import logging
+import math
+from operator import itemgetter
+import re
+from typing import TYPE_CHECKING, NamedTuple
+
+from lxml import etree
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+LOGGER = logging.getLogger("stroke_to_path")
+
+SVG_NS = "http://www.w3.org/2000/svg"
+
+# Maximum distance between a curve and its flattened polyline, in user units
+TOLERANCE = 0.02
+
+# Elements which are never rendered directly
+NON_RENDERED = {
+    "clipPath",
+    "defs",
+    "linearGradient",
+    "marker",
+    "mask",
+    "metadata",
+    "pattern",
+    "radialGradient",
+    "style",
+    "symbol",
+    "title",
+    "desc",
+}
+
+INHERITED_PROPERTIES = {
+    "fill",
+    "fill-rule",
+    "stroke",
+    "stroke-width",
+    "stroke-linecap",
+    "stroke-linejoin",
+    "stroke-miterlimit",
+    "visibility",
+}
+
+DEFAULT_STYLE = {
+    "fill": "#000",
+    "fill-rule": "nonzero",
+    "stroke": "none",
+    "stroke-width": "1",
+    "stroke-linecap": "butt",
+    "stroke-linejoin": "miter",
+    "stroke-miterlimit": "4",
+    "visibility": "visible",
+}
+
+CSS_RULE_RE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+PATH_TOKEN_RE = re.compile(
+    r"([MmLlHhVvCcSsQqTtAaZz])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+)
+TRANSFORM_RE = re.compile(r"(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)")
+
+
+class Point(NamedTuple):
+    """A point in user space."""
+
+    x: float
+    y: float
+
+
+class Matrix(NamedTuple):
+    """An affine transformation, in the order of the SVG ``matrix()``."""
+
+    a: float = 1.0
+    b: float = 0.0
+    c: float = 0.0
+    d: float = 1.0
+    e: float = 0.0
+    f: float = 0.0
+
+    def multiply(self, other: Matrix) -> Matrix:
+        """Apply ``other`` first and then this transformation."""
+        return Matrix(
+            self.a * other.a + self.c * other.b,
+            self.b * other.a + self.d * other.b,
+            self.a * other.c + self.c * other.d,
+            self.b * other.c + self.d * other.d,
+            self.a * other.e + self.c * other.f + self.e,
+            self.b * other.e + self.d * other.f + self.f,
+        )
+
+    def apply(self, point: Point) -> Point:
+        """Transform a point."""
+        return Point(
+            self.a * point.x + self.c * point.y + self.e,
+            self.b * point.x + self.d * point.y + self.f,
+        )
+
+    def scale(self) -> float:
+        """Get the average scale factor, used for the stroke width."""
+        return math.sqrt(abs(self.a * self.d - self.b * self.c))
+
+
+class Subpath(NamedTuple):
+    """A flattened subpath."""
+
+    points: list[Point]
+    closed: bool
+
+
+type Style = dict[str, str]
+type CssRule = tuple[tuple[int, int], str, Style]
+
+
+def _parse_declarations(text: str) -> Style:
+    """Parse CSS declarations like ``fill:none;stroke:#000``."""
+    style: Style = {}
+    for declaration in text.split(";"):
+        name, _, value = declaration.partition(":")
+        if value.strip():
+            style[name.strip()] = value.strip()
+    return style
+
+
+def parse_css(text: str) -> list[CssRule]:
+    """Parse the simple CSS used in icons, with tag, class and tag.class selectors.
+
+    The rules are returned sorted by specificity, keeping the document order.
+    """
+    rules: list[CssRule] = []
+    for selectors, declarations in CSS_RULE_RE.findall(CSS_COMMENT_RE.sub("", text)):
+        style = _parse_declarations(declarations)
+        for selector in selectors.split(","):
+            selector = selector.strip()  # noqa: PLW2901
+            specificity = (selector.count("."), 0 if selector.startswith(".") else 1)
+            rules.append((specificity, selector, style))
+    rules.sort(key=itemgetter(0))
+    return rules
+
+
+def _matches(selector: str, tag: str, classes: set[str]) -> bool:
+    """Check if a simple selector matches an element."""
+    if selector == "*":
+        return True
+    selector_tag, *selector_classes = selector.split(".")
+    if selector_tag not in {"", "*", tag}:
+        return False
+    return all(selector_class in classes for selector_class in selector_classes)
+
+
+def parse_transform(text: str | None) -> Matrix:
+    """Parse a ``transform`` attribute."""
+    matrix = Matrix()
+    if not text:
+        return matrix
+    for name, args_text in TRANSFORM_RE.findall(text):
+        args = [float(arg) for arg in NUMBER_RE.findall(args_text)]
+        match name, args:
+            case "matrix", [a, b, c, d, e, f]:
+                step = Matrix(a, b, c, d, e, f)
+            case "translate", [tx]:
+                step = Matrix(e=tx)
+            case "translate", [tx, ty]:
+                step = Matrix(e=tx, f=ty)
+            case "scale", [sx]:
+                step = Matrix(a=sx, d=sx)
+            case "scale", [sx, sy]:
+                step = Matrix(a=sx, d=sy)
+            case "rotate", [angle, *center]:
+                cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+                step = Matrix(cos, sin, -sin, cos)
+                if len(center) == 2:
+                    cx, cy = center
+                    step = (
+                        Matrix(e=cx, f=cy).multiply(step).multiply(Matrix(e=-cx, f=-cy))
+                    )
+            case "skewX", [angle]:
+                step = Matrix(c=math.tan(math.radians(angle)))
+            case "skewY", [angle]:
+                step = Matrix(b=math.tan(math.radians(angle)))
+            case _:
+                LOGGER.warning("Ignoring invalid transform %s(%s)", name, args_text)
+                continue
+        matrix = matrix.multiply(step)
+    return matrix
+
+
+def _cubic(p0: Point, p1: Point, p2: Point, p3: Point) -> list[Point]:
+    """Flatten a cubic Bézier curve, without the start point."""
+    flatness = max(
+        math.hypot(p0.x - 2 * p1.x + p2.x, p0.y - 2 * p1.y + p2.y),
+        math.hypot(p1.x - 2 * p2.x + p3.x, p1.y - 2 * p2.y + p3.y),
+    )
+    steps = max(1, math.ceil(math.sqrt(0.75 * flatness / TOLERANCE)))
+    points = []
+    for step in range(1, steps + 1):
+        t = step / steps
+        mt = 1 - t
+        points.append(
+            Point(
+                mt**3 * p0.x
+                + 3 * mt**2 * t * p1.x
+                + 3 * mt * t**2 * p2.x
+                + t**3 * p3.x,
+                mt**3 * p0.y
+                + 3 * mt**2 * t * p1.y
+                + 3 * mt * t**2 * p2.y
+                + t**3 * p3.y,
+            )
+        )
+    return points
+
+
+def _quadratic(p0: Point, p1: Point, p2: Point) -> list[Point]:
+    """Flatten a quadratic Bézier curve, without the start point."""
+    flatness = math.hypot(p0.x - 2 * p1.x + p2.x, p0.y - 2 * p1.y + p2.y)
+    steps = max(1, math.ceil(math.sqrt(0.25 * flatness / TOLERANCE)))
+    points = []
+    for step in range(1, steps + 1):
+        t = step / steps
+        mt = 1 - t
+        points.append(
+            Point(
+                mt**2 * p0.x + 2 * mt * t * p1.x + t**2 * p2.x,
+                mt**2 * p0.y + 2 * mt * t * p1.y + t**2 * p2.y,
+            )
+        )
+    return points
+
+
+def _ellipse_arc(  # noqa: PLR0913, PLR0917
+    center: Point,
+    rx: float,
+    ry: float,
+    phi: float,
+    start: float,
+    sweep: float,
+) -> list[Point]:
+    """Flatten an elliptical arc given in center parameterization."""
+    radius = max(rx, ry)
+    if radius <= TOLERANCE:
+        max_step = math.pi / 2
+    else:
+        max_step = 2 * math.acos(1 - TOLERANCE / radius)
+    steps = max(1, math.ceil(abs(sweep) / max_step))
+    cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+    points = []
+    for step in range(1, steps + 1):
+        angle = start + sweep * step / steps
+        x, y = rx * math.cos(angle), ry * math.sin(angle)
+        points.append(
+            Point(
+                center.x + cos_phi * x - sin_phi * y,
+                center.y + sin_phi * x + cos_phi * y,
+            )
+        )
+    return points
+
+
+def _arc(  # noqa: PLR0913, PLR0917
+    p0: Point,
+    rx: float,
+    ry: float,
+    rotation: float,
+    large_arc: bool,  # noqa: FBT001
+    sweep: bool,  # noqa: FBT001
+    p1: Point,
+) -> list[Point]:
+    """Flatten an SVG arc, using the endpoint to center conversion of the spec."""
+    rx, ry = abs(rx), abs(ry)
+    if p0 == p1:
+        return []
+    if rx == 0 or ry == 0:
+        return [p1]
+
+    phi = math.radians(rotation)
+    cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+    dx, dy = (p0.x - p1.x) / 2, (p0.y - p1.y) / 2
+    x1 = cos_phi * dx + sin_phi * dy
+    y1 = -sin_phi * dx + cos_phi * dy
+
+    # Scale up radii which are too small to reach the end point
+    scale = (x1 / rx) ** 2 + (y1 / ry) ** 2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+
+    numerator = max(0.0, (rx * ry) ** 2 - (rx * y1) ** 2 - (ry * x1) ** 2)
+    factor = math.sqrt(numerator / ((rx * y1) ** 2 + (ry * x1) ** 2))
+    if large_arc == sweep:
+        factor = -factor
+    cx1, cy1 = factor * rx * y1 / ry, -factor * ry * x1 / rx
+    center = Point(
+        cos_phi * cx1 - sin_phi * cy1 + (p0.x + p1.x) / 2,
+        sin_phi * cx1 + cos_phi * cy1 + (p0.y + p1.y) / 2,
+    )
+
+    start = math.atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+    end = math.atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx)
+    delta = end - start
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+
+    points = _ellipse_arc(center, rx, ry, phi, start, delta)
+    points[-1] = p1
+    return points
+
+
+def _path_tokens(data: str) -> Iterator[str]:
+    """Split path data into commands and numbers.
+
+    Arc flags may be written without separators, e.g. ``a1 1 0 011 1``, so they
+    are split into single digits by the caller.
+    """
+    for command, number in PATH_TOKEN_RE.findall(data):
+        yield command or number
+
+
+def parse_path(data: str) -> list[Subpath]:  # noqa: PLR0912, PLR0915
+    """Parse and flatten SVG path data."""
+    tokens = list(_path_tokens(data))
+    subpaths: list[Subpath] = []
+    points: list[Point] = []
+    current = start = Point(0, 0)
+    last_control: Point | None = None
+    command = last_command = ""
+    index = 0
+
+    def number() -> float:
+        nonlocal index
+        value = float(tokens[index])
+        index += 1
+        return value
+
+    def flag() -> bool:
+        nonlocal index
+        value = tokens[index]
+        if len(value) > 1 and value[0] in "01":
+            # Flags written without separator, keep the rest for the next value
+            tokens[index] = value[1:]
+            return value[0] == "1"
+        index += 1
+        return value == "1"
+
+    def close_subpath(*, closed: bool) -> None:
+        nonlocal points
+        if points:
+            subpaths.append(Subpath(points, closed))
+        points = []
+
+    while index < len(tokens):
+        token = tokens[index]
+        if token.isalpha():
+            command = token
+            index += 1
+            if command in "Zz":
+                close_subpath(closed=True)
+                current = start
+                last_control = None
+                continue
+        elif not command:
+            LOGGER.warning("Invalid path data: %s", data)
+            break
+
+        relative = command.islower()
+        base = current if relative else Point(0, 0)
+        next_control: Point | None = None
+        if not points and command not in "Mm":
+            # Drawing without a moveto starts at the current point
+            points = [current]
+
+        try:
+            match command.upper():
+                case "M":
+                    close_subpath(closed=False)
+                    current = start = Point(base.x + number(), base.y + number())
+                    points = [current]
+                    # Following coordinate pairs are lines
+                    command = "l" if relative else "L"
+                case "L":
+                    current = Point(base.x + number(), base.y + number())
+                    points.append(current)
+                case "H":
+                    current = Point(base.x + number(), current.y)
+                    points.append(current)
+                case "V":
+                    current = Point(current.x, base.y + number())
+                    points.append(current)
+                case "C":
+                    c1 = Point(base.x + number(), base.y + number())
+                    c2 = Point(base.x + number(), base.y + number())
+                    end = Point(base.x + number(), base.y + number())
+                    points.extend(_cubic(current, c1, c2, end))
+                    next_control, current = c2, end
+                case "S":
+                    c1 = (
+                        Point(
+                            2 * current.x - last_control.x,
+                            2 * current.y - last_control.y,
+                        )
+                        if last_control is not None and last_command in "CcSs"
+                        else current
+                    )
+                    c2 = Point(base.x + number(), base.y + number())
+                    end = Point(base.x + number(), base.y + number())
+                    points.extend(_cubic(current, c1, c2, end))
+                    next_control, current = c2, end
+                case "Q":
+                    c1 = Point(base.x + number(), base.y + number())
+                    end = Point(base.x + number(), base.y + number())
+                    points.extend(_quadratic(current, c1, end))
+                    next_control, current = c1, end
+                case "T":
+                    c1 = (
+                        Point(
+                            2 * current.x - last_control.x,
+                            2 * current.y - last_control.y,
+                        )
+                        if last_control is not None and last_command in "QqTt"
+                        else current
+                    )
+                    end = Point(base.x + number(), base.y + number())
+                    points.extend(_quadratic(current, c1, end))
+                    next_control, current = c1, end
+                case "A":
+                    rx, ry, rotation = number(), number(), number()
+                    large_arc, sweep = flag(), flag()
+                    end = Point(base.x + number(), base.y + number())
+                    points.extend(
+                        _arc(current, rx, ry, rotation, large_arc, sweep, end)
+                    )
+                    current = end
+        except (IndexError, ValueError):
+            LOGGER.warning("Invalid path data: %s", data)
+            break
+
+        last_control = next_control
+        last_command = command
+
+    close_subpath(closed=False)
+    return subpaths
+
+
+def _points_attribute(text: str) -> list[Point]:
+    values = [float(value) for value in NUMBER_RE.findall(text)]
+    return list(starmap(Point, zip(values[::2], values[1::2], strict=False)))
+
+
+def _length(element: etree._Element, name: str) -> float:
+    value = NUMBER_RE.match(element.get(name, "0").strip())
+    return float(value.group()) if value else 0.0
+
+
+def element_subpaths(element: etree._Element, tag: str) -> list[Subpath]:  # noqa: PLR0911
+    """Get the flattened geometry of a shape element."""
+    match tag:
+        case "path":
+            return parse_path(element.get("d", ""))
+        case "line":
+            return [
+                Subpath(
+                    [
+                        Point(_length(element, "x1"), _length(element, "y1")),
+                        Point(_length(element, "x2"), _length(element, "y2")),
+                    ],
+                    closed=False,
+                )
+            ]
+        case "polyline" | "polygon":
+            points = _points_attribute(element.get("points", ""))
+            if not points:
+                return []
+            return [Subpath(points, closed=tag == "polygon")]
+        case "circle" | "ellipse":
+            center = Point(_length(element, "cx"), _length(element, "cy"))
+            if tag == "circle":
+                rx = ry = _length(element, "r")
+            else:
+                rx, ry = _length(element, "rx"), _length(element, "ry")
+            if rx <= 0 or ry <= 0:
+                return []
+            return [
+                Subpath(_ellipse_arc(center, rx, ry, 0, 0, 2 * math.pi), closed=True)
+            ]
+        case "rect":
+            x, y = _length(element, "x"), _length(element, "y")
+            width, height = _length(element, "width"), _length(element, "height")
+            if width <= 0 or height <= 0:
+                return []
+            rx, ry = _length(element, "rx"), _length(element, "ry")
+            rx, ry = rx or ry, ry or rx
+            rx, ry = min(rx, width / 2), min(ry, height / 2)
+            if rx <= 0:
+                return [
+                    Subpath(
+                        [
+                            Point(x, y),
+                            Point(x + width, y),
+                            Point(x + width, y + height),
+                            Point(x, y + height),
+                        ],
+                        closed=True,
+                    )
+                ]
+            return parse_path(
+                f"M{x + rx},{y}H{x + width - rx}A{rx},{ry} 0 0 1 {x + width},{y + ry}"
+                f"V{y + height - ry}A{rx},{ry} 0 0 1 {x + width - rx},{y + height}"
+                f"H{x + rx}A{rx},{ry} 0 0 1 {x},{y + height - ry}"
+                f"V{y + ry}A{rx},{ry} 0 0 1 {x + rx},{y}Z"
+            )
+    return []
+
+
+class Stroke(NamedTuple):
+    """The stroke properties of a shape."""
+
+    width: float
+    linecap: str
+    linejoin: str
+    miterlimit: float
+
+
+def _signed_area(points: list[Point]) -> float:
+    return sum(
+        p0.x * p1.y - p1.x * p0.y
+        for p0, p1 in zip(points, points[1:] + points[:1], strict=True)
+    )
+
+
+def _fmt(value: float) -> str:
+    """Format a coordinate with two decimals, as short as possible."""
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    if text in {"-0", ""}:
+        return "0"
+    return text.replace("0.", ".", 1) if text.startswith(("0.", "-0.")) else text
+
+
+def _coordinates(points: list[Point]) -> str:
+    """Format points for path data, the minus sign doubles as separator."""
+    text = ""
+    for point in points:
+        for value in (_fmt(point.x), _fmt(point.y)):
+            text += value if not text or value[0] == "-" else f" {value}"
+    return text
+
+
+class _Outline:
+    """Collect outlines as path data, all drawn with a positive orientation."""
+
+    def __init__(self) -> None:
+        self.parts: list[str] = []
+
+    def polygon(self, points: list[Point]) -> None:
+        area = _signed_area(points)
+        if abs(area) < 1e-9:
+            return
+        if area < 0:
+            points.reverse()
+        # Following coordinate pairs after a moveto are lines
+        self.parts.append(f"M{_coordinates(points)}Z")
+
+    def disc(self, center: Point, radius: float) -> None:
+        start = Point(center.x + radius, center.y)
+        opposite = Point(center.x - radius, center.y)
+        r = _fmt(radius)
+        self.parts.append(
+            f"M{_coordinates([start])}A{r} {r} 0 1 1 {_coordinates([opposite])}"
+            f"A{r} {r} 0 1 1 {_coordinates([start])}Z"
+        )
+
+    def wedge(self, center: Point, p0: Point, p1: Point, radius: float) -> None:
+        """Add the circle sector between two points on a circle."""
+        cross = (p0.x - center.x) * (p1.y - center.y) - (p0.y - center.y) * (
+            p1.x - center.x
+        )
+        if abs(cross) < 1e-9:
+            return
+        if cross < 0:
+            p0, p1 = p1, p0
+        r = _fmt(radius)
+        self.parts.append(
+            f"M{_coordinates([center, p0])}A{r} {r} 0 0 1 {_coordinates([p1])}Z"
+        )
+
+    def data(self) -> str:
+        return "".join(self.parts)
+
+
+def _unit_normal(p0: Point, p1: Point) -> Point:
+    length = math.hypot(p1.x - p0.x, p1.y - p0.y)
+    return Point(-(p1.y - p0.y) / length, (p1.x - p0.x) / length)
+
+
+def _offset(point: Point, normal: Point, distance: float) -> Point:
+    return Point(point.x + normal.x * distance, point.y + normal.y * distance)
+
+
+def _join(
+    outline: _Outline, vertex: Point, n0: Point, n1: Point, stroke: Stroke
+) -> None:
+    """Add the join between two segments, on the outer side of the turn."""
+    radius = stroke.width / 2
+    turn = n0.x * n1.y - n0.y * n1.x
+    cos_angle = max(-1.0, min(1.0, n0.x * n1.x + n0.y * n1.y))
+    if abs(turn) < 1e-9 and cos_angle > 0:
+        return
+    side = -1 if turn > 0 else 1
+    a = _offset(vertex, n0, side * radius)
+    b = _offset(vertex, n1, side * radius)
+    if stroke.linejoin == "round":
+        if abs(turn) < 1e-9:
+            outline.disc(vertex, radius)
+        else:
+            outline.wedge(vertex, a, b, radius)
+        return
+
+    miter_ratio = 1 / math.sqrt((1 + cos_angle) / 2) if cos_angle > -1 else math.inf
+    if stroke.linejoin in {"miter", "miter-clip", "arcs"} and (
+        miter_ratio <= stroke.miterlimit
+    ):
+        bisector = Point(n0.x + n1.x, n0.y + n1.y)
+        length = math.hypot(*bisector)
+        miter = _offset(
+            vertex,
+            Point(bisector.x / length, bisector.y / length),
+            side * radius * miter_ratio,
+        )
+        outline.polygon([vertex, a, miter, b])
+    else:
+        outline.polygon([vertex, a, b])
+
+
+def _cap(
+    outline: _Outline, end: Point, normal: Point, stroke: Stroke, *, start: bool
+) -> None:
+    """Add the cap at the start or end of an open subpath."""
+    radius = stroke.width / 2
+    if stroke.linecap == "round":
+        outline.disc(end, radius)
+    elif stroke.linecap == "square":
+        # The direction of the segment is the normal rotated back
+        tip = _offset(end, Point(normal.y, -normal.x), -radius if start else radius)
+        outline.polygon(
+            [
+                _offset(end, normal, radius),
+                _offset(tip, normal, radius),
+                _offset(tip, normal, -radius),
+                _offset(end, normal, -radius),
+            ]
+        )
+
+
+def _run_polygon(outline: _Outline, run: list[tuple[Point, Point]]) -> None:
+    """Add the outline of a run from its left and right offset points."""
+    outline.polygon([left for left, _ in run] + [right for _, right in run[::-1]])
+
+
+def stroke_subpath(outline: _Outline, subpath: Subpath, stroke: Stroke) -> None:
+    """Add the outlines of a stroked subpath.
+
+    Runs of segments with only slight turns, like flattened curves, become one
+    polygon through the intersections of their offset lines. The other
+    segments are joined by separate join shapes.
+    """
+    radius = stroke.width / 2
+    points = [subpath.points[0]]
+    for point in subpath.points[1:]:
+        if math.hypot(point.x - points[-1].x, point.y - points[-1].y) > 1e-9:
+            points.append(point)
+    closed = subpath.closed and len(points) > 2
+    if closed and points[0] == points[-1]:
+        points.pop()
+
+    if len(points) == 1:
+        # Zero length subpaths only show their caps
+        if stroke.linecap != "butt":
+            _cap(outline, points[0], Point(0, 1), stroke, start=True)
+            _cap(outline, points[0], Point(0, 1), stroke, start=False)
+        return
+
+    starts = points if closed else points[:-1]
+    segments = list(zip(starts, points[1:] + points[:1], strict=False))
+    normals = list(starmap(_unit_normal, segments))
+    lengths = [math.hypot(p1.x - p0.x, p1.y - p0.y) for p0, p1 in segments]
+
+    # The offset lines are joined by their intersection if it doesn't move the
+    # outer side further than the tolerance and stays within both segments.
+    min_cos_half = radius / (radius + TOLERANCE)
+    run: list[tuple[Point, Point]] = []
+    for index, p0 in enumerate(starts):
+        normal = normals[index]
+        if index > 0:
+            previous = normals[index - 1]
+            bisector = Point(previous.x + normal.x, previous.y + normal.y)
+            cos_half = math.hypot(*bisector) / 2
+            if (
+                cos_half >= min_cos_half
+                and radius * math.sqrt(max(0.0, 1 - cos_half**2)) / cos_half
+                < min(lengths[index - 1], lengths[index]) / 2
+            ):
+                factor = radius / (2 * cos_half**2)
+                run.append(
+                    (_offset(p0, bisector, factor), _offset(p0, bisector, -factor))
+                )
+            else:
+                run.append(
+                    (_offset(p0, previous, radius), _offset(p0, previous, -radius))
+                )
+                _run_polygon(outline, run)
+                _join(outline, p0, previous, normal, stroke)
+                run = []
+        if not run:
+            run.append((_offset(p0, normal, radius), _offset(p0, normal, -radius)))
+    end = segments[-1][1]
+    run.append((_offset(end, normals[-1], radius), _offset(end, normals[-1], -radius)))
+    _run_polygon(outline, run)
+
+    if closed:
+        _join(outline, points[0], normals[-1], normals[0], stroke)
+    else:
+        _cap(outline, points[0], normals[0], stroke, start=True)
+        _cap(outline, points[-1], normals[-1], stroke, start=False)
+
+
+def _computed_style(
+    element: etree._Element, tag: str, parent_style: Style, rules: list[CssRule]
+) -> Style:
+    """Compute the style of an element from its parent, the CSS and attributes."""
+    style = {
+        name: value
+        for name, value in parent_style.items()
+        if name in INHERITED_PROPERTIES
+    }
+    # Presentation attributes have the lowest precedence
+    for name in DEFAULT_STYLE:
+        if (value := element.get(name)) is not None:
+            style[name] = value
+    if (value := element.get("display")) is not None:
+        style["display"] = value
+    classes = set(element.get("class", "").split())
+    for _, selector, declarations in rules:
+        if _matches(selector, tag, classes):
+            style.update(declarations)
+    style.update(_parse_declarations(element.get("style", "")))
+    return style
+
+
+def _paint(value: str) -> str | None:
+    """Get the color of a paint value, None if it isn't painted."""
+    if value in {"none", "transparent"} or value.startswith("url("):
+        return None
+    return value
+
+
+SHAPES = {"path", "line", "polyline", "polygon", "circle", "ellipse", "rect"}
+
+
+class _Converter:
+    """Build an SVG with the filled outlines of the shapes of an icon.
+
+    Consecutive stroke outlines with the same color are merged into one path.
+    Fills keep their own path, their direction may differ from the outlines.
+    """
+
+    def __init__(self, svg_root: etree._Element) -> None:
+        self.rules = [
+            rule
+            for style_tag in svg_root.iter(f"{{{SVG_NS}}}style")
+            for rule in parse_css(style_tag.text or "")
+        ]
+        self.output = etree.Element(f"{{{SVG_NS}}}svg", nsmap={None: SVG_NS})
+        for attribute in ("width", "height", "viewBox"):
+            if (value := svg_root.get(attribute)) is not None:
+                self.output.set(attribute, value)
+        self.stroke_color: str | None = None
+        self.stroke_outline = _Outline()
+
+    def add_stroke(self, outline: _Outline, color: str) -> None:
+        if not outline.parts:
+            return
+        if self.stroke_color == color:
+            self.stroke_outline.parts.extend(outline.parts)
+            return
+        self.flush()
+        self.stroke_color, self.stroke_outline = color, outline
+
+    def add_fill(self, outline: _Outline, color: str, fill_rule: str) -> None:
+        if not outline.parts:
+            return
+        self.flush()
+        path = etree.SubElement(self.output, f"{{{SVG_NS}}}path", d=outline.data())
+        path.set("fill", color)
+        if fill_rule != "nonzero":
+            path.set("fill-rule", fill_rule)
+
+    def flush(self) -> None:
+        if self.stroke_color is None:
+            return
+        path = etree.SubElement(
+            self.output, f"{{{SVG_NS}}}path", d=self.stroke_outline.data()
+        )
+        path.set("fill", self.stroke_color)
+        self.stroke_color = None
+
+    def walk(
+        self, element: etree._Element, parent_style: Style, matrix: Matrix
+    ) -> None:
+        if not isinstance(element.tag, str):
+            return
+        tag = etree.QName(element).localname
+        if tag in NON_RENDERED:
+            return
+        style = _computed_style(element, tag, parent_style, self.rules)
+        if style.get("display") == "none":
+            return
+        matrix = matrix.multiply(parse_transform(element.get("transform")))
+
+        if tag in {"svg", "g", "a"}:
+            for child in element:
+                self.walk(child, style, matrix)
+        elif tag not in SHAPES:
+            LOGGER.warning("Unsupported element <%s> is not converted", tag)
+        elif style["visibility"] == "visible":
+            self.shape(element, tag, style, matrix)
+
+    def shape(
+        self, element: etree._Element, tag: str, style: Style, matrix: Matrix
+    ) -> None:
+        subpaths = [
+            Subpath([matrix.apply(point) for point in subpath.points], subpath.closed)
+            for subpath in element_subpaths(element, tag)
+        ]
+
+        if (fill := _paint(style["fill"])) is not None and tag != "line":
+            outline = _Outline()
+            for subpath in subpaths:
+                if len(subpath.points) > 2:
+                    outline.parts.append(f"M{_coordinates(subpath.points)}Z")
+            self.add_fill(outline, fill, style["fill-rule"])
+
+        if (stroke := _paint(style["stroke"])) is not None:
+            number = NUMBER_RE.match(style["stroke-width"])
+            width = (float(number.group()) if number else 1.0) * matrix.scale()
+            if width <= 0:
+                return
+            number = NUMBER_RE.match(style["stroke-miterlimit"])
+            stroke_properties = Stroke(
+                width,
+                style["stroke-linecap"],
+                style["stroke-linejoin"],
+                float(number.group()) if number else 4.0,
+            )
+            outline = _Outline()
+            for subpath in subpaths:
+                stroke_subpath(outline, subpath, stroke_properties)
+            self.add_stroke(outline, stroke)
+
+
+def convert(svg_file: etree._ElementTree) -> bytes:
+    """Convert an icon to an SVG containing only filled paths."""
+    converter = _Converter(svg_file.getroot())
+    converter.walk(svg_file.getroot(), DEFAULT_STYLE, Matrix())
+    converter.flush()
+    return etree.tostring(converter.output, xml_declaration=True, encoding="UTF-8")
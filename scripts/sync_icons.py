@@ -2,36 +2,72 @@
 """Synchronize icons between black and white."""
 
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from pathlib import Path
+import re
 import sys
 from typing import Literal
 
 LOGGER = logging.getLogger("sync_icons")
 
+type Style = Literal["black", "white"]
+
+# The colors of each style and the color they have in the other style
+_COLORS: dict[Style, dict[str, str]] = {
+    "black": {"#000": "#fff", "#000000": "#ffffff"},
+    "white": {
+        "#fff": "#000",
+        "#ffffff": "#000000",
+        "#FFF": "#000",
+        "#FFFFFF": "#000000",
+    },
+}
+# The colors are only replaced as a whole, so #000 isn't replaced in #000000
+_COLOR_PATTERNS = {
+    style: re.compile(
+        "|".join(re.escape(color) for color in sorted(colors, key=len, reverse=True))
+        + "(?![0-9a-fA-F])"
+    )
+    for style, colors in _COLORS.items()
+}
+_ANY_COLOR = re.compile(r"#(?:000(?:000)?|fff(?:fff)?)(?![0-9a-fA-F])", re.IGNORECASE)
+
+
+def recolor(text: str, src_style: Style) -> str:
+    """Replace the colors of an icon with the colors of the other style."""
+    colors = _COLORS[src_style]
+    return _COLOR_PATTERNS[src_style].sub(lambda match: colors[match[0]], text)
 
-def copy_file(src: Path, dest: Path, src_style: Literal["black", "white"]) -> None:
+
+def copy_file(src: Path, dest: Path, src_style: Style) -> None:
     """Copy a file and adjust the colors."""
+    dest.write_text(recolor(src.read_text(encoding="utf8"), src_style), encoding="utf8")
+
 
-    match src_style:
-        case "black":
-            replace_str = {("#000", "#fff"), ("#000000", "#ffffff")}
-        case "white":
-            replace_str = {
-                ("#fff", "#000"),
-                ("#ffffff", "#000000"),
-                ("#FFF", "#000"),
-                ("#FFFFFF", "#000000"),
-            }
-    with src.open("r") as src_fd, dest.open("w") as dest_fd:
-        src_text = src_fd.read()
-        for pattern in replace_str:
-            src_text = src_text.replace(pattern[0], pattern[1])
-        dest_fd.write(src_text)
-
-
-def main(folder: Path, *, fix: bool = False) -> bool:
-    """Check if icons are in both black and white folders."""
+def _drifted(black_file: Path, white_file: Path) -> bool:
+    """Check if an icon differs between the styles in more than its colors."""
+    black_text = black_file.read_text(encoding="utf8")
+    white_text = white_file.read_text(encoding="utf8")
+    return _ANY_COLOR.sub("#color", black_text) != _ANY_COLOR.sub("#color", white_text)
+
+
+def main(
+    folder: Path,
+    *,
+    fix: bool = False,
+    content: bool = False,
+    prefer: Style | None = None,
+    jobs: int = 0,
+) -> bool:
+    """Check if icons are in both black and white folders.
+
+    With ``content`` the icons in both folders are compared too, after their
+    colors are normalized. Icons which differ are copied from the ``prefer``
+    style when fixing, they are only reported without it. The files are read
+    and written in a thread pool with ``jobs`` threads, with 0 the
+    pool picks it from the number of CPUs.
+    """
 
     valid = True
     if not (folder / "white").is_dir():
@@ -58,11 +94,52 @@ def main(folder: Path, *, fix: bool = False) -> bool:
         )
         valid = False
 
-    if fix:
-        for file in white_not_black:
-            copy_file(folder / "white" / file, folder / "black" / file, "white")
-        for file in black_not_white:
-            copy_file(folder / "black" / file, folder / "white" / file, "black")
+    drifted: list[str] = []
+    if content:
+        both = sorted(files_black & files_white)
+        with ThreadPoolExecutor(max_workers=jobs or None) as executor:
+            drifted = [
+                file
+                for file, differs in zip(
+                    both,
+                    executor.map(
+                        _drifted,
+                        [folder / "black" / file for file in both],
+                        [folder / "white" / file for file in both],
+                    ),
+                    strict=True,
+                )
+                if differs
+            ]
+    if drifted:
+        LOGGER.error(
+            "The following files differ between 'black' and 'white': %s",
+            drifted,
+        )
+        valid = False
+
+    if not fix:
+        return valid
+    copies: list[tuple[Path, Path, Style]] = [
+        (folder / "white" / file, folder / "black" / file, "white")
+        for file in white_not_black
+    ]
+    copies += [
+        (folder / "black" / file, folder / "white" / file, "black")
+        for file in black_not_white
+    ]
+    if drifted and prefer is None:
+        LOGGER.warning(
+            "Not fixing the files which differ, choose a style with --prefer."
+        )
+    elif prefer is not None:
+        other = "white" if prefer == "black" else "black"
+        copies += [
+            (folder / prefer / file, folder / other / file, prefer) for file in drifted
+        ]
+    if copies:
+        with ThreadPoolExecutor(max_workers=jobs or None) as executor:
+            _ = list(executor.map(lambda copy: copy_file(*copy), copies))
 
     return valid
 
@@ -74,6 +151,26 @@ if __name__ == "__main__":
     parser.add_argument(
         "--fix", help="Fixes the mapping file.", action="store_true", default=False
     )
+    parser.add_argument(
+        "--content",
+        help="Also check if the icons in both folders differ in more than their "
+        "colors.",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--prefer",
+        help="The style to copy the icons which differ from when fixing.",
+        choices=["black", "white"],
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of files to read and write in parallel, 0 picks it from the "
+        "number of CPUs.",
+        type=int,
+        default=0,
+    )
     parser.add_argument(
         "folder",
         help="Folder where the 'black' and 'white' folders are to check",
@@ -81,5 +178,11 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    if not main(args.folder, fix=args.fix):
+    if not main(
+        args.folder,
+        fix=args.fix,
+        content=args.content,
+        prefer=args.prefer,
+        jobs=args.jobs,
+    ):
         sys.exit(1)
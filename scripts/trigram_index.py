@@ -0,0 +1,138 @@
+"""A trigram index for ranked fuzzy searches."""
+
+from __future__ import annotations
+
+from collections import Counter
+import heapq
+import logging
+import marshal
+import math
+import os
+from pathlib import Path
+import re
+import tempfile
+from typing import Any
+
+LOGGER = logging.getLogger("trigram_index")
+
+INDEX_VERSION = 2
+
+# Documents which share less of the query trigrams aren't candidates
+MIN_COVERAGE = 0.3
+
+# The weight of the query coverage in the score, the rest is the similarity
+COVERAGE_WEIGHT = 0.75
+
+_CAMEL_CASE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def trigrams(text: str) -> set[str]:
+    """Get the trigrams of the words of a text.
+
+    Reverse DNS names, snake case and camel case are split into words. The
+    words are padded, like in PostgreSQL's pg_trgm, so the trigrams at the
+    start of a word are weighted more.
+    """
+    words = _SEPARATORS.sub(" ", _CAMEL_CASE.sub(" ", text)).lower().split()
+    return {
+        f"  {word} "[index : index + 3]
+        for word in words
+        for index in range(len(word) + 1)
+    }
+
+
+class TrigramIndex:
+    """An inverted index from trigrams to the documents containing them.
+
+    A search only looks at the documents which share a trigram with the query,
+    so it doesn't slow down linearly with the number of documents.
+    """
+
+    def __init__(self, documents: list[str], payload: Any = None) -> None:  # noqa: ANN401
+        """Index the documents, they are referred to by their position.
+
+        The ``payload`` is saved with the index, like what the documents belong
+        to. It must be supported by marshal.
+        """
+        self.documents = documents
+        self.payload = payload
+        self.sizes: list[int] = []
+        postings: dict[str, list[int]] = {}
+        for document_id, document in enumerate(documents):
+            document_trigrams = trigrams(document)
+            self.sizes.append(len(document_trigrams))
+            for trigram in document_trigrams:
+                postings.setdefault(trigram, []).append(document_id)
+        self.postings = postings
+
+    def search(self, query: str, top: int) -> list[tuple[int, float]]:
+        """Get the ``top`` documents which match the query best, with their score.
+
+        The score is between 0 and 1. It mostly rewards the share of the query
+        trigrams found in a document, so a query matches long names like
+        org.gnome.Settings as well. The Dice similarity breaks the ties in favor
+        of shorter documents.
+        """
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        counts: Counter[int] = Counter()
+        for trigram in query_trigrams:
+            counts.update(self.postings.get(trigram, ()))
+
+        minimum = math.ceil(len(query_trigrams) * MIN_COVERAGE)
+        scores = (
+            (
+                document_id,
+                COVERAGE_WEIGHT * common / len(query_trigrams)
+                + (1 - COVERAGE_WEIGHT)
+                * 2
+                * common
+                / (len(query_trigrams) + self.sizes[document_id]),
+            )
+            for document_id, common in counts.items()
+            if common >= minimum
+        )
+        return heapq.nlargest(top, scores, key=lambda item: (item[1], -item[0]))
+
+    @classmethod
+    def load(cls, index_file: Path, fingerprint: str) -> TrigramIndex | None:
+        """Load a saved index, None if it was built from other documents."""
+        try:
+            data = marshal.loads(index_file.read_bytes())  # noqa: S302
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != INDEX_VERSION
+            or data.get("fingerprint") != fingerprint
+        ):
+            return None
+        index = cls([])
+        index.documents = data["documents"]
+        index.payload = data["payload"]
+        index.sizes = data["sizes"]
+        index.postings = data["postings"]
+        return index
+
+    def save(self, index_file: Path, fingerprint: str) -> None:
+        """Save the index, with the fingerprint of its documents."""
+        try:
+            index_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=index_file.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as tmp_file:
+                marshal.dump(
+                    {
+                        "version": INDEX_VERSION,
+                        "fingerprint": fingerprint,
+                        "documents": self.documents,
+                        "payload": self.payload,
+                        "sizes": self.sizes,
+                        "postings": self.postings,
+                    },
+                    tmp_file,
+                )
+            Path(tmp_name).replace(index_file)
+        except OSError as err:
+            LOGGER.warning("Couldn't save the trigram index: %s", err)
@@ -1,81 +1,321 @@
 #!/usr/bin/python3
 """Validate the mapping file."""
 
+from __future__ import annotations
+
 from argparse import ArgumentParser
+from itertools import pairwise
 import logging
+import os
 from pathlib import Path
+import re
+import shutil
 import sys
+import tempfile
+from typing import TYPE_CHECKING, NamedTuple
 
+from icon_mapping import YAML_LOADER
 import yaml
 
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
 LOGGER = logging.getLogger("validate_mapping")
 
+# The usual layout of the mapping file, lines with a key, a value or a comment
+_LAYOUT = re.compile(r"(?:(?:[\w.][\w.+@-]*:|- [\w.][\w.+@/-]*|#.*|)(?:\n|\Z))*")
 
-def validate_mapping(file: Path, *, fix: bool = False) -> bool:
-    """Validate the mapping file."""
-    valid = True
 
+class MappingStructureError(yaml.MarkedYAMLError):
+    """The mapping file isn't a mapping of keys to lists of values."""
+
+    def __init__(self, problem: str, event: yaml.Event) -> None:
+        """Initialize the error, it points to the start of the event."""
+        super().__init__(problem=problem, problem_mark=event.start_mark)
+
+
+class _Value(NamedTuple):
+    """A value of an entry and the lines it is written on, starting at 1."""
+
+    value: str
+    line: int
+    end_line: int
+
+
+class _Entry(NamedTuple):
+    """An entry of the mapping file and the line of its key, starting at 1."""
+
+    key: str
+    line: int
+    dests: list[_Value]
+    # The values are written like [a, b] instead of one per line
+    flow: bool
+
+
+def _scan_entries(text: str, lines: list[str]) -> list[_Entry] | None:
+    """Read the entries of a mapping file in the layout the fix writes.
+
+    A key or value is only read like this if it is a plain YAML scalar, which
+    is the same text as its value. None if any line doesn't fit the layout.
+    """
+    if not _LAYOUT.fullmatch(text):
+        return None
+    entries: list[_Entry] = []
+    dests: list[_Value] | None = None
+    for number, line in enumerate(lines, 1):
+        if line.startswith("- "):
+            if dests is None:
+                return None
+            dests.append(_Value(line[2:], number, number))
+        elif line and line[0] != "#":
+            dests = []
+            entries.append(_Entry(line[:-1], number, dests, flow=False))
+    if not all(entry.dests for entry in entries):
+        # Keys without values aren't lists
+        return None
+    return entries
+
+
+def _read_entries(file: Path) -> Iterator[_Entry]:
+    """Stream the entries of the mapping file with their line numbers.
+
+    The file is read as YAML events, so the keys are seen in the order of the
+    file and duplicate keys aren't merged. Raises a YAMLError if the file isn't
+    valid YAML, or a MappingStructureError if it isn't a mapping of keys to
+    lists of values.
+    """
     with file.open(encoding="utf8") as yaml_fp:
-        yaml_doc: dict[str, list[str]] = yaml.safe_load(yaml_fp)
-
-        yaml_fp.seek(0, 0)
-        yaml_lines = yaml_fp.readlines()
-        map_keys = [
-            line.rstrip().removesuffix(":")
-            for line in yaml_lines
-            if line.rstrip().endswith(":")
-        ]
-
-        keys_seen = set()
-        keys_dupes = [x for x in map_keys if x in keys_seen or keys_seen.add(x)]
-        if len(keys_dupes) > 0:
-            LOGGER.error("The following keys are duplicated: %s", keys_dupes)
-            return False
-
-    if sorted(yaml_doc.keys()) != list(yaml_doc.keys()):
-        LOGGER.error("Keys are not sorted!")
-        if not fix:
-            return False
-
-    for entry, values in yaml_doc.items():
-        values_seen = set()
-        values_dupes = [x for x in values if x in values_seen or values_seen.add(x)]
-        if len(values_dupes) > 0:
-            LOGGER.error(
-                "The entry '%s' has these duplicate values: %s", entry, values_dupes
+        yield from _read_events(yaml.parse(yaml_fp, Loader=YAML_LOADER))
+
+
+def _read_events(events: Iterator[yaml.Event]) -> Iterator[_Entry]:
+    for event in events:
+        if isinstance(event, yaml.MappingStartEvent):
+            break
+        if isinstance(event, yaml.StreamEndEvent):
+            # An empty file
+            return
+        if not isinstance(event, yaml.StreamStartEvent | yaml.DocumentStartEvent):
+            msg = "The mapping file isn't a mapping"
+            raise MappingStructureError(msg, event)
+
+    for event in events:
+        if isinstance(event, yaml.MappingEndEvent):
+            return
+        if not isinstance(event, yaml.ScalarEvent):
+            msg = "The keys must be strings"
+            raise MappingStructureError(msg, event)
+        key = event.value
+        key_line = event.start_mark.line + 1
+
+        values_start = next(events)
+        if not isinstance(values_start, yaml.SequenceStartEvent):
+            msg = f"The entry '{key}' isn't a list"
+            raise MappingStructureError(msg, values_start)
+        values: list[_Value] = []
+        for value_event in events:
+            if isinstance(value_event, yaml.SequenceEndEvent):
+                break
+            if not isinstance(value_event, yaml.ScalarEvent):
+                msg = f"The values of the entry '{key}' must be strings"
+                raise MappingStructureError(msg, value_event)
+            values.append(
+                _Value(
+                    value_event.value,
+                    value_event.start_mark.line + 1,
+                    value_event.end_mark.line + 1,
+                )
+            )
+        yield _Entry(key, key_line, values, bool(values_start.flow_style))
+
+
+class _Block(NamedTuple):
+    """The lines of an entry, split so the values can be moved between them."""
+
+    head: list[str]
+    dests: list[tuple[str, list[str]]]
+    tail: list[str]
+    flow: bool
+
+
+def _entry_block(entry: _Entry, lines: list[str], end: int) -> _Block:
+    """Split the lines of an entry, which end before the line ``end``.
+
+    Each value owns its lines and the comments up to the next value, the lines
+    after the last value stay at the end of the entry.
+    """
+    start = entry.line - 1
+    if entry.flow:
+        return _Block(
+            head=lines[start:end],
+            dests=[(value.value, []) for value in entry.dests],
+            tail=[],
+            flow=True,
+        )
+    starts = [value.line - 1 for value in entry.dests]
+    last = entry.dests[-1].end_line
+    return _Block(
+        head=lines[start : starts[0]],
+        dests=[
+            (value.value, lines[value_start:value_end])
+            for value, value_start, value_end in zip(
+                entry.dests, starts, [*starts[1:], last], strict=True
+            )
+        ],
+        tail=lines[last:end],
+        flow=False,
+    )
+
+
+def _fixed_lines(key: str, block: _Block) -> list[str]:
+    """Get the lines of an entry with sorted values without duplicates."""
+    values: dict[str, list[str]] = {}
+    for value, value_lines in block.dests:
+        _ = values.setdefault(value, value_lines)
+    if block.flow:
+        # Written again, in block style like the rest of the file
+        dumped = yaml.safe_dump({key: sorted(values)}, default_flow_style=False)
+        return dumped.removesuffix("\n").split("\n")
+    return [
+        *block.head,
+        *(line for value in sorted(values) for line in values[value]),
+        *block.tail,
+    ]
+
+
+def _fix_mapping(
+    file: Path, text: str, lines: list[str], entries: list[_Entry]
+) -> None:
+    """Sort the entries and values of the mapping file and drop duplicates.
+
+    Only the lines of the entries which aren't sorted are moved, the other
+    lines and the comments stay as they are. The entries of duplicate keys are
+    merged into the first one. The file is replaced atomically.
+    """
+    # A mapping written like {a: [b]} can't be split in lines, it's written again
+    flow_mapping = any(
+        entry.line == next_entry.line for entry, next_entry in pairwise(entries)
+    )
+
+    ends = [entry.line - 1 for entry in entries[1:]]
+    ends.append(len(lines))
+    blocks: dict[str, _Block] = {}
+    for entry, end in zip(entries, ends, strict=True):
+        block = _entry_block(entry, lines, end)
+        if entry.key in blocks:
+            first = blocks[entry.key]
+            block = first._replace(
+                dests=first.dests + block.dests, flow=first.flow or block.flow
             )
-            valid = False
+        blocks[entry.key] = block._replace(flow=block.flow or flow_mapping)
+
+    new_lines = [] if flow_mapping else lines[: entries[0].line - 1]
+    for key in sorted(blocks):
+        new_lines += _fixed_lines(key, blocks[key])
+    new_text = "\n".join(new_lines) + "\n"
+    if new_text == text:
+        return
+
+    fd, tmp_name = tempfile.mkstemp(dir=file.parent, prefix=f".{file.name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf8", newline="") as tmp_file:
+            _ = tmp_file.write(new_text)
+        shutil.copymode(file, tmp_name)
+        Path(tmp_name).replace(file)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def validate_mapping(file: Path, *, fix: bool = False) -> bool:
+    """Validate the mapping file.
 
-        if sorted(values) != values:
-            LOGGER.error("The entry '%s' has unsorted values", entry)
-            valid = False
+    The file is checked in a single pass, every problem is reported with its
+    line number. With ``fix`` everything but values in multiple keys is fixed.
+    """
+    valid = True
+    fixable = True
+    entries: list[_Entry] = []
+    key_lines: dict[str, int] = {}
+    value_keys: dict[str, _Entry] = {}
+    previous_key: str | None = None
 
-    # Check if a value is in multiple keys, with reporting the first key
-    values_seen = {}
-    for entry, values in yaml_doc.items():
-        for value in values:
-            if value in values_seen:
+    text = file.read_text(encoding="utf8")
+    lines = text.removesuffix("\n").split("\n")
+    try:
+        scanned = _scan_entries(text, lines)
+        for entry in _read_entries(file) if scanned is None else scanned:
+            if entry.key in key_lines:
                 LOGGER.error(
-                    "The value '%s' is in multiple keys: %s and %s",
-                    value,
-                    values_seen[value],
-                    entry,
+                    "%s:%d: The key '%s' is duplicated, it's first on line %d",
+                    file,
+                    entry.line,
+                    entry.key,
+                    key_lines[entry.key],
                 )
                 valid = False
-            else:
-                values_seen[value] = entry
-
-    if not fix:
-        return valid
+            elif previous_key is not None and entry.key < previous_key:
+                LOGGER.error(
+                    "%s:%d: The key '%s' isn't sorted, it comes after '%s'",
+                    file,
+                    entry.line,
+                    entry.key,
+                    previous_key,
+                )
+                valid = False
+            key_lines.setdefault(entry.key, entry.line)
+            previous_key = entry.key
+            if fix:
+                entries.append(entry)
 
-    fixed_doc = dict(sorted(yaml_doc.items()))
-    for entry, values in yaml_doc.items():
-        fixed_doc[entry] = sorted(set(values))
+            previous_value: str | None = None
+            for value, value_line, _ in entry.dests:
+                first = value_keys.get(value)
+                if first is not None and first.key == entry.key:
+                    LOGGER.error(
+                        "%s:%d: The entry '%s' has the duplicate value '%s'",
+                        file,
+                        value_line,
+                        entry.key,
+                        value,
+                    )
+                    valid = False
+                elif previous_value is not None and value < previous_value:
+                    LOGGER.error(
+                        "%s:%d: The entry '%s' has unsorted values, "
+                        "'%s' comes after '%s'",
+                        file,
+                        value_line,
+                        entry.key,
+                        value,
+                        previous_value,
+                    )
+                    valid = False
+                previous_value = value
 
-    with file.open("w", encoding="utf8") as yaml_fp:
-        yaml.safe_dump(fixed_doc, yaml_fp, default_flow_style=False)
+                # Check if a value is in multiple keys, reporting the first key
+                if first is None:
+                    value_keys[value] = entry
+                elif first.key != entry.key:
+                    LOGGER.error(
+                        "%s:%d: The value '%s' is in multiple keys: "
+                        "%s (line %d) and %s",
+                        file,
+                        value_line,
+                        value,
+                        first.key,
+                        next(dest.line for dest in first.dests if dest.value == value),
+                        entry.key,
+                    )
+                    valid = fixable = False
+    except yaml.YAMLError as err:
+        LOGGER.error("%s: %s", file, err)  # noqa: TRY400
+        return False
 
-    return True
+    if fix and not valid:
+        _fix_mapping(file, text, lines, entries)
+        return fixable
+    return valid
 
 
 if __name__ == "__main__":